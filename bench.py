@@ -0,0 +1,689 @@
+"""
+Офлайн-бенчмарки бота: реальные роутеры из main.py гоняются через Dispatcher,
+вместо сети — FakeSession, которая только записывает вызовы API.
+БД — временный SQLite, реальный токен не нужен. Для каждого сценария —
+пропускная способность, p50/p99 задержки и пиковый RSS процесса.
+
+    python bench.py all                      # все сценарии, каждый в своём процессе
+    python bench.py start --n 10000          # /start от 10k пользователей
+    python bench.py funnel                   # воронка записи: услуга → «мастер одобрил» → дата
+    python bench.py reviews                  # листание отзывов
+    python bench.py broadcast --n 50000      # рассылка по базе
+    python bench.py reminders                # шторм напоминаний
+    python bench.py updates --no-gate        # порядок апдейтов без ChatOrderMiddleware
+    python bench.py routing                  # цена маршрутизации кнопки: 10/100/1000 хэндлеров
+    python bench.py keyboards                # CPU на нажатие: готовые клавиатуры против сборки
+    python bench.py parse                    # разборов дат/с: без кэша и из lru_cache
+    python bench.py pool                     # запросов/с: пул соединений против соединения на запрос
+    python bench.py scale                    # db_* и админ-экраны на 1M/500k/100k строк
+"""
+
+import argparse, asyncio, itertools, logging, os, random, resource, subprocess, sys, tempfile, time
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+import main
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  ОКРУЖЕНИЕ
+# ══════════════════════════════════════════════════════════════════════════════
+
+class FakeSession(BaseSession):
+    """
+    Сессия aiogram без сети: запоминает вызовы, отвечает правдоподобными объектами.
+    delay — средняя задержка ответа API (равномерно от 0 до 2·delay).
+    """
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.delay = delay
+        self.calls: list = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.delay:
+            await asyncio.sleep(random.uniform(0, 2 * self.delay))
+        self.calls.append(method)
+        if method.__returning__ is Message:
+            chat_id = getattr(method, "chat_id", None) or 1
+            return Message(message_id=1, date=datetime.now(),
+                           chat=Chat(id=chat_id, type="private"), text=getattr(method, "text", None))
+        if method.__returning__ is User:
+            return User(id=42, is_bot=True, first_name="bench", username="bench_bot")
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+    def count(self, name: str) -> int:
+        return sum(type(c).__name__ == name for c in self.calls)
+
+_ids = itertools.count(1)
+
+def msg_update(uid: int, text: str) -> Update:
+    return Update(update_id=next(_ids), message=Message(
+        message_id=next(_ids), date=datetime.now(), text=text,
+        chat=Chat(id=uid, type="private"),
+        from_user=User(id=uid, is_bot=False, first_name=f"U{uid}", username=f"u{uid}"),
+    ))
+
+def cb_update(uid: int, data: str) -> Update:
+    return Update(update_id=next(_ids), callback_query=CallbackQuery(
+        id=str(next(_ids)), chat_instance="bench", data=data,
+        from_user=User(id=uid, is_bot=False, first_name=f"U{uid}"),
+        message=Message(message_id=1, date=datetime.now(), chat=Chat(id=uid, type="private"), text="x"),
+    ))
+
+_background: list[asyncio.Task] = []
+
+async def make_env(api_delay: float = 0.0, gate: bool = True, limit: int = main.UPDATE_CONCURRENCY,
+                   rate: float = main.TG_GLOBAL_RATE, chat_interval: float = 0.0, db_path: str | None = None):
+    """
+    БД (по умолчанию временная), пул, FSM-хранилище, Dispatcher со всеми
+    роутерами бота и лидер с фоновыми задачами — уведомления, напоминания
+    и рассылки уходят так же, как в проде.
+    """
+    main.DB_PATH     = db_path or os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    main.POOL        = main.SQLitePool(main.DB_PATH)
+    main.USER_BUFFER = main.UserUpsertBuffer(main.POOL)
+    main.REMINDERS   = main.ReminderScheduler()
+    main.OUTBOX      = main.Outbox()
+    main.LEADER      = main.LeaderLease()
+    main.TG_LIMITER  = main.RateLimiter(rate, chat_interval)
+    await main.POOL.open()
+    await main.init_db()
+    main.warm_keyboards()
+    storage = main.SQLiteFSMStorage(main.POOL)
+    await storage.init()
+
+    session = FakeSession(api_delay)
+    bot = Bot(token="1:bench", session=session)
+    dp  = Dispatcher(storage=storage)
+    for r in (main.callback_router, main.auth_router, main.common_router, main.review_router,
+              main.booking_router, main.admin_fsm_router):
+        dp.include_router(r)
+    if gate:
+        main.UPDATE_GATE = main.ChatOrderMiddleware(limit)
+        main.install_update_gate(dp)
+    _background.append(asyncio.create_task(main.LEADER.run(bot)))
+    while not main.LEADER.is_leader:
+        await asyncio.sleep(0.01)
+    return bot, dp, session
+
+async def drain_outbox(expected: int, timeout: float = 600.0):
+    """Ждёт, пока Outbox обработает expected сообщений (доставит или откажется)."""
+    deadline = time.monotonic() + timeout
+    while main.OUTBOX.sent + main.OUTBOX.failed + main.OUTBOX.blocked < expected:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"outbox: обработано {main.OUTBOX.sent} из {expected}")
+        await asyncio.sleep(0.05)
+
+async def close_env(dp: Dispatcher):
+    for task in _background:
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    _background.clear()
+    await dp.storage.close()
+    await main.USER_BUFFER.close()
+    await main.POOL.close()
+
+async def feed(dp: Dispatcher, bot: Bot, update: Update, latency: list[float]):
+    t = time.perf_counter()
+    await dp.feed_update(bot, update)
+    latency.append(time.perf_counter() - t)
+
+def pct(values: list[float], q: float) -> float:
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * q))] if s else 0.0
+
+def report(name: str, count: int, elapsed: float, latency: list[float] | None = None, **extra):
+    print(f"── {name}")
+    print(f"  операций:   {count} за {elapsed:.2f} с, {count / elapsed:.0f}/с")
+    if latency:
+        print(f"  задержка:   p50 {pct(latency, .5) * 1000:.1f} мс, p99 {pct(latency, .99) * 1000:.1f} мс")
+    for key, value in extra.items():
+        print(f"  {key + ':':11s} {value}")
+    # ru_maxrss в Linux — в килобайтах
+    print(f"  пик RSS:    {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  СЦЕНАРИИ
+# ══════════════════════════════════════════════════════════════════════════════
+
+async def scenario_start(args):
+    """Приток по рекламной ссылке: N разных пользователей жмут /start одновременно."""
+    n = args.n or 10_000
+    bot, dp, session = await make_env(args.api_delay, limit=args.limit, rate=args.rate)
+    latency: list[float] = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(feed(dp, bot, msg_update(100_000 + i, "/start"), latency) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    users = await main.db_count_users()
+    report(f"start: {n} × /start", n, elapsed, latency, **{"в БД": f"{users} пользователей"})
+    await close_env(dp)
+
+async def scenario_funnel(args):
+    """Воронка записи: /start → услуги → услуга → «мастер одобрил» → дата текстом."""
+    n = args.n or 2_000
+    bot, dp, session = await make_env(args.api_delay, limit=args.limit, rate=args.rate)
+    dates = ["15.01 14:00", "завтра в 10", "в пятницу в 7 вечера", "20 марта", "когда будет окно"]
+    latency: list[float] = []
+
+    async def client(uid: int):
+        svc = random.randrange(len(main.SERVICES))
+        for u in (msg_update(uid, "/start"), cb_update(uid, "book_start"), cb_update(uid, f"svc:{svc}"),
+                  cb_update(uid, f"booking_approved:{svc}"), msg_update(uid, random.choice(dates))):
+            await feed(dp, bot, u, latency)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(200_000 + i) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    pending = await main.db_count_pending_bookings()
+    await drain_outbox(n)
+    lag = main.OUTBOX.lag_stats()
+    report(f"funnel: {n} клиентов × 5 шагов", len(latency), elapsed, latency,
+           **{"заявок": pending,
+              "админу": f"{main.OUTBOX.sent} уведомл., от заявки до доставки p50 {lag['p50']:.2f} с, "
+                        f"max {lag['max']:.2f} с"})
+    await close_env(dp)
+
+async def scenario_reviews(args):
+    """Листание одобренных отзывов: каждый клиент открывает ленту и идёт на pages страниц вперёд."""
+    n, total, pages = args.n or 2_000, 5_000, 10
+    bot, dp, session = await make_env(args.api_delay, limit=args.limit, rate=args.rate)
+    async with main.POOL.write() as db:
+        await db.executemany(
+            "INSERT INTO reviews (user_id,username,first_name,rating,text,status,created_at) "
+            "VALUES(?,?,?,?,?,'approved',?)",
+            [(i, f"u{i}", f"U{i}", random.randint(3, 5), "Отличный мастер, всё понравилось! " * 3,
+              f"2025-01-01T00:00:{i:09d}") for i in range(total)])
+    await main.db_rebuild_review_stats()   # отзывы вставлены в обход db_set_review_status
+    latency: list[float] = []
+
+    async def reader(uid: int):
+        await feed(dp, bot, cb_update(uid, "reviews_menu"), latency)
+        await feed(dp, bot, cb_update(uid, "reviews_browse:0"), latency)
+        # Лента идёт от новых к старым: на позиции i стоит отзыв с id = total - i
+        for i in range(pages):
+            await feed(dp, bot, cb_update(uid, f"reviews_browse:{i + 1}:next:{total - i}"), latency)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(reader(300_000 + i) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    report(f"reviews: {n} клиентов × {pages + 2} экранов, {total} отзывов", len(latency), elapsed, latency)
+    await close_env(dp)
+
+async def scenario_broadcast(args):
+    """Рассылка по всей базе: админ подтверждает текст, дальше фоновая задача."""
+    n = args.n or 50_000
+    bot, dp, session = await make_env(args.api_delay, limit=args.limit, rate=args.rate)
+    async with main.POOL.write() as db:
+        await db.executemany("INSERT INTO users (user_id,username,first_name,created_at) VALUES(?,?,?,?)",
+                             [(400_000 + i, f"u{i}", f"U{i}", "2025-01-01") for i in range(n)])
+    latency: list[float] = []
+    admin = main.ADMIN_ID
+    await feed(dp, bot, cb_update(admin, "adm_broadcast"), latency)
+    text  = "Скидка 20% на окрашивание до конца месяца!"
+    await feed(dp, bot, msg_update(admin, text), latency)
+    t0 = time.perf_counter()
+    await feed(dp, bot, cb_update(admin, "adm_do_broadcast"), latency)
+    while main.BROADCAST_TASKS:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - t0
+    sent = sum(type(c).__name__ == "SendMessage" and c.text == text for c in session.calls)
+    report(f"broadcast: {n} получателей, лимит {args.rate:g}/с", sent,
+           elapsed, latency, **{"хэндлеры": "задержка выше — клики админа"})
+    await close_env(dp)
+
+async def scenario_reminders(args):
+    """Шторм напоминаний: n подтверждённых записей, у всех «за 1 час» наступает одновременно."""
+    n = args.n or 5_000
+    bot, dp, session = await make_env(args.api_delay, limit=args.limit, rate=args.rate)
+    main.REMINDER_SETTINGS.update(r24=False, r12=False, r6=False, r1=True)
+    due = int(time.time()) + 3600 + 1
+    async with main.POOL.write() as db:
+        await db.executemany(
+            "INSERT INTO bookings (user_id,service_name,datetime_txt,appt_dt,appt_ts,dt_confidence,"
+            "status,created_at) VALUES(?,?,?,?,?,2,'confirmed',?)",
+            [(500_000 + i, main.SERVICES[i % len(main.SERVICES)][0], "bench",
+              datetime.fromtimestamp(due).isoformat(), due, "2025-01-01") for i in range(n)])
+    await main.REMINDERS.rebuild()
+    await drain_outbox(n)
+    elapsed = time.time() - (due - 3600)       # от момента, когда напоминания стали должны
+    queued, lag = main.REMINDERS.lag_stats(), main.OUTBOX.lag_stats()
+    report(f"reminders: {n} напоминаний, лимит {args.rate:g}/с", n, elapsed,
+           **{"в outbox":  f"опоздание p50 {queued['p50']:.2f} с, max {queued['max']:.2f} с",
+              "доставка":  f"p50 {lag['p50']:.2f} с, p99 {lag['p99']:.2f} с, max {lag['max']:.2f} с",
+              "отправлено": main.OUTBOX.sent})
+    await close_env(dp)
+
+async def scenario_updates(args):
+    """
+    Много чатов шлют по несколько апдейтов подряд; как при polling, каждый
+    апдейт — отдельная задача. Проверяем порядок внутри чата, считаем
+    пропускную способность, задержку и пиковое число одновременных хэндлеров.
+    """
+    bot, dp, session = await make_env(args.api_delay, gate=not args.no_gate, limit=args.limit)
+
+    running = peak_running = 0
+    trace: dict[int, list[tuple[int, float, float]]] = {}   # чат -> [(update_id, начало, конец)]
+
+    async def observe(handler, event, data):
+        nonlocal running, peak_running
+        running += 1
+        peak_running = max(peak_running, running)
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            running -= 1
+            trace.setdefault(data["event_chat"].id, []).append(
+                (data["event_update"].update_id, t0, time.perf_counter()))
+    dp.message.outer_middleware(observe)
+    dp.callback_query.outer_middleware(observe)
+
+    # Чаты вперемешку, внутри чата — /start, затем листание меню
+    script = ["/start", "book_start", "svc:0", "prices", "main_menu"]
+    updates = []
+    for i in range(args.per_chat):
+        step = script[i % len(script)]
+        for c in range(args.chats):
+            uid = 10_000 + c
+            updates.append(msg_update(uid, step) if step.startswith("/") else cb_update(uid, step))
+
+    latency: list[float] = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(asyncio.create_task(feed(dp, bot, u, latency)) for u in updates))
+    elapsed = time.perf_counter() - t0
+
+    misordered = overlapping = 0
+    for events in trace.values():
+        for (id1, _, end1), (id2, start2, _) in zip(events, events[1:]):
+            misordered  += id2 < id1
+            overlapping += start2 < end1
+
+    extra = {"хэндлеров": f"пик {peak_running} одновременно",
+             "порядок":   f"нарушений {misordered}, наложений {overlapping}"}
+    if not args.no_gate:
+        extra["очередь"] = f"пик {main.UPDATE_GATE.peak_waiting} ожидающих"
+    report(f"updates: {args.chats} чатов × {args.per_chat}, "
+           f"гейт {'выкл' if args.no_gate else f'вкл, лимит {args.limit}'}",
+           len(updates), elapsed, latency, **extra)
+    await close_env(dp)
+
+async def scenario_routing(args):
+    """
+    Стоимость маршрутизации нажатия в зависимости от числа кнопок: обычный
+    Router с F.data-фильтрами (перебор) против CallbackRouter (таблица).
+    Жмётся последняя зарегистрированная кнопка — худший случай для перебора.
+    Хэндлеры пустые, БД и FSM не участвуют — меряется только диспетчеризация.
+    """
+    from aiogram import F, Router
+    n = args.n or 500
+    bot = Bot(token="1:bench", session=FakeSession())
+
+    async def noop(cb: CallbackQuery):
+        pass
+
+    for buttons in (10, 100, 1000):
+        results = []
+        for kind in ("перебор", "таблица"):
+            router = Router() if kind == "перебор" else main.CallbackRouter()
+            for i in range(buttons):
+                key = F.data == f"btn_{i}" if kind == "перебор" else f"btn_{i}"
+                router.callback_query.register(noop, key)
+            dp = Dispatcher()
+            dp.include_router(router)
+            updates = [cb_update(10_000 + i % 100, f"btn_{buttons - 1}") for i in range(n)]
+            t0 = time.perf_counter()
+            for update in updates:
+                await dp.feed_update(bot, update)
+            elapsed = time.perf_counter() - t0
+            results.append(f"{kind} {elapsed / n * 1e6:.0f} мкс")
+        print(f"── routing: {buttons:>4} кнопок — {', '.join(results)} на нажатие")
+    await bot.session.close()
+
+async def scenario_parse(args):
+    """
+    Разбор дат из текста клиента (parse_dt) по корпусу фраз из тестов:
+    без кэша (parse_dt.__wrapped__) и повторно из lru_cache — так текст
+    заявки разбирают moderate-клавиатура, экран админа и подтверждение.
+    """
+    from tests.test_parse_dt import CORPUS, TODAY
+    n     = args.n or 100_000
+    texts = [text for text, _ in CORPUS]
+    main.parse_dt.cache_clear()
+    results = {}
+    for kind, fn in (("без кэша", main.parse_dt.__wrapped__), ("из кэша", main.parse_dt)):
+        t0 = time.perf_counter()
+        for i in range(n):
+            fn(texts[i % len(texts)], TODAY)
+        results[kind] = n / (time.perf_counter() - t0)
+    print(f"── parse: {n} разборов по {len(texts)} фразам — "
+          + ", ".join(f"{kind} {qps:,.0f}/с".replace(",", " ") for kind, qps in results.items()))
+
+async def scenario_keyboards(args):
+    """
+    CPU на нажатие кнопки, чей хэндлер только показывает клавиатуру: готовая
+    разметка из KB_CACHE против сборки через InlineKeyboardBuilder на каждое
+    нажатие (KB_CACHE очищается перед каждым апдейтом). Время процесса,
+    а не настенное — ожидание БД и event loop не в счёт.
+    """
+    n = args.n or 2_000
+    bot, dp, session = await make_env()
+    admin = main.ADMIN_ID
+    presses = [
+        (10_001, "main_menu"), (10_001, "prices"), (10_001, "portfolio"), (10_001, "book_start"),
+        (10_001, main.SvcCb(idx=0).pack()),
+        (admin, "admin_panel"), (admin, "adm_bookings"), (admin, "adm_reminders"),
+        (admin, "adm_svc_texts"), (admin, "adm_profile"),
+    ]
+    rounds = 5   # варианты чередуются, берётся лучший раунд — меньше шума от GC и потоков БД
+    for uid, data in presses:
+        results = {"сборка": float("inf"), "кэш": float("inf")}
+        for _ in range(rounds):
+            for kind in results:
+                updates = [cb_update(uid, data) for _ in range(n // rounds)]
+                main.KB_CACHE.clear()
+                main.warm_keyboards()
+                t0 = time.process_time()
+                for update in updates:
+                    if kind == "сборка":
+                        main.KB_CACHE.clear()
+                    await dp.feed_update(bot, update)
+                results[kind] = min(results[kind], (time.process_time() - t0) / len(updates) * 1e6)
+        print(f"── keyboards: {data:<14} сборка {results['сборка']:5.0f} мкс, кэш {results['кэш']:5.0f} мкс "
+              f"CPU на нажатие ({results['кэш'] / results['сборка'] - 1:+.0%})")
+    main.warm_keyboards()
+    await close_env(dp)
+
+async def scenario_pool(args):
+    """
+    Запросов в секунду через SQLitePool против «соединение на запрос» —
+    как db_*-хэлперы работали до пула (новый aiosqlite-поток на каждый вызов).
+    Одинаковые SELECT по ключу и UPDATE, последовательно и n штук разом.
+    """
+    import aiosqlite
+    n = args.n or 1_000
+    bot, dp, session = await make_env()
+    async with main.POOL.write() as db:
+        await db.executemany("INSERT INTO settings (key,value) VALUES(?,?)", [(f"k{i}", "0") for i in range(n)])
+    read_sql  = "SELECT value FROM settings WHERE key=?"
+    write_sql = "UPDATE settings SET value=? WHERE key=?"
+
+    async def pool_read(i):
+        async with main.POOL.read() as db:
+            return await (await db.execute(read_sql, (f"k{i}",))).fetchone()
+
+    async def pool_write(i):
+        async with main.POOL.write() as db:
+            await db.execute(write_sql, (str(i), f"k{i}"))
+
+    async def connect_read(i):
+        async with aiosqlite.connect(main.DB_PATH) as db:
+            return await (await db.execute(read_sql, (f"k{i}",))).fetchone()
+
+    async def connect_write(i):
+        async with aiosqlite.connect(main.DB_PATH) as db:
+            await db.execute(write_sql, (str(i), f"k{i}"))
+            await db.commit()
+
+    async def run(op, concurrent: bool) -> tuple[float, int]:
+        errors = 0
+        async def one(i):
+            nonlocal errors
+            try:
+                await op(i)
+            except aiosqlite.OperationalError:   # database is locked
+                errors += 1
+        t0 = time.perf_counter()
+        if concurrent:
+            await asyncio.gather(*(one(i) for i in range(n)))
+        else:
+            for i in range(n):
+                await one(i)
+        return n / (time.perf_counter() - t0), errors
+
+    print(f"── pool: {n} запросов, запросов/с (ошибок)")
+    for name, concurrent in (("чтение подряд", False), ("чтение разом", True),
+                             ("запись подряд", False), ("запись разом", True)):
+        write = name.startswith("запись")
+        cells = []
+        for label, op in (("соединение на запрос", connect_write if write else connect_read),
+                          ("пул", pool_write if write else pool_read)):
+            qps, errors = await run(op, concurrent)
+            cells.append(f"{label} {qps:6.0f}" + (f" ({errors})" if errors else ""))
+        print(f"  {name + ':':15s} {', '.join(cells)}")
+    await close_env(dp)
+
+
+# ── Синтетическая база для масштабного теста ──────────────────────────────────
+
+FIRST_NAMES = ["Анна", "Мария", "Елена", "Ольга", "Наталья", "Ирина", "Светлана", "Дарья",
+               "Екатерина", "Юлия", "Алина", "Виктория", None]
+DATE_TEXTS  = ["15.01 14:00", "завтра в 10", "в пятницу в 7 вечера", "20 марта",
+               "когда будет окно", "послезавтра после обеда", "3 июня в 12:30"]
+REVIEW_TEXT = "Прекрасный мастер, цвет получился именно такой, как хотела. Приду ещё! "
+
+def _chunks(rows, size: int = 50_000):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def generate_db(users: int, bookings: int, reviews: int, days: int = 730):
+    """
+    Заполняет свежую БД (схема — миграциями init_db) объёмами «за пару лет работы»:
+    created_at растёт вместе с id, заявки и отзывы — во всех статусах.
+    Записи: ~3% pending, ~40% confirmed, остальное cancelled. У прошедших флаги
+    reminded_* стоят только для включённых в REMINDER_SETTINGS интервалов — как в проде,
+    где выключенный интервал не отмечается.
+    Отзывы: ~5% pending, ~10% rejected, остальное approved, оценки смещены к 5.
+    """
+    now    = int(time.time())
+    start  = now - days * 86400
+    iso    = lambda ts: datetime.fromtimestamp(ts).isoformat()
+    parsed = {txt: main.parse_booking_dt(txt) for txt in DATE_TEXTS}
+    fields = ("r24", "r12", "r6", "r1")   # порядок колонок reminded_24, _12, _6, _1
+
+    def user_rows():
+        for i in range(users):
+            uid = 10_000_000 + i
+            yield (uid, f"user{i}" if random.random() < .7 else None,
+                   random.choice(FIRST_NAMES), iso(start + i * days * 86400 // users))
+
+    def booking_rows():
+        for i in range(bookings):
+            u       = random.randrange(users)
+            created = start + i * days * 86400 // bookings
+            svc     = main.SERVICES[random.randrange(len(main.SERVICES))][0]
+            txt     = random.choice(DATE_TEXTS)
+            r       = random.random()
+            if r < .03:
+                ts, conf = parsed[txt]
+                yield (10_000_000 + u, f"user{u}", "Анна", svc, txt, None, ts, conf,
+                       "pending", 0, 0, 0, 0, iso(created))
+            else:
+                ts   = created + random.randint(1, 14) * 86400 + random.randint(10, 19) * 3600
+                done = [int(ts < now and main.REMINDER_SETTINGS[k]) for k in fields]
+                yield (10_000_000 + u, f"user{u}", "Анна", svc, txt, iso(ts), ts, main.DT_EXACT,
+                       "confirmed" if r < .43 else "cancelled", *done, iso(created))
+
+    def review_rows():
+        for i in range(reviews):
+            u = random.randrange(users)
+            r = random.random()
+            yield (10_000_000 + u, f"user{u}", "Анна", random.choices((5, 4, 3, 2, 1), (70, 20, 6, 2, 2))[0],
+                   REVIEW_TEXT, "pending" if r < .05 else "rejected" if r < .15 else "approved",
+                   iso(start + i * days * 86400 // reviews))
+
+    async with main.POOL.write() as db:
+        for chunk in _chunks(user_rows()):
+            await db.executemany("INSERT INTO users (user_id,username,first_name,created_at) VALUES(?,?,?,?)", chunk)
+        for chunk in _chunks(booking_rows()):
+            await db.executemany(
+                "INSERT INTO bookings (user_id,username,first_name,service_name,datetime_txt,appt_dt,appt_ts,"
+                "dt_confidence,status,reminded_24,reminded_12,reminded_6,reminded_1,created_at) "
+                "VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)", chunk)
+        for chunk in _chunks(review_rows()):
+            await db.executemany(
+                "INSERT INTO reviews (user_id,username,first_name,rating,text,status,created_at) "
+                "VALUES(?,?,?,?,?,?,?)", chunk)
+        await db.execute("ANALYZE")
+    await main.db_rebuild_review_stats()
+
+async def scenario_scale(args):
+    """
+    Каждый читающий db_*-запрос и админские экраны на базе реального размера
+    (по умолчанию 1M пользователей, 500k записей, 100k отзывов). База кэшируется
+    в --db и пересоздаётся с --regen. Запросы на пути клика админа/клиента дольше
+    --budget мс помечаются, и процесс завершается с кодом 1 — так регрессия видна
+    до продакшена. Фоновые выборки по всей таблице (рассылка, полные списки)
+    только печатаются: они линейны по построению.
+    """
+    path  = args.db or os.path.join(tempfile.gettempdir(), "bench-scale.db")
+    fresh = args.regen or not os.path.exists(path)
+    if fresh:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    bot, dp, session = await make_env(db_path=path)
+    if fresh:
+        t0 = time.perf_counter()
+        await generate_db(args.users, args.bookings, args.reviews)
+        print(f"── база {path} сгенерирована за {time.perf_counter() - t0:.0f} с, "
+              f"{os.path.getsize(path) / 2**20:.0f} МБ")
+
+    async with main.POOL.read() as db:
+        cur = await db.execute("SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM bookings), "
+                               "(SELECT COUNT(*) FROM reviews), (SELECT MAX(id) FROM bookings), "
+                               "(SELECT MAX(id) FROM reviews WHERE status='approved')")
+        n_users, n_bookings, n_reviews, max_booking, max_review = await cur.fetchone()
+        cur = await db.execute("SELECT id FROM bookings WHERE status='confirmed' ORDER BY appt_ts, id "
+                               "LIMIT 1 OFFSET (SELECT COUNT(*)/2 FROM bookings WHERE status='confirmed')")
+        mid_confirmed = (await cur.fetchone())[0]
+    print(f"── scale: {n_users} пользователей, {n_bookings} записей, {n_reviews} отзывов")
+
+    results: list[tuple[str, int, list[float], bool]] = []
+
+    async def measure(name: str, make_call, reps: int = args.reps, bulk: bool = False):
+        times, rows = [], 0
+        for _ in range(reps):
+            main.COUNT_CACHE.clear()          # иначе счётчики меряют только кэш
+            t = time.perf_counter()
+            out = await make_call()
+            times.append(time.perf_counter() - t)
+            rows = len(out) if isinstance(out, list) else out if type(out) is int else int(out is not None)
+        results.append((name, rows, times, bulk))
+
+    await measure("db_count_users",                lambda: main.db_count_users())
+    await measure("db_get_all_user_ids",           lambda: main.db_get_all_user_ids(), bulk=True)
+    await measure("db_get_latest_users",           lambda: main.db_get_latest_users())
+    await measure("db_count_approved_reviews",     lambda: main.db_count_approved_reviews())
+    await measure("db_rebuild_review_stats",       lambda: main.db_rebuild_review_stats(), bulk=True)
+    await measure("db_get_approved_reviews",       lambda: main.db_get_approved_reviews(), bulk=True)
+    await measure("db_count_pending_reviews",      lambda: main.db_count_pending_reviews())
+    await measure("db_get_pending_reviews",        lambda: main.db_get_pending_reviews(limit=1))
+    await measure("db_get_approved_review_at",     lambda: main.db_get_approved_review_at())
+    await measure("db_get_approved_review_at:next", lambda: main.db_get_approved_review_at(max_review // 2))
+    await measure("db_count_pending_bookings",     lambda: main.db_count_pending_bookings())
+    await measure("db_count_confirmed_bookings",   lambda: main.db_count_confirmed_bookings())
+    await measure("db_get_pending_bookings",       lambda: main.db_get_pending_bookings(limit=1))
+    await measure("db_get_confirmed_bookings",     lambda: main.db_get_confirmed_bookings(), bulk=True)
+    await measure("db_get_confirmed_booking_at",   lambda: main.db_get_confirmed_booking_at())
+    await measure("db_get_confirmed_booking_at:next", lambda: main.db_get_confirmed_booking_at(mid_confirmed))
+    await measure("db_get_booking",                lambda: main.db_get_booking(max_booking // 2))
+    await measure("db_get_bookings_for_reminders", lambda: main.db_get_bookings_for_reminders())
+    await measure("db_get_running_broadcasts",     lambda: main.db_get_running_broadcasts())
+
+    # Рассылка пишет снимок получателей — меряем один раз и убираем за собой
+    job = {}
+    async def create():
+        job["id"], total = await main.db_create_broadcast("bench", main.ADMIN_ID, 1)
+        return total
+    await measure("db_create_broadcast", create, reps=1, bulk=True)
+    await measure("db_get_broadcast",       lambda: main.db_get_broadcast(job["id"]), bulk=True)
+    await measure("db_get_broadcast_queue", lambda: main.db_get_broadcast_queue(job["id"]), bulk=True)
+    async with main.POOL.write() as db:
+        await db.execute("DELETE FROM broadcast_recipients WHERE broadcast_id=?", (job["id"],))
+        await db.execute("DELETE FROM broadcasts WHERE id=?", (job["id"],))
+
+    # Админские экраны целиком: хэндлер + клавиатура + отправка в FakeSession.
+    # В колонке «строк» — число вызовов API (0 — апдейт никто не обработал).
+    async def screen(data: str):
+        before = len(session.calls)
+        await dp.feed_update(bot, cb_update(main.ADMIN_ID, data))
+        return len(session.calls) - before
+    for data in ("adm_users", "adm_bookings", "adm_book_pending", "adm_book_confirmed:0",
+                 f"adm_book_confirmed:1:next:{mid_confirmed}", "adm_reviews"):
+        await measure(f"экран {data}", lambda: screen(data))
+
+    slow = 0
+    print(f"  {'запрос':40s} {'строк':>8s} {'p50, мс':>9s} {'max, мс':>9s}")
+    for name, rows, times, bulk in results:
+        over  = not bulk and pct(times, .5) * 1000 > args.budget
+        slow += over
+        note  = "  фон" if bulk else f"  ⚠ > {args.budget:g} мс" if over else ""
+        print(f"  {name:40s} {rows:>8} {pct(times, .5) * 1000:>9.1f} {max(times) * 1000:>9.1f}{note}")
+    report("scale", len(results), sum(sum(t) for _, _, t, _ in results),
+           **{"медленных": f"{slow} из {sum(not b for *_, b in results)} (бюджет {args.budget:g} мс)"})
+    await close_env(dp)
+    if slow:
+        sys.exit(1)
+
+
+SCENARIOS = {
+    "start":     scenario_start,
+    "funnel":    scenario_funnel,
+    "reviews":   scenario_reviews,
+    "broadcast": scenario_broadcast,
+    "reminders": scenario_reminders,
+    "updates":   scenario_updates,
+    "routing":   scenario_routing,
+    "keyboards": scenario_keyboards,
+    "parse":     scenario_parse,
+    "pool":      scenario_pool,
+    "scale":     scenario_scale,
+}
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Офлайн-бенчмарки хэндлеров бота")
+    p.add_argument("scenario", choices=[*SCENARIOS, "all"])
+    p.add_argument("--n", type=int, default=0, help="размер сценария (по умолчанию — свой у каждого)")
+    p.add_argument("--chats", type=int, default=300, help="updates: число чатов")
+    p.add_argument("--per-chat", type=int, default=10, help="updates: апдейтов на чат")
+    p.add_argument("--api-delay", type=float, default=0.0, help="средняя задержка ответа Telegram API, с")
+    p.add_argument("--rate", type=float, default=1e6,
+                   help="глобальный лимит отправок, сообщ./с (по умолчанию не ограничивает)")
+    p.add_argument("--limit", type=int, default=main.UPDATE_CONCURRENCY, help="лимит одновременных хэндлеров")
+    p.add_argument("--no-gate", action="store_true", help="без ChatOrderMiddleware")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--db", help="scale: путь к сгенерированной базе (по умолчанию во временном каталоге)")
+    p.add_argument("--regen", action="store_true", help="scale: пересоздать базу")
+    p.add_argument("--users", type=int, default=1_000_000, help="scale: пользователей")
+    p.add_argument("--bookings", type=int, default=500_000, help="scale: записей")
+    p.add_argument("--reviews", type=int, default=100_000, help="scale: отзывов")
+    p.add_argument("--reps", type=int, default=5, help="scale: повторов каждого запроса")
+    p.add_argument("--budget", type=float, default=100, help="scale: бюджет на запрос, мс")
+    return p.parse_args(argv)
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    args = parse_args()
+    if args.scenario == "all":
+        # Каждый сценарий — в отдельном процессе, чтобы пиковый RSS не смешивался
+        for name in SCENARIOS.keys() - {"scale"}:
+            subprocess.run([sys.executable, __file__, name, *sys.argv[2:]], check=True)
+    else:
+        random.seed(args.seed)
+        asyncio.run(SCENARIOS[args.scenario](args))
@@ -7,81 +7,288 @@ Telegram-бот — Полина Евдокимова. v13
 ✅ Кэш админов в памяти — кнопки мгновенные
 """
 
-import asyncio, logging, json, re, urllib.parse, aiosqlite
-from datetime import datetime
+import asyncio, bisect, cProfile, functools, hashlib, heapq, html, logging, json, os, pstats, re, signal, socket, time
+import urllib.parse, aiosqlite
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 from typing import Any, Dict, Optional
 
-from aiogram import Bot, Dispatcher, Router, F
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher, Router, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED, SkipHandler
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
 from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError,
+    TelegramNetworkError, TelegramRetryAfter
+)
 from aiogram.filters import CommandStart, Command, Filter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
 from aiogram.types import (
-    Message, CallbackQuery, TelegramObject,
+    Message, CallbackQuery, TelegramObject, FSInputFile,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  ПУЛ СОЕДИНЕНИЙ SQLITE
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Профиль соединения: WAL, чтобы фоновые чтения не блокировали запись хэндлеров
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous":  "NORMAL",      # в WAL-режиме надёжно и без fsync на каждый commit
+    "cache_size":   -16000,        # ~16 МБ страничного кэша на соединение
+    "mmap_size":    134217728,     # 128 МБ
+    "busy_timeout": 5000,
+}
+
+class SQLitePool:
+    """
+    Долгоживущие соединения с БД: одно пишущее и несколько читающих.
+    Каждое aiosqlite-соединение — отдельный поток, поэтому они открываются
+    один раз в main() и закрываются при остановке бота.
+    """
+    def __init__(self, db_path: str, readers: int = 4):
+        self._db_path = db_path
+        self._size    = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._wlock   = asyncio.Lock()
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._conns:  list[aiosqlite.Connection] = []
+        self._after:  list = []                   # колбэки текущей пишущей транзакции
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self._db_path)
+        for name, value in SQLITE_PRAGMAS.items():
+            await conn.execute(f"PRAGMA {name}={value}")
+        self._conns.append(conn)
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect()
+        for _ in range(self._size):
+            self._readers.put_nowait(await self._connect())
+
+    @asynccontextmanager
+    async def read(self):
+        """Соединение только для SELECT — берётся из очереди читателей."""
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Единственный писатель: транзакция коммитится при выходе из блока."""
+        async with self._wlock:
+            self._after = []
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            for fn in self._after:
+                fn()
+
+    def after_commit(self, fn):
+        """Внутри write(): fn() выполнится, только если транзакция закоммитится."""
+        self._after.append(fn)
+
+    async def close(self):
+        for conn in self._conns:
+            await conn.close()
+        self._conns.clear()
+        self._writer  = None
+        self._readers = asyncio.Queue()
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  SQLITE FSM STORAGE
 # ══════════════════════════════════════════════════════════════════════════════
 
+class _FSMEntry:
+    __slots__ = ("state", "data", "expires")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], expires: float):
+        self.state   = state
+        self.data    = data
+        self.expires = expires
+
+
 class SQLiteFSMStorage(BaseStorage):
-    def __init__(self, db_path: str):
-        self._db_path = db_path
-        self._lock    = asyncio.Lock()
+    """
+    FSM-хранилище с write-through кэшем в памяти.
+    Чтение горячего чата не ходит в БД; кэш ограничен по размеру (LRU)
+    и по времени простоя (TTL). Изменения копятся в _dirty и сбрасываются
+    одной транзакцией через flush_delay секунд — пара update_data() +
+    set_state() превращается в одну запись на диск. Пока сброс не
+    закоммичен, ключ остаётся в _flushing и из кэша не вытесняется.
+    """
+    def __init__(self, pool: SQLitePool, max_size: int = 10_000,
+                 ttl: float = 3600.0, flush_delay: float = 0.05):
+        self._pool        = pool
+        self._locks: Dict[str, list] = {}   # key -> [Lock, число владельцев/ожидающих]
+        self._max_size    = max_size
+        self._ttl         = ttl
+        self._flush_delay = flush_delay
+        self._cache: OrderedDict[str, _FSMEntry] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._flushing: set[str] = set()    # взяты flush(), но ещё не закоммичены
+        self._flush_task: Optional[asyncio.Task] = None
 
     async def init(self):
-        async with aiosqlite.connect(self._db_path) as db:
+        async with self._pool.write() as db:
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS fsm_data (
                     key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}'
                 )
             """)
-            await db.commit()
 
     @staticmethod
     def _key(k: StorageKey) -> str:
         return f"{k.bot_id}:{k.chat_id}:{k.user_id}"
 
+    @asynccontextmanager
+    async def _key_lock(self, k: str):
+        """Замок на один StorageKey; удаляется, как только его никто не ждёт."""
+        slot = self._locks.get(k)
+        if slot is None:
+            slot = self._locks[k] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0:
+                del self._locks[k]
+
+    # ── Кэш ───────────────────────────────────────────────────────────────────
+
+    def _pinned(self, k: str) -> bool:
+        """Запись ещё не в БД: выкинуть или перечитать её — потерять изменения."""
+        return k in self._dirty or k in self._flushing
+
+    async def _entry(self, k: str) -> _FSMEntry:
+        now = time.monotonic()
+        e   = self._cache.get(k)
+        if e is not None and (e.expires > now or self._pinned(k)):
+            e.expires = now + self._ttl
+            self._cache.move_to_end(k)
+            return e
+        async with self._pool.read() as db:
+            cur = await db.execute("SELECT state, data FROM fsm_data WHERE key=?", (k,))
+            row = await cur.fetchone()
+        # Пока шёл SELECT, ключ мог быть записан — кэш в приоритете
+        e = self._cache.get(k)
+        if e is not None and self._pinned(k):
+            return e
+        data = {}
+        if row:
+            try: data = json.loads(row[1]) or {}
+            except: data = {}
+        e = _FSMEntry(row[0] if row else None, data, now + self._ttl)
+        self._cache[k] = e
+        self._cache.move_to_end(k)
+        self._evict()
+        return e
+
+    def _evict(self):
+        """Выкидывает просроченные и самые старые записи; несброшенные не трогаем."""
+        if len(self._cache) <= self._max_size:
+            return
+        now = time.monotonic()
+        for k in [k for k, e in self._cache.items() if e.expires <= now and not self._pinned(k)]:
+            del self._cache[k]
+        for k in list(self._cache):
+            if len(self._cache) <= self._max_size:
+                break
+            if not self._pinned(k):
+                del self._cache[k]
+
+    def _mark_dirty(self, k: str):
+        self._dirty.add(k)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Ключи, изменённые во время записи, уходят следующим кругом
+        while self._dirty:
+            await asyncio.sleep(self._flush_delay)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error(f"fsm flush: {e}")
+
+    async def flush(self):
+        """Сбрасывает все изменённые ключи в БД одной транзакцией."""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        self._flushing |= keys
+        rows = [(k, e.state, json.dumps(e.data, ensure_ascii=False))
+                for k in keys if (e := self._cache.get(k)) is not None]
+        try:
+            async with self._pool.write() as db:
+                await db.executemany("""
+                    INSERT INTO fsm_data (key,state,data) VALUES(?,?,?)
+                    ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data
+                """, rows)
+        except BaseException:
+            self._dirty |= keys
+            raise
+        finally:
+            self._flushing -= keys
+        self._evict()
+
+    # ── BaseStorage ───────────────────────────────────────────────────────────
+
     async def set_state(self, key: StorageKey, state: StateType = None):
         k  = self._key(key)
         sv = state.state if hasattr(state, "state") else (state if isinstance(state, str) else None)
-        async with self._lock:
-            async with aiosqlite.connect(self._db_path) as db:
-                await db.execute("""
-                    INSERT INTO fsm_data (key,state,data) VALUES(?,?,?)
-                    ON CONFLICT(key) DO UPDATE SET state=excluded.state
-                """, (k, sv, "{}"))
-                await db.commit()
+        async with self._key_lock(k):
+            e = await self._entry(k)
+            e.state = sv
+            self._mark_dirty(k)
 
     async def get_state(self, key: StorageKey) -> Optional[str]:
-        async with aiosqlite.connect(self._db_path) as db:
-            cur = await db.execute("SELECT state FROM fsm_data WHERE key=?", (self._key(key),))
-            row = await cur.fetchone()
-        return row[0] if row else None
+        return (await self._entry(self._key(key))).state
 
     async def set_data(self, key: StorageKey, data: Dict[str, Any]):
-        async with self._lock:
-            async with aiosqlite.connect(self._db_path) as db:
-                await db.execute("""
-                    INSERT INTO fsm_data (key,state,data) VALUES(?,NULL,?)
-                    ON CONFLICT(key) DO UPDATE SET data=excluded.data
-                """, (self._key(key), json.dumps(data, ensure_ascii=False)))
-                await db.commit()
+        k = self._key(key)
+        async with self._key_lock(k):
+            e = await self._entry(k)
+            e.data = dict(data)
+            self._mark_dirty(k)
 
     async def get_data(self, key: StorageKey) -> Dict[str, Any]:
-        async with aiosqlite.connect(self._db_path) as db:
-            cur = await db.execute("SELECT data FROM fsm_data WHERE key=?", (self._key(key),))
-            row = await cur.fetchone()
-        if not row: return {}
-        try: return json.loads(row[0]) or {}
-        except: return {}
+        return dict((await self._entry(self._key(key))).data)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        # У BaseStorage это get_data + set_data без замка: параллельные
+        # update_data одного ключа теряли бы друг друга
+        k = self._key(key)
+        async with self._key_lock(k):
+            e = await self._entry(k)
+            e.data = {**e.data, **data}
+            self._mark_dirty(k)
+            return dict(e.data)
 
-    async def close(self): pass
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        await self.flush()
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -96,6 +303,25 @@ MASTER_USERNAME  = "Evdokimkaaa"
 MASTER_NAME_FULL = "Полина Евдокимова"
 PORTFOLIO_LINK   = "https://t.me/evdokimovapolinatg"
 
+# Получение апдейтов: пустой WEBHOOK_URL — long polling, иначе вебхук (aiohttp).
+# В режиме вебхука Telegram копит апдейты, пока бот перезапускается
+WEBHOOK_URL      = ""                      # например "https://bot.example.com"
+WEBHOOK_PATH     = "/webhook"
+WEBHOOK_SECRET   = hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+WEBAPP_HOST      = "0.0.0.0"
+
+# Метрики в формате Prometheus: GET /metrics, только локально (0 — не поднимать)
+METRICS_HOST     = "127.0.0.1"
+
+# Порты — свои у каждого процесса на хосте: WEBAPP_PORT=8081 METRICS_PORT=9101 python main.py
+WEBAPP_PORT      = int(os.environ.get("WEBAPP_PORT", 8080))
+METRICS_PORT     = int(os.environ.get("METRICS_PORT", 9100))
+
+# Профилирование из админки: куда класть .prof, сколько строк в отчёте, потолок по времени
+PROFILE_DIR         = "profiles"
+PROFILE_TOP         = 15
+PROFILE_MAX_SECONDS = 600
+
 SERVICES = [
     ("Сложное окрашивание",             "9 000 – 14 000 ₽"),
     ("В один тон",                       "5 000 – 9 000 ₽"),
@@ -120,6 +346,24 @@ DEFAULT_SERVICE_TEXTS = [
     "Здравствуйте, я с бота по записи, хочу записаться на укладку локоны",
 ]
 
+# Лимиты Telegram: ~30 сообщений/с на бота и ~1 сообщение/с в один чат (берём с запасом)
+TG_GLOBAL_RATE      = 25
+TG_CHAT_INTERVAL    = 1.0
+BROADCAST_WORKERS   = 8      # одновременных отправителей в рассылке
+BROADCAST_PROGRESS  = 3.0    # как часто (сек) обновлять прогресс у админа и сохранять его в БД
+OUTBOX_WORKERS      = 4      # одновременных отправителей уведомлений
+OUTBOX_MAX_ATTEMPTS = 8      # после стольких сетевых ошибок сообщение считается недоставленным
+OUTBOX_BACKOFF      = 2.0    # пауза перед первым повтором, сек; дальше удваивается
+OUTBOX_BACKOFF_MAX  = 600.0
+OUTBOX_KEEP_DAYS    = 7      # сколько хранить обработанные сообщения
+UPDATE_CONCURRENCY  = 64     # одновременно работающих хэндлеров (разных чатов)
+
+# Несколько процессов на одной БД: фоновые задачи ведёт только лидер
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TTL   = 15.0   # аренда лидера, сек: столько ждут остальные, если лидер упал
+LEASE_RENEW = 5.0    # как часто лидер продлевает аренду (и остальные пробуют её взять)
+CACHE_POLL  = 1.0    # как часто сверять версии кэшей с БД, сек
+
 # Кэш авторизованных админов в памяти — проверка мгновенная без запроса к БД
 ADMIN_CACHE: set[int] = set()
 
@@ -127,6 +371,22 @@ ADMIN_CACHE: set[int] = set()
 # Формат: {"r24": True, "r12": False, "r6": True, "r1": True}
 REMINDER_SETTINGS: dict = {"r24": True, "r12": False, "r6": True, "r1": True}
 
+# Кэш счётчиков для листалок — сбрасывается хэлперами, меняющими статусы
+# Ключи: "confirmed_bookings"
+COUNT_CACHE: dict[str, int] = {}
+
+# Одобренные отзывы по оценкам {1..5: число} — копия review_stats, меняется
+# вместе с ней в db_set_review_status; число, средняя и гистограмма — отсюда
+REVIEW_STATS: dict[int, int] = {}
+
+# Тексты услуг и готовые ссылки «Написать мастеру» (по индексу услуги).
+# Загружаются при старте, меняются только через db_set/db_reset_service_text
+SERVICE_TEXTS: list[str] = list(DEFAULT_SERVICE_TEXTS)
+MASTER_URLS:   list[str] = [""] * len(SERVICES)
+
+# Чаты, заблокировавшие бота (загружаются при старте, пополняются Outbox)
+BLOCKED_CHATS: set[int] = set()
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s | %(levelname)-8s | %(name)s: %(message)s",
@@ -134,99 +394,500 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
+# Общий пул соединений — открывается в main(), им пользуются все db_* и FSM-хранилище
+POOL = SQLitePool(DB_PATH)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  МЕТРИКИ
+# ══════════════════════════════════════════════════════════════════════════════
+
+METRICS: list = []   # всё, что отдаётся на /metrics, в порядке объявления
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(key: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self._values: dict[tuple, float] = {}
+        METRICS.append(self)
+
+    def inc(self, value: float = 1.0, **labels):
+        key = tuple(labels.items())
+        self._values[key] = self._values.get(key, 0.0) + value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, v in self._values.items():
+            yield f"{self.name}{_labels(key)} {v}"
+
+class Gauge:
+    """Значение считается в момент запроса /metrics функцией fn() -> {метки: значение}."""
+    def __init__(self, name: str, help: str, fn):
+        self.name, self.help, self._fn = name, help, fn
+        METRICS.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for key, v in self._fn().items():
+            yield f"{self.name}{_labels(key)} {v}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.buckets = name, help, buckets
+        self._series: dict[tuple, list] = {}   # метки -> [счётчики по корзинам, сумма, количество]
+        METRICS.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.items())
+        s = self._series.get(key)
+        if s is None:
+            s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        s[0][bisect.bisect_left(self.buckets, value)] += 1
+        s[1] += value
+        s[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total, n) in self._series.items():
+            acc = 0
+            for le, c in zip((*self.buckets, "+Inf"), counts):
+                acc += c
+                le = f'le="{le}"'
+                yield f"{self.name}_bucket{_labels(key, le)} {acc}"
+            yield f"{self.name}_sum{_labels(key)} {total}"
+            yield f"{self.name}_count{_labels(key)} {n}"
+
+def render_metrics() -> str:
+    return "\n".join(line for m in METRICS for line in m.render()) + "\n"
+
+HANDLER_SECONDS  = Histogram("bot_handler_seconds", "Время работы хэндлера")
+HANDLER_ERRORS   = Counter("bot_handler_errors_total", "Исключения в хэндлерах")
+DB_SECONDS       = Histogram("bot_db_seconds", "Время db_*-хэлперов")
+API_SECONDS      = Histogram("bot_api_seconds", "Время запросов к Telegram Bot API")
+API_ERRORS       = Counter("bot_api_errors_total", "Ошибки запросов к Telegram Bot API")
+REMINDER_LAG     = Histogram("bot_reminder_lag_seconds", "Опоздание постановки напоминания в outbox",
+                             (1, 5, 15, 30, 60, 300, 900, 1800, 3600))
+REMINDERS_SENT   = Counter("bot_reminders_total", "Напоминания, поставленные в outbox")
+OUTBOX_MSGS      = Counter("bot_outbox_messages_total", "Исходящие уведомления по результату попытки")
+OUTBOX_DELAY     = Histogram("bot_outbox_delay_seconds", "От постановки в outbox до доставки",
+                             (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+BROADCAST_MSGS   = Counter("bot_broadcast_messages_total", "Сообщения рассылок")
+Gauge("bot_updates_inflight", "Апдейты в работе / в ожидании", lambda: {
+    (("state", "inflight"),): UPDATE_GATE.inflight, (("state", "waiting"),): UPDATE_GATE.waiting})
+Gauge("bot_broadcasts_running", "Идущие рассылки", lambda: {(): len(BROADCAST_TASKS)})
+Gauge("bot_reminders_queued", "Напоминания в куче планировщика", lambda: {(): len(REMINDERS._heap)})
+Gauge("bot_outbox_inflight", "Сообщения outbox, взятые в отправку", lambda: {(): len(OUTBOX._inflight)})
+Gauge("bot_leader", "1, если этот процесс ведёт фоновые задачи", lambda: {(): int(LEADER.is_leader)})
+
+def timed_db(fn):
+    """Обёртка db_*-хэлпера: время выполнения в bot_db_seconds{query=имя}."""
+    name = fn.__name__
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - t, query=name)
+    return wrapper
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время и ошибки каждого хэндлера по имени функции."""
+    async def __call__(self, handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        name = data["handler"].callback.__name__
+        t = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - t, handler=name)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: каждый вызов Bot API — время и ошибки по методу."""
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        t = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - t, method=name)
+
+def install_metrics(dp: Dispatcher, bot: Bot):
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(ApiMetricsMiddleware())
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+async def start_metrics_server() -> web.AppRunner | None:
+    if not METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        # Порт занят (второй процесс на хосте с тем же METRICS_PORT) — бот работает без метрик
+        log.error(f"Метрики не подняты на {METRICS_HOST}:{METRICS_PORT}: {e}")
+        await runner.cleanup()
+        return None
+    log.info(f"Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
+
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  БАЗА ДАННЫХ
 # ══════════════════════════════════════════════════════════════════════════════
 
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.executescript("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY, username TEXT,
-                first_name TEXT, created_at TEXT
-            );
-            CREATE TABLE IF NOT EXISTS service_texts (
-                svc_index INTEGER PRIMARY KEY, custom_text TEXT NOT NULL
-            );
-            CREATE TABLE IF NOT EXISTS admin_sessions (
-                user_id INTEGER PRIMARY KEY, authed_at TEXT NOT NULL
-            );
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL, username TEXT, first_name TEXT,
-                rating INTEGER NOT NULL, text TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'pending', created_at TEXT NOT NULL
-            );
-            -- status: pending | confirmed | cancelled
-            CREATE TABLE IF NOT EXISTS bookings (
-                id           INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id      INTEGER NOT NULL,
-                username     TEXT,
-                first_name   TEXT,
-                service_name TEXT NOT NULL,
-                datetime_txt TEXT NOT NULL,
-                appt_dt      TEXT,
-                status       TEXT NOT NULL DEFAULT 'pending',
-                reminded_24  INTEGER DEFAULT 0,
-                reminded_12  INTEGER DEFAULT 0,
-                reminded_6   INTEGER DEFAULT 0,
-                reminded_1   INTEGER DEFAULT 0,
-                created_at   TEXT NOT NULL
-            );
-            -- Настройки бота (ключ-значение)
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            );
-        """)
-        await db.commit()
+# Миграции схемы: (версия, SQL). Применённые версии пишутся в schema_version.
+# Новые индексы и колонки добавляются только новой записью в конец списка.
+MIGRATIONS: list[tuple[int, str]] = [
+    (1, """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY, username TEXT,
+            first_name TEXT, created_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS service_texts (
+            svc_index INTEGER PRIMARY KEY, custom_text TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS admin_sessions (
+            user_id INTEGER PRIMARY KEY, authed_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL, username TEXT, first_name TEXT,
+            rating INTEGER NOT NULL, text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending', created_at TEXT NOT NULL
+        );
+        -- status: pending | confirmed | cancelled
+        CREATE TABLE IF NOT EXISTS bookings (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id      INTEGER NOT NULL,
+            username     TEXT,
+            first_name   TEXT,
+            service_name TEXT NOT NULL,
+            datetime_txt TEXT NOT NULL,
+            appt_dt      TEXT,
+            status       TEXT NOT NULL DEFAULT 'pending',
+            reminded_24  INTEGER DEFAULT 0,
+            reminded_12  INTEGER DEFAULT 0,
+            reminded_6   INTEGER DEFAULT 0,
+            reminded_1   INTEGER DEFAULT 0,
+            created_at   TEXT NOT NULL
+        );
+        -- Настройки бота (ключ-значение)
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """),
+    (2, """
+        -- Ключ сортировки подтверждённых записей вместо CASE в ORDER BY
+        ALTER TABLE bookings ADD COLUMN sort_key TEXT;
+        UPDATE bookings SET sort_key = COALESCE(appt_dt, datetime_txt);
+
+        CREATE INDEX IF NOT EXISTS idx_bookings_status_created ON bookings(status, created_at);
+        CREATE INDEX IF NOT EXISTS idx_bookings_status_sort ON bookings(status, sort_key);
+        CREATE INDEX IF NOT EXISTS idx_bookings_unreminded ON bookings(status, appt_dt)
+            WHERE status='confirmed' AND appt_dt IS NOT NULL
+              AND (reminded_24=0 OR reminded_12=0 OR reminded_6=0 OR reminded_1=0);
+        CREATE INDEX IF NOT EXISTS idx_reviews_status_created ON reviews(status, created_at);
+    """),
+    (3, """
+        -- status: running | done
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            text            TEXT NOT NULL,
+            admin_chat_id   INTEGER NOT NULL,
+            progress_msg_id INTEGER,
+            status          TEXT NOT NULL DEFAULT 'running',
+            created_at      TEXT NOT NULL,
+            finished_at     TEXT
+        );
+        -- status: 0 — в очереди, 1 — доставлено, 2 — ошибка
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            user_id      INTEGER NOT NULL,
+            status       INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID;
+    """),
+    (4, """
+        -- appt_ts: время записи в unix-секундах (у заявки — распознанное из текста клиента)
+        -- dt_confidence: 0 — не распознано, 1 — только дата, 2 — дата и время;
+        --                NULL — заявка ещё не разбиралась (досчитывается в init_db)
+        ALTER TABLE bookings ADD COLUMN appt_ts INTEGER;
+        ALTER TABLE bookings ADD COLUMN dt_confidence INTEGER;
+        UPDATE bookings SET appt_ts = CAST(strftime('%s', appt_dt, 'utc') AS INTEGER), dt_confidence = 2
+            WHERE appt_dt IS NOT NULL;
+
+        DROP INDEX IF EXISTS idx_bookings_status_sort;
+        DROP INDEX IF EXISTS idx_bookings_unreminded;
+        -- Порядок подтверждённых теперь по appt_ts; sort_key никто больше не пишет
+        ALTER TABLE bookings DROP COLUMN sort_key;
+        CREATE INDEX IF NOT EXISTS idx_bookings_status_ts ON bookings(status, appt_ts);
+        CREATE INDEX IF NOT EXISTS idx_bookings_unreminded ON bookings(status, appt_ts)
+            WHERE status='confirmed' AND appt_ts IS NOT NULL
+              AND (reminded_24=0 OR reminded_12=0 OR reminded_6=0 OR reminded_1=0);
+    """),
+    (5, """
+        -- Экран «Пользователи» показывает последних 50 без сортировки всей таблицы
+        CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at);
+    """),
+    (6, """
+        -- Ручное подтверждение даты живёт в FSM-состоянии админа (AdminFSM.confirm_date)
+        DELETE FROM settings WHERE key='pending_confirm_bid';
+    """),
+    (7, """
+        -- Исходящие уведомления. status: 0 — в очереди, 1 — доставлено, 2 — ошибка, 3 — бот заблокирован
+        CREATE TABLE IF NOT EXISTS outbox (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id      INTEGER NOT NULL,
+            kind         TEXT NOT NULL,
+            text         TEXT NOT NULL,
+            reply_markup TEXT,
+            status       INTEGER NOT NULL DEFAULT 0,
+            attempts     INTEGER NOT NULL DEFAULT 0,
+            next_at      REAL NOT NULL,
+            last_error   TEXT,
+            created_at   TEXT NOT NULL,
+            sent_at      TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_at) WHERE status=0;
+        -- Чаты, заблокировавшие бота; снимается, когда пользователь снова жмёт /start
+        CREATE TABLE IF NOT EXISTS blocked_chats (
+            chat_id INTEGER PRIMARY KEY, blocked_at TEXT NOT NULL
+        );
+    """),
+    (8, """
+        -- Аренда лидера: напоминания, outbox и рассылки ведёт один процесс
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL
+        );
+        -- Версии кэшей в памяти: изменивший данные увеличивает, остальные процессы перечитывают
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY, version INTEGER NOT NULL
+        );
+    """),
+    (9, """
+        -- Одобренные отзывы по оценкам: число, сумма и гистограмма без обхода reviews
+        CREATE TABLE IF NOT EXISTS review_stats (
+            rating INTEGER PRIMARY KEY, count INTEGER NOT NULL
+        );
+        INSERT OR REPLACE INTO review_stats (rating,count)
+            SELECT rating, COUNT(*) FROM reviews WHERE status='approved' GROUP BY rating;
+    """),
+    (10, """
+        -- Незавершённые рассылки при старте и смене лидера — без обхода всей истории
+        CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON broadcasts(status) WHERE status='running';
+    """),
+]
 
-        # Загружаем кэш админов
-        cur = await db.execute("SELECT user_id FROM admin_sessions")
-        for row in await cur.fetchall():
-            ADMIN_CACHE.add(row[0])
+async def migrate(db: aiosqlite.Connection):
+    """Применяет недостающие миграции, каждую — в своей транзакции."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY, applied_at TEXT NOT NULL
+        )
+    """)
+    cur = await db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    current = (await cur.fetchone())[0]
+    for version, sql in MIGRATIONS:
+        if version <= current:
+            continue
+        await db.executescript(
+            f"BEGIN;\n{sql}\n"
+            f"INSERT INTO schema_version (version,applied_at) VALUES({version},'{datetime.now().isoformat()}');\n"
+            f"COMMIT;"
+        )
+        log.info(f"Схема БД обновлена до версии {version}")
 
-        # Загружаем настройки напоминаний
-        cur = await db.execute("SELECT key, value FROM settings WHERE key LIKE 'reminder_%'")
-        rows = await cur.fetchall()
-        mapping = {"reminder_24":"r24","reminder_12":"r12","reminder_6":"r6","reminder_1":"r1"}
-        for key, val in rows:
-            if key in mapping:
-                REMINDER_SETTINGS[mapping[key]] = (val == "1")
+async def init_db():
+    async with POOL.write() as db:
+        await migrate(db)
+
+        # Заявки, созданные до появления appt_ts, разбираем один раз — относительно
+        # дня создания: «завтра» в старой заявке — это следующий день после неё
+        cur  = await db.execute("SELECT id, datetime_txt, created_at FROM bookings WHERE dt_confidence IS NULL")
+        rows = [(*parse_booking_dt(txt, date.fromisoformat(created[:10])), bid)
+                for bid, txt, created in await cur.fetchall()]
+        if rows:
+            await db.executemany("UPDATE bookings SET appt_ts=?, dt_confidence=? WHERE id=?", rows)
+
+        # Версии читаем до кэшей: изменение, сделанное другим процессом
+        # во время загрузки, CACHE_SYNC подхватит при первой сверке
+        cur = await db.execute("SELECT name, version FROM cache_versions")
+        CACHE_SYNC.versions = dict(await cur.fetchall())
+
+        await db_load_admins(db)
+        await db_load_reminder_settings(db)
+        # Тексты услуг и ссылки на мастера
+        await db_load_service_texts(db)
+        # Заблокировавшие бота — им исходящие не ставятся в очередь
+        await db_load_blocked(db)
+        await db_load_review_stats(db)
 
     log.info(f"БД готова. Админы: {ADMIN_CACHE}. Напоминания: {REMINDER_SETTINGS}")
 
 
 async def db_save_setting(key: str, value: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.write() as db:
         await db.execute("INSERT OR REPLACE INTO settings (key,value) VALUES(?,?)", (key, value))
-        await db.commit()
+        await _bump(db, "settings")
+
+async def db_load_reminder_settings(db: aiosqlite.Connection):
+    cur = await db.execute("SELECT key, value FROM settings WHERE key LIKE 'reminder_%'")
+    mapping = {"reminder_24":"r24","reminder_12":"r12","reminder_6":"r6","reminder_1":"r1"}
+    for key, val in await cur.fetchall():
+        if key in mapping:
+            REMINDER_SETTINGS[mapping[key]] = (val == "1")
+
+
+# ── Несколько процессов ───────────────────────────────────────────────────────
+
+_BUMP = """
+    INSERT INTO cache_versions (name,version) VALUES(?,1)
+    ON CONFLICT(name) DO UPDATE SET version=version+1
+    RETURNING version
+"""
+
+async def _bump(db: aiosqlite.Connection, *names: str):
+    """
+    В транзакции, меняющей данные кэша: другие процессы перечитают кэши names.
+    Записанные версии запоминаются как свои — этот процесс уже обновил кэш сам.
+    """
+    own = []
+    for name in names:
+        cur = await db.execute(_BUMP, (name,))
+        own.append((name, (await cur.fetchone())[0]))
+    POOL.after_commit(lambda: CACHE_SYNC.mine(own))
+
+async def db_cache_versions() -> dict[str, int]:
+    async with POOL.read() as db:
+        cur = await db.execute("SELECT name, version FROM cache_versions")
+        return dict(await cur.fetchall())
+
+async def db_lease_acquire(name, holder, ttl) -> bool:
+    """Берёт или продлевает аренду: получится, если она наша, свободна или истекла."""
+    now = time.time()
+    async with POOL.write() as db:
+        cur = await db.execute("""
+            INSERT INTO leases (name,holder,expires_at) VALUES(?,?,?)
+            ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+            WHERE leases.holder=excluded.holder OR leases.expires_at<?
+        """, (name, holder, now + ttl, now))
+        return cur.rowcount > 0
+
+async def db_lease_release(name, holder):
+    async with POOL.write() as db:
+        await db.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
 
 
 # ── Пользователи ──────────────────────────────────────────────────────────────
 
+class UserUpsertBuffer:
+    """
+    Write-behind для таблицы users: /start не ждёт коммита на диск.
+    Повторы одного user_id схлопываются; накопленное пишется одним
+    executemany через delay секунд или сразу, как наберётся max_rows.
+    """
+    def __init__(self, pool: SQLitePool, delay: float = 0.2, max_rows: int = 500):
+        self._pool     = pool
+        self._delay    = delay
+        self._max_rows = max_rows
+        self._pending: dict[int, tuple[str | None, str | None, str]] = {}
+        self._full     = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, user_id, username, first_name):
+        old = self._pending.get(user_id)
+        # created_at — момент первого появления в этой пачке; в БД его всё равно не перезапишет
+        self._pending[user_id] = (username, first_name, old[2] if old else datetime.now().isoformat())
+        if len(self._pending) >= self._max_rows:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._full.wait(), self._delay)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error(f"users flush: {e}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            async with self._pool.write() as db:
+                await db.executemany("""
+                    INSERT INTO users (user_id,username,first_name,created_at) VALUES(?,?,?,?)
+                    ON CONFLICT(user_id) DO UPDATE SET username=excluded.username,first_name=excluded.first_name
+                """, [(uid, *v) for uid, v in batch.items()])
+        except BaseException:
+            # Более свежие данные, пришедшие во время записи, важнее
+            self._pending = {**batch, **self._pending}
+            raise
+
+    async def close(self):
+        self._full.set()
+        if self._task and not self._task.done():
+            await self._task
+        await self.flush()
+
+USER_BUFFER = UserUpsertBuffer(POOL)
+
 async def db_save_user(user_id, username, first_name):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            INSERT INTO users (user_id,username,first_name,created_at) VALUES(?,?,?,?)
-            ON CONFLICT(user_id) DO UPDATE SET username=excluded.username,first_name=excluded.first_name
-        """, (user_id, username, first_name, datetime.now().isoformat()))
-        await db.commit()
-
-async def db_get_all_users():
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT user_id,username,first_name,created_at FROM users ORDER BY created_at DESC")
+    USER_BUFFER.add(user_id, username, first_name)
+    if user_id in BLOCKED_CHATS:
+        await db_unblock_chat(user_id)
+
+async def db_get_latest_users(limit=50):
+    await USER_BUFFER.flush()
+    async with POOL.read() as db:
+        cur = await db.execute(
+            "SELECT user_id,username,first_name,created_at FROM users ORDER BY created_at DESC LIMIT ?", (limit,)
+        )
         rows = await cur.fetchall()
     return [{"user_id":r[0],"username":r[1],"first_name":r[2],"created_at":r[3]} for r in rows]
 
 async def db_get_all_user_ids():
-    async with aiosqlite.connect(DB_PATH) as db:
+    await USER_BUFFER.flush()
+    async with POOL.read() as db:
         cur = await db.execute("SELECT user_id FROM users")
         return [r[0] for r in await cur.fetchall()]
 
 async def db_count_users():
-    async with aiosqlite.connect(DB_PATH) as db:
+    await USER_BUFFER.flush()
+    async with POOL.read() as db:
         cur = await db.execute("SELECT COUNT(*) FROM users")
         row = await cur.fetchone()
     return row[0] if row else 0
@@ -234,144 +895,448 @@ async def db_count_users():
 
 # ── Тексты услуг ──────────────────────────────────────────────────────────────
 
+def _cache_service_text(idx, text):
+    SERVICE_TEXTS[idx] = text
+    MASTER_URLS[idx]   = f"https://t.me/{MASTER_USERNAME}?text={urllib.parse.quote(text)}"
+
+async def db_load_service_texts(db: aiosqlite.Connection):
+    cur  = await db.execute("SELECT svc_index, custom_text FROM service_texts")
+    rows = await cur.fetchall()
+    for idx, text in enumerate(DEFAULT_SERVICE_TEXTS):
+        _cache_service_text(idx, text)
+    for idx, text in rows:
+        if 0 <= idx < len(SERVICES):
+            _cache_service_text(idx, text)
+
 async def db_get_service_text(idx):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT custom_text FROM service_texts WHERE svc_index=?", (idx,))
-        row = await cur.fetchone()
-    return row[0] if row else DEFAULT_SERVICE_TEXTS[idx]
+    return SERVICE_TEXTS[idx]
 
 async def db_set_service_text(idx, text):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.write() as db:
         await db.execute("INSERT OR REPLACE INTO service_texts (svc_index,custom_text) VALUES(?,?)", (idx, text))
-        await db.commit()
+        await _bump(db, "service_texts")
+    _cache_service_text(idx, text)
 
 async def db_reset_service_text(idx):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.write() as db:
         await db.execute("DELETE FROM service_texts WHERE svc_index=?", (idx,))
-        await db.commit()
+        await _bump(db, "service_texts")
+    _cache_service_text(idx, DEFAULT_SERVICE_TEXTS[idx])
 
 
 # ── Авторизация ───────────────────────────────────────────────────────────────
 
 async def db_admin_add(user_id):
     ADMIN_CACHE.add(user_id)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.write() as db:
         await db.execute("INSERT OR REPLACE INTO admin_sessions (user_id,authed_at) VALUES(?,?)",
                          (user_id, datetime.now().isoformat()))
-        await db.commit()
+        await _bump(db, "admins")
+
+async def db_load_admins(db: aiosqlite.Connection):
+    cur  = await db.execute("SELECT user_id FROM admin_sessions")
+    rows = await cur.fetchall()
+    ADMIN_CACHE.clear()
+    ADMIN_CACHE.update(r[0] for r in rows)
 
 
 # ── Отзывы ────────────────────────────────────────────────────────────────────
 
 async def db_add_review(user_id, username, first_name, rating, text):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.write() as db:
         cur = await db.execute("""
             INSERT INTO reviews (user_id,username,first_name,rating,text,status,created_at)
             VALUES(?,?,?,?,?,'pending',?)
         """, (user_id, username, first_name, rating, text, datetime.now().isoformat()))
-        await db.commit()
         return cur.lastrowid
 
 async def db_get_approved_reviews():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.read() as db:
         cur = await db.execute("""
             SELECT id,user_id,username,first_name,rating,text,created_at
-            FROM reviews WHERE status='approved' ORDER BY created_at DESC
+            FROM reviews WHERE status='approved' ORDER BY created_at DESC, id DESC
         """)
         rows = await cur.fetchall()
     return [{"id":r[0],"user_id":r[1],"username":r[2],"first_name":r[3],
              "rating":r[4],"text":r[5],"created_at":r[6]} for r in rows]
 
-async def db_get_pending_reviews():
-    async with aiosqlite.connect(DB_PATH) as db:
+async def db_get_pending_reviews(limit=-1):
+    async with POOL.read() as db:
         cur = await db.execute("""
             SELECT id,user_id,username,first_name,rating,text,created_at
-            FROM reviews WHERE status='pending' ORDER BY created_at ASC
-        """)
+            FROM reviews WHERE status='pending' ORDER BY created_at ASC LIMIT ?
+        """, (limit,))
         rows = await cur.fetchall()
     return [{"id":r[0],"user_id":r[1],"username":r[2],"first_name":r[3],
              "rating":r[4],"text":r[5],"created_at":r[6]} for r in rows]
 
-async def db_set_review_status(review_id, status):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE reviews SET status=? WHERE id=?", (status, review_id))
-        await db.commit()
+async def db_get_approved_review_at(anchor_id=None, direction="next"):
+    """
+    Один одобренный отзыв по курсору (created_at, id) — без загрузки всего списка.
+    Без anchor_id — самый свежий; иначе следующий/предыдущий относительно anchor_id.
+    """
+    if anchor_id is None:
+        where, order = "", "DESC"
+    elif direction == "prev":
+        where, order = "AND (created_at,id) > (SELECT created_at,id FROM reviews WHERE id=?)", "ASC"
+    else:
+        where, order = "AND (created_at,id) < (SELECT created_at,id FROM reviews WHERE id=?)", "DESC"
+    async with POOL.read() as db:
+        cur = await db.execute(f"""
+            SELECT id,user_id,username,first_name,rating,text,created_at
+            FROM reviews WHERE status='approved' {where}
+            ORDER BY created_at {order}, id {order} LIMIT 1
+        """, () if anchor_id is None else (anchor_id,))
+        r = await cur.fetchone()
+    if not r: return None
+    return {"id":r[0],"user_id":r[1],"username":r[2],"first_name":r[3],
+            "rating":r[4],"text":r[5],"created_at":r[6]}
+
+_STATS_ADD = """
+    INSERT INTO review_stats (rating,count) VALUES(?,?)
+    ON CONFLICT(rating) DO UPDATE SET count=count+excluded.count
+"""
 
-async def db_count_approved_reviews():
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT COUNT(*) FROM reviews WHERE status='approved'")
+async def db_set_review_status(review_id, status):
+    """
+    Меняет статус и в той же транзакции — review_stats, если отзыв вошёл в
+    одобренные или вышел из них. Первый UPDATE срабатывает только на таком
+    переходе и сразу берёт блокировку записи, так что два процесса, жмущие
+    одну кнопку, не посчитают отзыв дважды.
+    """
+    delta = 1 if status == "approved" else -1
+    async with POOL.write() as db:
+        cur = await db.execute(
+            "UPDATE reviews SET status=? WHERE id=? AND (status='approved')!=(?='approved') RETURNING rating",
+            (status, review_id, status))
+        row = await cur.fetchone()
+        if row:
+            await db.execute(_STATS_ADD, (row[0], delta))
+            await _bump(db, "reviews")
+        else:
+            # Переход внутри неодобренных (pending → rejected) или повторный клик
+            await db.execute("UPDATE reviews SET status=? WHERE id=?", (status, review_id))
+    if row:
+        REVIEW_STATS[row[0]] = REVIEW_STATS.get(row[0], 0) + delta
+
+async def db_load_review_stats(db: aiosqlite.Connection):
+    cur  = await db.execute("SELECT rating, count FROM review_stats WHERE count>0")
+    rows = await cur.fetchall()
+    REVIEW_STATS.clear()
+    REVIEW_STATS.update(rows)
+
+async def db_rebuild_review_stats() -> dict[int, tuple[int, int]]:
+    """
+    Пересчитывает review_stats по таблице reviews (проверка согласованности).
+    Возвращает расхождения {оценка: (было, стало)}; пусто — всё сходилось.
+    """
+    async with POOL.write() as db:
+        # DELETE первым: транзакция сразу пишущая, отзывы не поменяются между чтениями
+        cur    = await db.execute("DELETE FROM review_stats RETURNING rating, count")
+        stored = dict(await cur.fetchall())
+        cur    = await db.execute("SELECT rating, COUNT(*) FROM reviews WHERE status='approved' GROUP BY rating")
+        actual = dict(await cur.fetchall())
+        await db.executemany("INSERT INTO review_stats (rating,count) VALUES(?,?)", actual.items())
+        await _bump(db, "reviews")
+    REVIEW_STATS.clear()
+    REVIEW_STATS.update(actual)
+    return {r: (stored.get(r, 0), actual.get(r, 0))
+            for r in sorted(stored.keys() | actual.keys()) if stored.get(r, 0) != actual.get(r, 0)}
+
+async def db_count_pending_reviews():
+    async with POOL.read() as db:
+        cur = await db.execute("SELECT COUNT(*) FROM reviews WHERE status='pending'")
         row = await cur.fetchone()
     return row[0] if row else 0
 
+async def db_count_approved_reviews():
+    return sum(REVIEW_STATS.values())
+
 
 # ── Записи ────────────────────────────────────────────────────────────────────
 
 async def db_add_booking(user_id, username, first_name, service_name, datetime_txt):
-    async with aiosqlite.connect(DB_PATH) as db:
+    """
+    Текст клиента разбирается здесь один раз; дальше все экраны и
+    подтверждение работают с appt_ts/dt_confidence.
+    Возвращает (id, appt_ts, dt_confidence).
+    """
+    appt_ts, conf = parse_booking_dt(datetime_txt)
+    async with POOL.write() as db:
         cur = await db.execute("""
-            INSERT INTO bookings (user_id,username,first_name,service_name,datetime_txt,status,created_at)
-            VALUES(?,?,?,?,?,'pending',?)
-        """, (user_id, username, first_name, service_name, datetime_txt, datetime.now().isoformat()))
-        await db.commit()
-        return cur.lastrowid
-
-async def db_confirm_booking(booking_id, appt_dt):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE bookings SET status='confirmed',appt_dt=? WHERE id=?", (appt_dt, booking_id))
-        await db.commit()
+            INSERT INTO bookings (user_id,username,first_name,service_name,datetime_txt,
+                                  appt_ts,dt_confidence,status,created_at)
+            VALUES(?,?,?,?,?,?,?,'pending',?)
+        """, (user_id, username, first_name, service_name, datetime_txt,
+              appt_ts, conf, datetime.now().isoformat()))
+        return cur.lastrowid, appt_ts, conf
+
+async def db_confirm_booking(booking_id, appt_ts: int):
+    async with POOL.write() as db:
+        await db.execute(
+            "UPDATE bookings SET status='confirmed',appt_dt=?,appt_ts=?,dt_confidence=? WHERE id=?",
+            (datetime.fromtimestamp(appt_ts).isoformat(), appt_ts, DT_EXACT, booking_id)
+        )
+        cur = await db.execute("SELECT user_id,service_name FROM bookings WHERE id=?", (booking_id,))
+        row = await cur.fetchone()
+        await _bump(db, "bookings")
+    COUNT_CACHE.pop("confirmed_bookings", None)
+    # Куча есть только у лидера; в другом процессе он узнает об этом по версии «bookings»
+    if row and LEADER.is_leader:
+        REMINDERS.schedule(booking_id, row[0], row[1], appt_ts)
 
 async def db_cancel_booking(booking_id):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.write() as db:
         await db.execute("UPDATE bookings SET status='cancelled' WHERE id=?", (booking_id,))
-        await db.commit()
+        await _bump(db, "bookings")
+    COUNT_CACHE.pop("confirmed_bookings", None)
+    if LEADER.is_leader:
+        REMINDERS.discard(booking_id)
 
-async def db_get_pending_bookings():
-    async with aiosqlite.connect(DB_PATH) as db:
+async def db_get_pending_bookings(limit=-1):
+    async with POOL.read() as db:
         cur = await db.execute("""
-            SELECT id,user_id,username,first_name,service_name,datetime_txt,created_at
-            FROM bookings WHERE status='pending' ORDER BY created_at ASC
-        """)
+            SELECT id,user_id,username,first_name,service_name,datetime_txt,created_at,appt_ts,dt_confidence
+            FROM bookings WHERE status='pending' ORDER BY created_at ASC LIMIT ?
+        """, (limit,))
         rows = await cur.fetchall()
     return [{"id":r[0],"user_id":r[1],"username":r[2],"first_name":r[3],
-             "service_name":r[4],"datetime_txt":r[5],"created_at":r[6]} for r in rows]
+             "service_name":r[4],"datetime_txt":r[5],"created_at":r[6],
+             "appt_ts":r[7],"dt_confidence":r[8]} for r in rows]
 
 async def db_get_confirmed_bookings():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.read() as db:
         cur = await db.execute("""
-            SELECT id,user_id,username,first_name,service_name,datetime_txt,appt_dt
-            FROM bookings WHERE status='confirmed' ORDER BY
-                CASE WHEN appt_dt IS NOT NULL THEN appt_dt ELSE datetime_txt END ASC
+            SELECT id,user_id,username,first_name,service_name,datetime_txt,appt_dt,appt_ts
+            FROM bookings WHERE status='confirmed' ORDER BY appt_ts ASC, id ASC
         """)
         rows = await cur.fetchall()
     return [{"id":r[0],"user_id":r[1],"username":r[2],"first_name":r[3],
-             "service_name":r[4],"datetime_txt":r[5],"appt_dt":r[6]} for r in rows]
+             "service_name":r[4],"datetime_txt":r[5],"appt_dt":r[6],"appt_ts":r[7]} for r in rows]
+
+async def db_get_confirmed_booking_at(anchor_id=None, direction="next"):
+    """
+    Одна подтверждённая запись по курсору (appt_ts, id).
+    Без anchor_id — ближайшая; иначе следующая/предыдущая относительно anchor_id.
+    """
+    if anchor_id is None:
+        where, order = "", "ASC"
+    elif direction == "prev":
+        where, order = "AND (appt_ts,id) < (SELECT appt_ts,id FROM bookings WHERE id=?)", "DESC"
+    else:
+        where, order = "AND (appt_ts,id) > (SELECT appt_ts,id FROM bookings WHERE id=?)", "ASC"
+    async with POOL.read() as db:
+        cur = await db.execute(f"""
+            SELECT id,user_id,username,first_name,service_name,datetime_txt,appt_dt,appt_ts
+            FROM bookings WHERE status='confirmed' {where}
+            ORDER BY appt_ts {order}, id {order} LIMIT 1
+        """, () if anchor_id is None else (anchor_id,))
+        r = await cur.fetchone()
+    if not r: return None
+    return {"id":r[0],"user_id":r[1],"username":r[2],"first_name":r[3],
+            "service_name":r[4],"datetime_txt":r[5],"appt_dt":r[6],"appt_ts":r[7]}
+
+async def db_count_confirmed_bookings():
+    if "confirmed_bookings" not in COUNT_CACHE:
+        async with POOL.read() as db:
+            cur = await db.execute("SELECT COUNT(*) FROM bookings WHERE status='confirmed'")
+            row = await cur.fetchone()
+        COUNT_CACHE["confirmed_bookings"] = row[0] if row else 0
+    return COUNT_CACHE["confirmed_bookings"]
+
+async def db_count_pending_bookings():
+    async with POOL.read() as db:
+        cur = await db.execute("SELECT COUNT(*) FROM bookings WHERE status='pending'")
+        row = await cur.fetchone()
+    return row[0] if row else 0
 
 async def db_get_booking(booking_id):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with POOL.read() as db:
         cur = await db.execute(
-            "SELECT id,user_id,username,first_name,service_name,datetime_txt,appt_dt,status FROM bookings WHERE id=?",
+            "SELECT id,user_id,username,first_name,service_name,datetime_txt,appt_dt,status,appt_ts,dt_confidence "
+            "FROM bookings WHERE id=?",
             (booking_id,)
         )
         row = await cur.fetchone()
     if not row: return None
     return {"id":row[0],"user_id":row[1],"username":row[2],"first_name":row[3],
-            "service_name":row[4],"datetime_txt":row[5],"appt_dt":row[6],"status":row[7]}
+            "service_name":row[4],"datetime_txt":row[5],"appt_dt":row[6],"status":row[7],
+            "appt_ts":row[8],"dt_confidence":row[9]}
 
 async def db_get_bookings_for_reminders():
-    async with aiosqlite.connect(DB_PATH) as db:
+    """
+    Записи, у которых ещё может сработать хоть одно напоминание. Флаги
+    выключенных и пропущенных по окну интервалов не ставятся, поэтому без
+    нижней границы по appt_ts прошедшие записи читались бы при каждой
+    перестройке вечно; индекс idx_bookings_unreminded ищет по ней сразу.
+    """
+    # Последнее закрывающееся окно — у r1: за (1 ч - допуск) до записи
+    since = time.time() + min(hours - grace for hours, _, grace, _ in REMINDER_KINDS.values()) * 3600
+    async with POOL.read() as db:
         cur = await db.execute("""
-            SELECT id,user_id,service_name,appt_dt,reminded_24,reminded_12,reminded_6,reminded_1
-            FROM bookings WHERE status='confirmed' AND appt_dt IS NOT NULL
+            SELECT id,user_id,service_name,appt_ts,reminded_24,reminded_12,reminded_6,reminded_1
+            FROM bookings WHERE status='confirmed' AND appt_ts IS NOT NULL
               AND (reminded_24=0 OR reminded_12=0 OR reminded_6=0 OR reminded_1=0)
-        """)
+              AND appt_ts>=?
+            ORDER BY appt_ts
+        """, (int(since),))
         rows = await cur.fetchall()
-    return [{"id":r[0],"user_id":r[1],"service_name":r[2],"appt_dt":r[3],
+    return [{"id":r[0],"user_id":r[1],"service_name":r[2],"appt_ts":r[3],
              "reminded_24":r[4],"reminded_12":r[5],"reminded_6":r[6],"reminded_1":r[7]} for r in rows]
 
-async def db_mark_reminded(booking_id, field):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(f"UPDATE bookings SET {field}=1 WHERE id=?", (booking_id,))
-        await db.commit()
+async def db_enqueue_reminders(items):
+    """
+    items: [(booking_id, field, user_id, text), ...] — флаги reminded_* и строки
+    outbox одной транзакцией: напоминание либо отмечено и стоит в очереди, либо ни то, ни другое.
+    В очередь идут только те, чей флаг ещё не стоял: если на минуту разошлись
+    два лидера (см. LeaderLease), напоминание всё равно уйдёт один раз.
+    Возвращает число поставленных.
+    """
+    by_field: Dict[str, list] = {}
+    for bid, field, _, _ in items:
+        by_field.setdefault(field, []).append(bid)
+    async with POOL.write() as db:
+        fresh: set[tuple[int, str]] = set()
+        for field, ids in by_field.items():
+            cur = await db.execute(
+                f"UPDATE bookings SET {field}=1 WHERE {field}=0 AND id IN (SELECT value FROM json_each(?)) "
+                f"RETURNING id", (json.dumps(ids),))
+            fresh.update((r[0], field) for r in await cur.fetchall())
+        await db.executemany(_OUTBOX_INSERT, [_outbox_row(uid, "reminder", text)
+                                              for bid, field, uid, text in items if (bid, field) in fresh])
+    return len(fresh)
+
+
+# ── Рассылки ──────────────────────────────────────────────────────────────────
+
+async def db_create_broadcast(text, admin_chat_id, progress_msg_id):
+    """Создаёт задание рассылки и снимок получателей. Возвращает (id, число получателей)."""
+    await USER_BUFFER.flush()
+    async with POOL.write() as db:
+        cur = await db.execute("""
+            INSERT INTO broadcasts (text,admin_chat_id,progress_msg_id,status,created_at)
+            VALUES(?,?,?,'running',?)
+        """, (text, admin_chat_id, progress_msg_id, datetime.now().isoformat()))
+        job_id = cur.lastrowid
+        cur = await db.execute("""
+            INSERT INTO broadcast_recipients (broadcast_id,user_id)
+            SELECT ?, user_id FROM users WHERE user_id NOT IN (SELECT chat_id FROM blocked_chats)
+        """, (job_id,))
+        await _bump(db, "broadcasts")
+        return job_id, cur.rowcount
+
+async def db_get_broadcast(job_id):
+    async with POOL.read() as db:
+        cur = await db.execute(
+            "SELECT id,text,admin_chat_id,progress_msg_id,status FROM broadcasts WHERE id=?", (job_id,)
+        )
+        r = await cur.fetchone()
+        if not r: return None
+        cur = await db.execute("""
+            SELECT COUNT(*), COALESCE(SUM(status=1),0), COALESCE(SUM(status=2),0)
+            FROM broadcast_recipients WHERE broadcast_id=?
+        """, (job_id,))
+        total, sent, failed = await cur.fetchone()
+    return {"id":r[0],"text":r[1],"admin_chat_id":r[2],"progress_msg_id":r[3],"status":r[4],
+            "total":total,"sent":sent,"failed":failed}
+
+async def db_get_running_broadcasts():
+    async with POOL.read() as db:
+        cur = await db.execute("SELECT id FROM broadcasts WHERE status='running'")
+        return [r[0] for r in await cur.fetchall()]
+
+async def db_get_broadcast_queue(job_id):
+    async with POOL.read() as db:
+        cur = await db.execute(
+            "SELECT user_id FROM broadcast_recipients WHERE broadcast_id=? AND status=0", (job_id,)
+        )
+        return [r[0] for r in await cur.fetchall()]
+
+async def db_mark_broadcast_recipients(rows):
+    """rows: [(status, broadcast_id, user_id), ...] — одной транзакцией."""
+    async with POOL.write() as db:
+        await db.executemany(
+            "UPDATE broadcast_recipients SET status=? WHERE broadcast_id=? AND user_id=?", rows
+        )
+
+async def db_finish_broadcast(job_id):
+    async with POOL.write() as db:
+        await db.execute("UPDATE broadcasts SET status='done',finished_at=? WHERE id=?",
+                         (datetime.now().isoformat(), job_id))
+
+
+# ── Исходящие ─────────────────────────────────────────────────────────────────
+
+OUT_QUEUED, OUT_SENT, OUT_FAILED, OUT_BLOCKED = 0, 1, 2, 3
+
+_OUTBOX_INSERT = "INSERT INTO outbox (chat_id,kind,text,reply_markup,next_at,created_at) VALUES(?,?,?,?,?,?)"
+
+def _outbox_row(chat_id, kind, text, reply_markup: InlineKeyboardMarkup | None = None) -> tuple:
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+    return (chat_id, kind, text, markup, time.time(), datetime.now().isoformat())
+
+async def db_outbox_add(chat_id, kind, text, reply_markup=None):
+    async with POOL.write() as db:
+        cur = await db.execute(_OUTBOX_INSERT, _outbox_row(chat_id, kind, text, reply_markup))
+        await _bump(db, "outbox")   # лидер в другом процессе проснётся по версии
+        return cur.lastrowid
+
+async def db_outbox_due(limit):
+    """Наступившие сообщения очереди, старые первыми."""
+    async with POOL.read() as db:
+        cur = await db.execute("""
+            SELECT id,chat_id,kind,text,reply_markup,attempts,created_at
+            FROM outbox WHERE status=0 AND next_at<=? ORDER BY next_at LIMIT ?
+        """, (time.time(), limit))
+        rows = await cur.fetchall()
+    return [{"id":r[0],"chat_id":r[1],"kind":r[2],"text":r[3],"reply_markup":r[4],
+             "attempts":r[5],"created_at":r[6]} for r in rows]
+
+async def db_outbox_next_at():
+    """Время ближайшего повтора или None, если очередь пуста."""
+    async with POOL.read() as db:
+        cur = await db.execute("SELECT MIN(next_at) FROM outbox WHERE status=0")
+        return (await cur.fetchone())[0]
+
+async def db_outbox_save(results, blocked):
+    """
+    results: [(status, attempts, next_at, last_error, sent_at, id), ...];
+    blocked: [chat_id, ...] — новые заблокировавшие. Всё одной транзакцией.
+    """
+    now = datetime.now().isoformat()
+    async with POOL.write() as db:
+        await db.executemany(
+            "UPDATE outbox SET status=?,attempts=?,next_at=?,last_error=?,sent_at=? WHERE id=?", results
+        )
+        await db.executemany("INSERT OR IGNORE INTO blocked_chats (chat_id,blocked_at) VALUES(?,?)",
+                             [(c, now) for c in blocked])
+        if blocked:
+            await _bump(db, "blocked")
+
+async def db_outbox_purge(days):
+    """Удаляет доставленные и окончательно не доставленные сообщения старше days дней."""
+    before = (datetime.now() - timedelta(days=days)).isoformat()
+    async with POOL.write() as db:
+        cur = await db.execute("DELETE FROM outbox WHERE status!=0 AND created_at<?", (before,))
+        return cur.rowcount
+
+async def db_unblock_chat(chat_id):
+    BLOCKED_CHATS.discard(chat_id)
+    async with POOL.write() as db:
+        await db.execute("DELETE FROM blocked_chats WHERE chat_id=?", (chat_id,))
+        await _bump(db, "blocked")
+
+async def db_load_blocked(db: aiosqlite.Connection):
+    cur  = await db.execute("SELECT chat_id FROM blocked_chats")
+    rows = await cur.fetchall()
+    BLOCKED_CHATS.clear()
+    BLOCKED_CHATS.update(r[0] for r in rows)
+
+
+# Все db_*-хэлперы меряются в bot_db_seconds
+for _name, _fn in list(globals().items()):
+    if _name.startswith("db_") and asyncio.iscoroutinefunction(_fn):
+        globals()[_name] = timed_db(_fn)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -381,12 +1346,26 @@ async def db_mark_reminded(booking_id, field):
 def is_admin(uid: int) -> bool:
     return uid == ADMIN_ID or uid in ADMIN_CACHE
 
-async def make_master_link(idx):
-    text = await db_get_service_text(idx)
-    return f"https://t.me/{MASTER_USERNAME}?text={urllib.parse.quote(text)}"
+def make_master_link(idx):
+    # Ссылка уже закодирована при загрузке/изменении текста
+    return MASTER_URLS[idx]
 
 def stars(r): return "⭐"*r + "☆"*(5-r)
 
+def fmt_review_stats() -> str:
+    """«4.9 ★ из 1 240 отзывов» по REVIEW_STATS — без запросов к БД."""
+    count = sum(REVIEW_STATS.values())
+    if not count:
+        return "Отзывов пока нет"
+    avg  = sum(r * n for r, n in REVIEW_STATS.items()) / count
+    word = "отзыва" if count % 10 == 1 and count % 100 != 11 else "отзывов"
+    return f"<b>{avg:.1f} ★</b> из {count:,} {word}".replace(",", " ")
+
+def fmt_review_histogram() -> str:
+    count = sum(REVIEW_STATS.values()) or 1
+    return "\n".join(f"{r}★ {'▇' * round(REVIEW_STATS.get(r, 0) * 10 / count):<10} {REVIEW_STATS.get(r, 0)}"
+                     for r in range(5, 0, -1))
+
 def fmt_review(r, idx, total):
     name  = r["first_name"] or "Аноним"
     uname = f" (@{r['username']})" if r["username"] else ""
@@ -394,43 +1373,127 @@ def fmt_review(r, idx, total):
             f"{stars(r['rating'])}  <b>{name}</b>{uname}\n"
             f"<i>{r['created_at'][:10]}</i>\n\n{r['text']}")
 
-def parse_dt_from_text(text: str) -> datetime | None:
+# ── Разбор даты из текста клиента ─────────────────────────────────────────────
+
+_MONTHS = {
+    "янв": 1, "фев": 2, "мар": 3, "апр": 4, "май": 5, "мая": 5, "июн": 6,
+    "июл": 7, "авг": 8, "сен": 9, "окт": 10, "ноя": 11, "дек": 12,
+}
+_MONTH_RE = "янв|фев|мар|апр|ма[йя]|июн|июл|авг|сен|окт|ноя|дек"
+_WEEKDAYS = {
+    "пн": 0, "понедельник": 0, "вт": 1, "вторник": 1, "ср": 2, "среда": 2, "среду": 2,
+    "чт": 3, "четверг": 3, "пт": 4, "пятница": 4, "пятницу": 4,
+    "сб": 5, "суббота": 5, "субботу": 5, "вс": 6, "воскресенье": 6,
+}
+_RELATIVE = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+# Слова после числа, с которыми «на 2 …» — количество, а не час
+_COUNTED_RE = "чел|персон|гост|мин|недел|месяц|раз"
+
+# Одно регулярное выражение — один проход по тексту; каждая альтернатива — свой тип токена
+_DT_TOKEN_RE = re.compile(r"""
+      (?P<dmy> \b(?P<d1>\d{1,2})[./](?P<m1>\d{1,2})(?:[./](?P<y1>\d{4}|\d{2}))?\b(?![:.]?\d) )
+    | (?P<dmon> \b(?P<d2>\d{1,2})\s+(?P<mon>MONTHS)[а-я]*(?:\s+(?P<y2>\d{4}))? )
+    | (?P<rel> \b(?:послезавтра|завтра|сегодня)\b )
+    | (?P<wd> \b(?:понедельник|вторник|среду|среда|четверг|пятницу|пятница|субботу|суббота|
+                 воскресенье|пн|вт|ср|чт|пт|сб|вс)\b )
+    | (?P<hm> \b(?P<h1>\d{1,2}):(?P<mi>\d{2})\b (?:\s*(?P<p1>утра|дня|вечера|ночи))? )
+    | (?P<h> \b(?:в|к|на)\s+(?P<h2>\d{1,2})(?![./:]?\d)(?!\s+(?:MONTHS))(?!\s*(?:COUNTED))
+             (?:\s*(?P<u2>ч\b|час[а-я]*))?(?:\s*(?P<p2>утра|дня|вечера|ночи))?\b
+          | \b(?P<h3>\d{1,2})\s*(?:(?P<p3>утра|дня|вечера|ночи)|ч\b|час[а-я]*) )
+""".replace("MONTHS", _MONTH_RE).replace("COUNTED", _COUNTED_RE), re.X)
+
+# «в 2» без «ч» и без «утра/дня/…» — скорее не время («на 2 человека»);
+# голое число считаем часом только в разумных для записи пределах
+_BARE_HOURS = range(7, 24)
+
+def _apply_period(hour: int, period: str | None) -> int:
+    if period in ("дня", "вечера") and hour < 12:
+        return hour + 12
+    if period == "ночи" and hour == 12:
+        return 0
+    return hour
+
+@functools.lru_cache(maxsize=4096)
+def parse_dt(text: str, today: date) -> tuple[datetime, bool] | None:
+    """
+    Разбирает дату и время из свободного текста за один проход по токенам.
+    Возвращает (datetime, время_указано) или None, если даты нет.
+    Год без явного указания — ближайший будущий (15.01 в декабре → следующий год).
+    Результат кэшируется по (текст, сегодняшняя дата).
+    """
+    day = None
+    hour = minute = None
+    midnight = False
+    for m in _DT_TOKEN_RE.finditer(text.strip().lower()):
+        if day is None and m.group("dmy"):
+            y = m.group("y1")
+            y = (int(y) + 2000 if len(y) == 2 else int(y)) if y else None
+            day = _make_date(today, int(m.group("d1")), int(m.group("m1")), y)
+        elif day is None and m.group("dmon"):
+            y   = int(m.group("y2")) if m.group("y2") else None
+            day = _make_date(today, int(m.group("d2")), _MONTHS[m.group("mon")], y)
+        elif day is None and m.group("rel"):
+            day = today + timedelta(days=_RELATIVE[m.group("rel")])
+        elif day is None and m.group("wd"):
+            wd  = _WEEKDAYS[m.group("wd")]
+            day = today + timedelta(days=(wd - today.weekday()) % 7)
+        elif hour is None and m.group("hm"):
+            h, period = int(m.group("h1")), m.group("p1")
+            hour, minute = _apply_period(h, period), int(m.group("mi"))
+            # «сегодня в 12 ночи» — полночь в конце этого дня, а не в начале
+            midnight = h == 12 and period == "ночи"
+        elif hour is None and m.group("h"):
+            h, period = int(m.group("h2") or m.group("h3")), m.group("p2") or m.group("p3")
+            if m.group("h2") and not (m.group("u2") or period) and h not in _BARE_HOURS:
+                continue
+            hour, minute = _apply_period(h, period), 0
+            midnight = h == 12 and period == "ночи"
+    if day is None:
+        return None
+    if hour is None or hour > 23 or minute > 59:
+        return datetime(day.year, day.month, day.day), False
+    if midnight:
+        day += timedelta(days=1)
+    return datetime(day.year, day.month, day.day, hour, minute), True
+
+def _make_date(today: date, d: int, mon: int, year: int | None) -> date | None:
+    try:
+        if year:
+            return date(year, mon, d)
+        dt = date(today.year, mon, d)
+        return dt if dt >= today else date(today.year + 1, mon, d)
+    except ValueError:
+        return None
+
+def parse_dt_from_text(text: str, now: datetime | None = None) -> datetime | None:
     """
     Умно ищет дату и время в свободном тексте клиента.
-    Понимает: '15.01 14:00', '15.01.2025 14:00', '15 января в 14:00' и т.д.
+    Понимает: '15.01 14:00', '15.01.2025 14:00', '15 января в 14:00',
+    'завтра в 10', 'в пятницу в 7 вечера' и т.д. Без времени — None.
     """
-    text = text.strip().lower()
-    now  = datetime.now()
+    parsed = parse_dt(text, (now or datetime.now()).date())
+    return parsed[0] if parsed and parsed[1] else None
 
-    # Формат ДД.ММ.ГГГГ ЧЧ:ММ или ДД.ММ ЧЧ:ММ
-    for fmt in ("%d.%m.%Y %H:%M", "%d.%m %H:%M"):
-        m = re.search(r'\d{1,2}\.\d{1,2}(?:\.\d{4})?\s+\d{1,2}:\d{2}', text)
-        if m:
-            try:
-                dt = datetime.strptime(m.group(), fmt)
-                if fmt == "%d.%m %H:%M":
-                    dt = dt.replace(year=now.year)
-                return dt
-            except: pass
+# Насколько уверенно распознана дата заявки (bookings.dt_confidence)
+DT_NONE, DT_DATE, DT_EXACT = 0, 1, 2
 
-    # Формат ДД.ММ.ГГГГ ЧЧ:ММ без пробела
-    m = re.search(r'(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?\s+(\d{1,2}):(\d{2})', text)
-    if m:
-        day, mon, yr, hr, mi = m.groups()
-        yr = int(yr) if yr else now.year
-        try:
-            return datetime(int(yr), int(mon), int(day), int(hr), int(mi))
-        except: pass
+def parse_booking_dt(text: str, today: date | None = None) -> tuple[int | None, int]:
+    """
+    Разбор текста клиента при создании заявки: (appt_ts или None, DT_*).
+    today — день, относительно которого понимать «завтра» и год без указания.
+    """
+    parsed = parse_dt(text, today or date.today())
+    if not parsed:
+        return None, DT_NONE
+    dt, has_time = parsed
+    return int(dt.timestamp()), DT_EXACT if has_time else DT_DATE
 
-    return None
+_MONTHS_SHORT = ["янв","фев","мар","апр","май","июн","июл","авг","сен","окт","ноя","дек"]
 
-def fmt_dt(iso: str) -> str:
-    try:
-        dt = datetime.fromisoformat(iso)
-        m  = ["янв","фев","мар","апр","май","июн","июл","авг","сен","окт","ноя","дек"][dt.month-1]
-        return f"{dt.day} {m} в {dt.strftime('%H:%M')}"
-    except:
-        return iso
+def fmt_ts(ts: int, with_time: bool = True) -> str:
+    dt = datetime.fromtimestamp(ts)
+    m  = _MONTHS_SHORT[dt.month-1]
+    return f"{dt.day} {m} в {dt.strftime('%H:%M')}" if with_time else f"{dt.day} {m}"
 
 def reminder_label() -> str:
     active = []
@@ -441,6 +1504,75 @@ def reminder_label() -> str:
     return ", ".join(active) if active else "выключены"
 
 
+# ══════════════════════════════════════════════════════════════════════════════
+#  ЛИМИТЕР TELEGRAM
+# ══════════════════════════════════════════════════════════════════════════════
+
+class RateLimiter:
+    """
+    Токен-бакет на весь бот (rate сообщений в секунду) плюс минимальный
+    интервал между сообщениями в один чат. pause() останавливает все
+    отправки — так обрабатывается TelegramRetryAfter (flood control общий).
+    """
+    def __init__(self, rate: float, chat_interval: float):
+        self._rate          = rate
+        self._tokens        = rate
+        self._updated       = time.monotonic()
+        self._paused_until  = 0.0
+        self._chat_interval = chat_interval
+        self._chat_next: dict[int, float] = {}
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self._chat_interval
+        if len(self._chat_next) > 10_000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens  = min(self._rate, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+TG_LIMITER = RateLimiter(TG_GLOBAL_RATE, TG_CHAT_INTERVAL)
+
+async def tg_send(bot: Bot, chat_id: int, text: str, **kwargs) -> bool:
+    """
+    Отправка через общий лимитер. RetryAfter — пауза и повтор, сетевые
+    ошибки — повтор с backoff. False — получатель недоступен (заблокировал бота
+    и т.п.) или попытки кончились.
+    """
+    for attempt in range(5):
+        await TG_LIMITER.acquire(chat_id)
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+            return True
+        except TelegramRetryAfter as e:
+            log.warning(f"Flood control: пауза {e.retry_after} с")
+            TG_LIMITER.pause(e.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            log.info(f"Не доставлено {chat_id}: {e.message}")
+            return False
+        except TelegramNetworkError as e:
+            log.warning(f"Сеть при отправке {chat_id}: {e.message}")
+            await asyncio.sleep(2 ** attempt)
+    return False
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 #  FSM
 # ══════════════════════════════════════════════════════════════════════════════
@@ -450,6 +1582,7 @@ class AdminFSM(StatesGroup):
     broadcast_msg     = State()
     broadcast_confirm = State()
     edit_svc_text     = State()
+    confirm_date      = State()
 
 class ReviewFSM(StatesGroup):
     rating = State()
@@ -464,10 +1597,220 @@ class IsAdmin(Filter):
         return is_admin(uid) if uid else False
 
 
+# ══════════════════════════════════════════════════════════════════════════════
+#  CALLBACK DATA
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Кнопки с параметрами — типизированные CallbackData; строка в Telegram та же,
+# что и раньше («svc:3», «adm_book_ok:17»), так что старые сообщения работают.
+# Кнопки без параметров («main_menu», «adm_users») остаются простыми строками.
+
+class SvcCb(CallbackData, prefix="svc"):
+    idx: int
+
+class BookingApprovedCb(CallbackData, prefix="booking_approved"):
+    idx: int
+
+class RateCb(CallbackData, prefix="rate"):
+    rating: int
+
+class ReviewsPageCb(CallbackData, prefix="reviews_browse"):
+    idx:       int
+    direction: Optional[str] = None   # next | prev
+    anchor:    Optional[int] = None   # id текущего отзыва
+
+class ConfirmedPageCb(CallbackData, prefix="adm_book_confirmed"):
+    idx:       int
+    direction: Optional[str] = None   # next | prev
+    anchor:    Optional[int] = None   # id текущей записи
+
+class BookOkCb(CallbackData, prefix="adm_book_ok"):
+    bid: int
+
+class BookDelCb(CallbackData, prefix="adm_book_del"):
+    bid: int
+
+class RemindCb(CallbackData, prefix="adm_remind"):
+    bid: int
+
+class RemToggleCb(CallbackData, prefix="adm_rem_toggle"):
+    kind: str   # r24 / r12 / r6 / r1
+
+class ProfileCb(CallbackData, prefix="adm_prof"):
+    mode: str                   # s — секунды, u — апдейты, stop
+    n:    Optional[int] = None
+
+class EditSvcCb(CallbackData, prefix="adm_edit_svc"):
+    idx: int
+
+class ResetSvcCb(CallbackData, prefix="adm_reset_svc"):
+    idx: int
+
+class ReviewOkCb(CallbackData, prefix="adm_rev_ok"):
+    rid: int
+
+class ReviewDelCb(CallbackData, prefix="adm_rev_del"):
+    rid: int
+
+def unpack_cb(cls: type[CallbackData], data: str) -> CallbackData:
+    """
+    CallbackData.unpack, который понимает и короткую форму старых кнопок
+    («reviews_browse:0», «adm_prof:stop»): недостающие хвостовые поля — None.
+    """
+    missing = len(cls.model_fields) - data.count(cls.__separator__)
+    return cls.unpack(data + cls.__separator__ * missing if missing > 0 else data)
+
+class CallbackTable(TelegramEventObserver):
+    """
+    Observer callback_query с таблицей диспетчеризации: хэндлер ищется по
+    префиксу callback_data (до первого «:») в словаре, а не перебором
+    F.data-фильтров всех хэндлеров. Первый аргумент регистрации — ключ:
+    строка для кнопки без параметров или класс CallbackData; остальные
+    фильтры (состояние FSM, IsAdmin) проверяются только у найденного хэндлера.
+    Разобранный CallbackData приходит в хэндлер аргументом callback_data.
+    """
+    def __init__(self, router: Router, event_name: str):
+        super().__init__(router, event_name)
+        self.table: dict[str, list[tuple[type[CallbackData] | None, Any]]] = {}
+
+    def register(self, callback, key, *filters, flags=None, **kwargs):
+        super().register(callback, *filters, flags=flags, **kwargs)
+        typed  = not isinstance(key, str)
+        prefix = key.__prefix__ if typed else key
+        self.table.setdefault(prefix, []).append((key if typed else None, self.handlers[-1]))
+        return callback
+
+    async def trigger(self, event: CallbackQuery, **kwargs: Any) -> Any:
+        data = event.data or ""
+        for cb_type, handler in self.table.get(data.partition(":")[0], ()):
+            if cb_type is not None:
+                try:
+                    kwargs["callback_data"] = unpack_cb(cb_type, data)
+                except (TypeError, ValueError):
+                    continue
+            kwargs["handler"] = handler
+            result, extra = await handler.check(event, **kwargs)
+            if result:
+                kwargs.update(extra)
+                try:
+                    wrapped = self.outer_middleware.wrap_middlewares(self._resolve_middlewares(), handler.call)
+                    return await wrapped(event, kwargs)
+                except SkipHandler:
+                    continue
+        return UNHANDLED
+
+class CallbackRouter(Router):
+    """Router, у которого callback_query — CallbackTable."""
+    def __init__(self, *, name: str | None = None):
+        super().__init__(name=name)
+        self.callback_query = self.observers["callback_query"] = CallbackTable(self, "callback_query")
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  ОЧЕРЁДНОСТЬ АПДЕЙТОВ
+# ══════════════════════════════════════════════════════════════════════════════
+
+class ChatOrderMiddleware(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: апдейты одного чата обрабатываются строго
+    по очереди, разных чатов — параллельно, но не больше max_inflight
+    хэндлеров сразу. Остальные ждут; их число — глубина очереди (waiting).
+    Должен стоять раньше FSM-middleware, иначе состояние читается до того,
+    как предыдущий апдейт чата его поменял (см. install_update_gate).
+    """
+    def __init__(self, max_inflight: int = UPDATE_CONCURRENCY):
+        self._sem   = asyncio.Semaphore(max_inflight)
+        self._chats: Dict[int, list] = {}   # chat_id -> [Lock, число владельцев/ожидающих]
+        self.waiting = self.inflight = self.peak_waiting = 0
+
+    @asynccontextmanager
+    async def _chat_lock(self, chat_id: int | None):
+        if chat_id is None:
+            yield
+            return
+        slot = self._chats.get(chat_id)
+        if slot is None:
+            slot = self._chats[chat_id] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0:
+                del self._chats[chat_id]
+
+    async def __call__(self, handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        chat = data.get("event_chat") or data.get("event_from_user")
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        started = False
+        try:
+            async with self._chat_lock(chat.id if chat else None), self._sem:
+                self.waiting -= 1
+                started = True
+                self.inflight += 1
+                try:
+                    return await handler(event, data)
+                finally:
+                    self.inflight -= 1
+        finally:
+            if not started:
+                self.waiting -= 1
+
+    def stats(self) -> dict:
+        return {"inflight": self.inflight, "waiting": self.waiting,
+                "peak_waiting": self.peak_waiting, "chats": len(self._chats)}
+
+UPDATE_GATE = ChatOrderMiddleware()
+
+def install_update_gate(dp: Dispatcher, gate: ChatOrderMiddleware | None = None):
+    """Ставит гейт после UserContextMiddleware (нужен event_chat), но до FSM."""
+    mw = dp.update.outer_middleware
+    mw.unregister(dp.fsm)
+    mw(gate or UPDATE_GATE)
+    mw(dp.fsm)
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 #  КЛАВИАТУРЫ
 # ══════════════════════════════════════════════════════════════════════════════
 
+# Реестр готовых клавиатур: (имя функции, *аргументы) -> разметка.
+# Разметки общие для всех вызовов — их нельзя менять после сборки.
+KB_CACHE: dict[tuple, InlineKeyboardMarkup] = {}
+
+# Клавиатуры, зависящие от изменяемого состояния: kb_reminders — от REMINDER_SETTINGS,
+# kb_admin_main и kb_profile — от PROFILER.active. Сбрасываются при смене любого из них
+KB_DYNAMIC = ("kb_admin_main", "kb_reminders", "kb_profile")
+
+def cached_kb(fn):
+    """Клавиатура строится один раз на набор аргументов, дальше берётся из KB_CACHE."""
+    @functools.wraps(fn)
+    def wrapper(*args):
+        key = (fn.__name__, *args)
+        kb  = KB_CACHE.get(key)
+        if kb is None:
+            kb = KB_CACHE[key] = fn(*args)
+        return kb
+    return wrapper
+
+def invalidate_keyboards(names=KB_DYNAMIC):
+    for key in [k for k in KB_CACHE if k[0] in names]:
+        del KB_CACHE[key]
+
+def warm_keyboards():
+    """Собирает статичные клавиатуры при старте — первый клик тоже без сборки."""
+    for kb in (kb_back, kb_adm_back, kb_portfolio, kb_services, kb_cancel_main, kb_cancel_adm,
+               kb_admin_main, kb_broadcast_confirm, kb_svc_list, kb_bookings_nav, kb_reminders,
+               kb_reviews_menu, kb_rating, kb_cancel_review, kb_review_confirm):
+        kb()
+    kb_main(False)
+    kb_main(True)
+    for i in range(len(SERVICES)):
+        kb_svc_edit(i)
+
+@cached_kb
 def kb_main(admin=False) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="📅 Записаться",  callback_data="book_start"))
@@ -478,49 +1821,57 @@ def kb_main(admin=False) -> InlineKeyboardMarkup:
         b.row(InlineKeyboardButton(text="🛠 Панель администратора", callback_data="admin_panel"))
     return b.as_markup()
 
+@cached_kb
 def kb_back() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu"))
     return b.as_markup()
 
+@cached_kb
 def kb_adm_back() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="🔙 Панель администратора", callback_data="admin_panel"))
     return b.as_markup()
 
+@cached_kb
 def kb_portfolio() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="🌸 Смотреть работы", url=PORTFOLIO_LINK))
     b.row(InlineKeyboardButton(text="🔙 Главное меню",    callback_data="main_menu"))
     return b.as_markup()
 
+@cached_kb
 def kb_services() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     for i, (name, price) in enumerate(SERVICES):
-        b.button(text=f"{name}  —  {price}", callback_data=f"svc:{i}")
+        b.button(text=f"{name}  —  {price}", callback_data=SvcCb(idx=i).pack())
     b.adjust(1)
     b.row(InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu"))
     return b.as_markup()
 
+@cached_kb
 def kb_svc_page(svc_index: int, master_url: str) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="✍️ Написать мастеру", url=master_url))
     b.row(InlineKeyboardButton(text="✅ Мастер одобрил — оформить запись",
-                               callback_data=f"booking_approved:{svc_index}"))
+                               callback_data=BookingApprovedCb(idx=svc_index).pack()))
     b.row(InlineKeyboardButton(text="🔙 Выбрать другую услугу", callback_data="book_start"))
     b.row(InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
     return b.as_markup()
 
+@cached_kb
 def kb_cancel_main() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="❌ Отмена", callback_data="main_menu"))
     return b.as_markup()
 
+@cached_kb
 def kb_cancel_adm() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="❌ Отмена", callback_data="admin_panel"))
     return b.as_markup()
 
+@cached_kb
 def kb_admin_main() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="👥 Список пользователей",          callback_data="adm_users"))
@@ -532,53 +1883,60 @@ def kb_admin_main() -> InlineKeyboardMarkup:
         text=f"🔔 Напоминания: {reminder_label()}",
         callback_data="adm_reminders"
     ))
+    b.row(InlineKeyboardButton(
+        text="🔬 Профилирование" + (": идёт" if PROFILER.active else ""),
+        callback_data="adm_profile"
+    ))
     b.row(InlineKeyboardButton(text="🔙 Главное меню",                  callback_data="main_menu"))
     return b.as_markup()
 
+@cached_kb
 def kb_broadcast_confirm() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="✅ Отправить", callback_data="adm_do_broadcast"),
           InlineKeyboardButton(text="❌ Отмена",    callback_data="admin_panel"))
     return b.as_markup()
 
+@cached_kb
 def kb_svc_list() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     for i, (name, _) in enumerate(SERVICES):
-        b.button(text=name, callback_data=f"adm_edit_svc:{i}")
+        b.button(text=name, callback_data=EditSvcCb(idx=i).pack())
     b.adjust(1)
     b.row(InlineKeyboardButton(text="🔙 Панель администратора", callback_data="admin_panel"))
     return b.as_markup()
 
+@cached_kb
 def kb_svc_edit(idx) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
-    b.row(InlineKeyboardButton(text="🔄 Сбросить на стандартный", callback_data=f"adm_reset_svc:{idx}"))
+    b.row(InlineKeyboardButton(text="🔄 Сбросить на стандартный", callback_data=ResetSvcCb(idx=idx).pack()))
     b.row(InlineKeyboardButton(text="❌ Отмена", callback_data="adm_svc_texts"))
     return b.as_markup()
 
+@cached_kb
 def kb_bookings_nav() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="🕐 Ожидают подтверждения", callback_data="adm_book_pending"))
-    b.row(InlineKeyboardButton(text="✅ Подтверждённые",         callback_data="adm_book_confirmed:0"))
+    b.row(InlineKeyboardButton(text="✅ Подтверждённые",         callback_data=ConfirmedPageCb(idx=0).pack()))
     b.row(InlineKeyboardButton(text="🔙 Панель администратора",  callback_data="admin_panel"))
     return b.as_markup()
 
-def kb_booking_moderate(booking_id, datetime_txt="") -> InlineKeyboardMarkup:
+def kb_booking_moderate(booking_id, appt_ts=None) -> InlineKeyboardMarkup:
     """Кнопки для заявки: подтвердить (с автоопределением даты) и отклонить."""
     b = InlineKeyboardBuilder()
-    # Если дата успешно распознана — показываем её в кнопке
-    dt = parse_dt_from_text(datetime_txt) if datetime_txt else None
-    if dt:
-        dt_str = fmt_dt(dt.isoformat())
+    # Если дата и время распознаны — показываем их в кнопке
+    if appt_ts:
+        dt_str = fmt_ts(appt_ts)
         b.row(InlineKeyboardButton(
             text=f"✅ Подтвердить ({dt_str})",
-            callback_data=f"adm_book_ok:{booking_id}"
+            callback_data=BookOkCb(bid=booking_id).pack()
         ))
     else:
         b.row(InlineKeyboardButton(
             text="✅ Подтвердить",
-            callback_data=f"adm_book_ok:{booking_id}"
+            callback_data=BookOkCb(bid=booking_id).pack()
         ))
-    b.row(InlineKeyboardButton(text="❌ Отклонить", callback_data=f"adm_book_del:{booking_id}"))
+    b.row(InlineKeyboardButton(text="❌ Отклонить", callback_data=BookDelCb(bid=booking_id).pack()))
     b.row(InlineKeyboardButton(text="🔙 К заявкам", callback_data="adm_book_pending"))
     return b.as_markup()
 
@@ -587,79 +1945,102 @@ def kb_booking_actions(booking_id) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(
         text="🔔 Отправить напоминание",
-        callback_data=f"adm_remind:{booking_id}"
+        callback_data=RemindCb(bid=booking_id).pack()
     ))
     b.row(InlineKeyboardButton(
         text="❌ Отменить запись",
-        callback_data=f"adm_book_del:{booking_id}"
+        callback_data=BookDelCb(bid=booking_id).pack()
     ))
-    b.row(InlineKeyboardButton(text="🔙 К записям", callback_data="adm_book_confirmed:0"))
+    b.row(InlineKeyboardButton(text="🔙 К записям", callback_data=ConfirmedPageCb(idx=0).pack()))
     return b.as_markup()
 
 def kb_confirmed_nav(idx, total, booking_id) -> InlineKeyboardMarkup:
-    """Навигация по подтверждённым записям + управление."""
+    """Навигация по подтверждённым записям + управление. Курсор — id текущей записи."""
     b = InlineKeyboardBuilder()
     nav = []
     if idx > 0:
-        nav.append(InlineKeyboardButton(text="◀", callback_data=f"adm_book_confirmed:{idx-1}"))
+        nav.append(InlineKeyboardButton(text="◀", callback_data=ConfirmedPageCb(idx=idx-1, direction="prev", anchor=booking_id).pack()))
     nav.append(InlineKeyboardButton(text=f"{idx+1}/{total}", callback_data="noop"))
     if idx < total - 1:
-        nav.append(InlineKeyboardButton(text="▶", callback_data=f"adm_book_confirmed:{idx+1}"))
+        nav.append(InlineKeyboardButton(text="▶", callback_data=ConfirmedPageCb(idx=idx+1, direction="next", anchor=booking_id).pack()))
     if nav: b.row(*nav)
     b.row(InlineKeyboardButton(
         text="🔔 Отправить напоминание",
-        callback_data=f"adm_remind:{booking_id}"
+        callback_data=RemindCb(bid=booking_id).pack()
     ))
     b.row(InlineKeyboardButton(
         text="❌ Отменить запись",
-        callback_data=f"adm_book_del:{booking_id}"
+        callback_data=BookDelCb(bid=booking_id).pack()
     ))
     b.row(InlineKeyboardButton(text="🔙 К записям", callback_data="adm_bookings"))
     return b.as_markup()
 
+@cached_kb
 def kb_reminders() -> InlineKeyboardMarkup:
     """Настройка напоминаний — toggle кнопки."""
     def icon(key): return "✅" if REMINDER_SETTINGS[key] else "❌"
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(
-        text=f"{icon('r24')} За 24 часа",  callback_data="adm_rem_toggle:r24"))
+        text=f"{icon('r24')} За 24 часа",  callback_data=RemToggleCb(kind="r24").pack()))
     b.row(InlineKeyboardButton(
-        text=f"{icon('r12')} За 12 часов", callback_data="adm_rem_toggle:r12"))
+        text=f"{icon('r12')} За 12 часов", callback_data=RemToggleCb(kind="r12").pack()))
     b.row(InlineKeyboardButton(
-        text=f"{icon('r6')}  За 6 часов",  callback_data="adm_rem_toggle:r6"))
+        text=f"{icon('r6')}  За 6 часов",  callback_data=RemToggleCb(kind="r6").pack()))
     b.row(InlineKeyboardButton(
-        text=f"{icon('r1')}  За 1 час",    callback_data="adm_rem_toggle:r1"))
+        text=f"{icon('r1')}  За 1 час",    callback_data=RemToggleCb(kind="r1").pack()))
     b.row(InlineKeyboardButton(text="🔙 Панель администратора", callback_data="admin_panel"))
     return b.as_markup()
 
+@cached_kb
+def kb_profile() -> InlineKeyboardMarkup:
+    b = InlineKeyboardBuilder()
+    if PROFILER.active:
+        b.row(InlineKeyboardButton(text="⏹ Остановить и прислать отчёт", callback_data=ProfileCb(mode="stop").pack()))
+    else:
+        b.row(InlineKeyboardButton(text="⏱ 30 секунд",     callback_data=ProfileCb(mode="s", n=30).pack()),
+              InlineKeyboardButton(text="⏱ 2 минуты",      callback_data=ProfileCb(mode="s", n=120).pack()))
+        b.row(InlineKeyboardButton(text="📨 200 апдейтов",  callback_data=ProfileCb(mode="u", n=200).pack()),
+              InlineKeyboardButton(text="📨 1000 апдейтов", callback_data=ProfileCb(mode="u", n=1000).pack()))
+    b.row(InlineKeyboardButton(text="🔙 Панель администратора", callback_data="admin_panel"))
+    return b.as_markup()
+
+@cached_kb
 def kb_reviews_menu() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
-    b.row(InlineKeyboardButton(text="📖 Смотреть отзывы", callback_data="reviews_browse:0"))
+    b.row(InlineKeyboardButton(text="📖 Смотреть отзывы", callback_data=ReviewsPageCb(idx=0).pack()))
     b.row(InlineKeyboardButton(text="✍️ Написать отзыв",  callback_data="review_write"))
     b.row(InlineKeyboardButton(text="🔙 Главное меню",    callback_data="main_menu"))
     return b.as_markup()
 
+@cached_kb
 def kb_rating() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     for i in range(1, 6):
-        b.button(text="⭐"*i, callback_data=f"rate:{i}")
+        b.button(text="⭐"*i, callback_data=RateCb(rating=i).pack())
     b.adjust(5)
     b.row(InlineKeyboardButton(text="❌ Отмена", callback_data="reviews_menu"))
     return b.as_markup()
 
-def kb_reviews_nav(idx, total) -> InlineKeyboardMarkup:
+@cached_kb
+def kb_cancel_review() -> InlineKeyboardMarkup:
+    b = InlineKeyboardBuilder()
+    b.row(InlineKeyboardButton(text="❌ Отмена", callback_data="reviews_menu"))
+    return b.as_markup()
+
+def kb_reviews_nav(idx, total, review_id) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     row = []
     if idx > 0:
-        row.append(InlineKeyboardButton(text="◀ Назад", callback_data=f"reviews_browse:{idx-1}"))
+        row.append(InlineKeyboardButton(text="◀ Назад", callback_data=ReviewsPageCb(idx=idx-1, direction="prev", anchor=review_id).pack()))
     row.append(InlineKeyboardButton(text=f"{idx+1}/{total}", callback_data="noop"))
     if idx < total - 1:
-        row.append(InlineKeyboardButton(text="Вперёд ▶", callback_data=f"reviews_browse:{idx+1}"))
+        row.append(InlineKeyboardButton(text="Вперёд ▶", callback_data=ReviewsPageCb(idx=idx+1, direction="next", anchor=review_id).pack()))
     b.row(*row)
     b.row(InlineKeyboardButton(text="✍️ Написать отзыв", callback_data="review_write"))
     b.row(InlineKeyboardButton(text="🔙 Главное меню",   callback_data="main_menu"))
     return b.as_markup()
 
+@cached_kb
 def kb_review_confirm() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.row(InlineKeyboardButton(text="✅ Отправить", callback_data="review_submit"),
@@ -669,8 +2050,8 @@ def kb_review_confirm() -> InlineKeyboardMarkup:
 
 def kb_moderate_review(review_id) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
-    b.row(InlineKeyboardButton(text="✅ Одобрить", callback_data=f"adm_rev_ok:{review_id}"),
-          InlineKeyboardButton(text="🗑 Удалить",  callback_data=f"adm_rev_del:{review_id}"))
+    b.row(InlineKeyboardButton(text="✅ Одобрить", callback_data=ReviewOkCb(rid=review_id).pack()),
+          InlineKeyboardButton(text="🗑 Удалить",  callback_data=ReviewDelCb(rid=review_id).pack()))
     b.row(InlineKeyboardButton(text="🔙 К модерации", callback_data="adm_reviews"))
     return b.as_markup()
 
@@ -712,13 +2093,17 @@ PRICES_TEXT = (
 
 auth_router      = Router()
 common_router    = Router()
-user_router      = Router()
 review_router    = Router()
 booking_router   = Router()
-admin_cb_router  = Router()
 admin_fsm_router = Router()
 
-admin_cb_router.callback_query.filter(IsAdmin())
+# Все кнопки — в одном роутере с таблицей по префиксу (см. CallbackTable):
+# нажатие стоит O(1) независимо от числа хэндлеров.
+callback_router  = CallbackRouter(name="callbacks")
+
+def admin_callback(key, *filters):
+    """Регистрация админской кнопки: тот же callback_router + IsAdmin()."""
+    return callback_router.callback_query(key, IsAdmin(), *filters)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -734,6 +2119,20 @@ async def cmd_admin(message: Message, state: FSMContext):
     await state.set_state(AdminFSM.password)
     await message.answer("🔐 <b>Введите пароль администратора:</b>")
 
+@auth_router.message(Command("rebuild_stats"), IsAdmin())
+async def cmd_rebuild_stats(message: Message):
+    """Пересчёт сводки отзывов по таблице reviews — проверка, что счётчики не разошлись."""
+    diff = await db_rebuild_review_stats()
+    if diff:
+        result = "⚠️ <b>Исправлены расхождения:</b>\n" + "\n".join(
+            f"{r}★: было {old}, стало {new}" for r, (old, new) in diff.items())
+    else:
+        result = "✅ Сводка сходилась с отзывами."
+    await message.answer(
+        f"📊 <b>Рейтинг:</b> {fmt_review_stats()}\n\n<pre>{fmt_review_histogram()}</pre>\n\n{result}",
+        reply_markup=kb_adm_back()
+    )
+
 @auth_router.message(AdminFSM.password)
 async def fsm_password(message: Message, state: FSMContext):
     if message.text and message.text.strip() == ADMIN_PASSWORD:
@@ -761,21 +2160,21 @@ async def cmd_start(message: Message, state: FSMContext):
     await db_save_user(u.id, u.username, u.first_name)
     await message.answer(WELCOME, reply_markup=kb_main(is_admin(u.id)))
 
-@common_router.callback_query(F.data == "main_menu")
+@callback_router.callback_query("main_menu")
 async def cb_main_menu(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     await state.clear()
     await cb.message.edit_text(WELCOME, reply_markup=kb_main(is_admin(cb.from_user.id)))
 
-@common_router.callback_query(F.data == "noop")
+@callback_router.callback_query("noop")
 async def cb_noop(cb: CallbackQuery): await cb.answer()
 
-@common_router.callback_query(F.data == "prices")
+@callback_router.callback_query("prices")
 async def cb_prices(cb: CallbackQuery):
     await cb.answer()
     await cb.message.edit_text(PRICES_TEXT, reply_markup=kb_back())
 
-@common_router.callback_query(F.data == "portfolio")
+@callback_router.callback_query("portfolio")
 async def cb_portfolio(cb: CallbackQuery):
     await cb.answer()
     await cb.message.edit_text(
@@ -788,18 +2187,18 @@ async def cb_portfolio(cb: CallbackQuery):
 #  ЗАПИСЬ (клиент)
 # ══════════════════════════════════════════════════════════════════════════════
 
-@user_router.callback_query(F.data == "book_start")
+@callback_router.callback_query("book_start")
 async def cb_book_start(cb: CallbackQuery):
     await cb.answer()
     await cb.message.edit_text("💇‍♀️ <b>Выберите услугу для записи:</b>", reply_markup=kb_services())
 
-@user_router.callback_query(F.data.startswith("svc:"))
-async def cb_svc(cb: CallbackQuery):
+@callback_router.callback_query(SvcCb)
+async def cb_svc(cb: CallbackQuery, callback_data: SvcCb):
     await cb.answer()
-    idx = int(cb.data.split(":")[1])
+    idx = callback_data.idx
     if idx >= len(SERVICES): return
     name, price = SERVICES[idx]
-    url = await make_master_link(idx)
+    url = make_master_link(idx)
     await cb.message.edit_text(
         f"✅ Вы выбрали: <b>{name}</b>  —  {price}\n\n"
         f"<b>Шаг 1:</b> Нажмите «Написать мастеру», договоритесь о дате и времени.\n\n"
@@ -807,28 +2206,28 @@ async def cb_svc(cb: CallbackQuery):
         reply_markup=kb_svc_page(idx, url)
     )
 
-@booking_router.callback_query(F.data.startswith("booking_approved:"))
-async def cb_booking_approved(cb: CallbackQuery, state: FSMContext):
+@callback_router.callback_query(BookingApprovedCb)
+async def cb_booking_approved(cb: CallbackQuery, state: FSMContext, callback_data: BookingApprovedCb):
     await cb.answer()
-    idx  = int(cb.data.split(":")[1])
+    idx  = callback_data.idx
     name = SERVICES[idx][0]
     await state.set_state(BookingFSM.datetime_txt)
     await state.update_data(booking_service=name)
     await cb.message.edit_text(
         f"📅 <b>Оформление записи</b>\n\nУслуга: <b>{name}</b>\n\n"
         f"Введите дату и время, которые вы согласовали с мастером:\n"
-        f"<i>Пример: <code>15.01 14:00</code> или <code>15.01.2025 14:00</code></i>",
+        f"<i>Пример: <code>15.01 14:00</code> или <code>15 января в 14:00</code></i>",
         reply_markup=kb_cancel_main()
     )
 
 @booking_router.message(BookingFSM.datetime_txt)
-async def fsm_booking_dt(message: Message, state: FSMContext, bot: Bot):
+async def fsm_booking_dt(message: Message, state: FSMContext):
     text    = (message.text or "").strip()
     data    = await state.get_data()
     service = data.get("booking_service", "—")
     u       = message.from_user
 
-    bid = await db_add_booking(u.id, u.username, u.first_name, service, text)
+    bid, appt_ts, conf = await db_add_booking(u.id, u.username, u.first_name, service, text)
     await state.clear()
 
     await message.answer(
@@ -840,69 +2239,71 @@ async def fsm_booking_dt(message: Message, state: FSMContext, bot: Bot):
     name  = u.first_name or "Аноним"
     uname = f" (@{u.username})" if u.username else ""
 
-    # Пробуем автоматически распознать дату
-    dt_auto = parse_dt_from_text(text)
-    dt_hint = f"\n\n🤖 Автоопределённая дата: <b>{fmt_dt(dt_auto.isoformat())}</b>" if dt_auto else \
-              "\n\n⚠️ Дату не удалось распознать автоматически."
+    # Дата уже распознана при сохранении заявки
+    if conf == DT_EXACT:
+        dt_hint = f"\n\n🤖 Автоопределённая дата: <b>{fmt_ts(appt_ts)}</b>"
+    elif conf == DT_DATE:
+        dt_hint = f"\n\n🤖 Распознана только дата: <b>{fmt_ts(appt_ts, False)}</b> — время нужно уточнить."
+    else:
+        dt_hint = "\n\n⚠️ Дату не удалось распознать автоматически."
 
-    try:
-        await bot.send_message(
-            ADMIN_ID,
-            f"📋 <b>Новая заявка #{bid}!</b>\n\n"
-            f"👤 <b>{name}</b>{uname}\n"
-            f"💇‍♀️ <b>{service}</b>\n"
-            f"📅 Клиент написал: <b>{text}</b>"
-            f"{dt_hint}",
-            reply_markup=kb_booking_moderate(bid, text)
-        )
-    except: pass
+    await OUTBOX.enqueue(
+        ADMIN_ID,
+        f"📋 <b>Новая заявка #{bid}!</b>\n\n"
+        f"👤 <b>{name}</b>{uname}\n"
+        f"💇‍♀️ <b>{service}</b>\n"
+        f"📅 Клиент написал: <b>{text}</b>"
+        f"{dt_hint}",
+        "admin_alert",
+        reply_markup=kb_booking_moderate(bid, appt_ts if conf == DT_EXACT else None)
+    )
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  ОТЗЫВЫ
 # ══════════════════════════════════════════════════════════════════════════════
 
-@review_router.callback_query(F.data == "reviews_menu")
+@callback_router.callback_query("reviews_menu")
 async def cb_reviews_menu(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     await state.clear()
-    total = await db_count_approved_reviews()
     await cb.message.edit_text(
-        f"⭐ <b>Отзывы клиентов</b>\n\nВсего: <b>{total}</b>\n\nПочитайте или оставьте свой:",
+        f"⭐ <b>Отзывы клиентов</b>\n\n{fmt_review_stats()}\n\nПочитайте или оставьте свой:",
         reply_markup=kb_reviews_menu()
     )
 
-@review_router.callback_query(F.data.startswith("reviews_browse:"))
-async def cb_reviews_browse(cb: CallbackQuery):
+@callback_router.callback_query(ReviewsPageCb)
+async def cb_reviews_browse(cb: CallbackQuery, callback_data: ReviewsPageCb):
     await cb.answer()
-    idx     = int(cb.data.split(":")[1])
-    reviews = await db_get_approved_reviews()
-    total   = len(reviews)
-    if total == 0:
+    idx    = callback_data.idx
+    anchor = callback_data.anchor
+    review = await db_get_approved_review_at(anchor, callback_data.direction) if anchor is not None else None
+    if review is None:
+        idx, review = 0, await db_get_approved_review_at()
+    total = await db_count_approved_reviews()
+    if review is None or total == 0:
         await cb.message.edit_text("💬 <b>Отзывов пока нет.</b>\n\nБудьте первым!", reply_markup=kb_reviews_menu())
         return
     idx = max(0, min(idx, total-1))
-    await cb.message.edit_text(fmt_review(reviews[idx], idx+1, total), reply_markup=kb_reviews_nav(idx, total))
+    await cb.message.edit_text(fmt_review(review, idx+1, total), reply_markup=kb_reviews_nav(idx, total, review["id"]))
 
-@review_router.callback_query(F.data == "review_write")
+@callback_router.callback_query("review_write")
 async def cb_review_write(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     await state.clear()
     await state.set_state(ReviewFSM.rating)
     await cb.message.edit_text("✍️ <b>Оставить отзыв</b>\n\nШаг 1 из 2: Выберите оценку 👇", reply_markup=kb_rating())
 
-@review_router.callback_query(ReviewFSM.rating, F.data.startswith("rate:"))
-async def cb_rate(cb: CallbackQuery, state: FSMContext):
+@callback_router.callback_query(RateCb, ReviewFSM.rating)
+async def cb_rate(cb: CallbackQuery, state: FSMContext, callback_data: RateCb):
     await cb.answer()
-    r = int(cb.data.split(":")[1])
+    r = callback_data.rating
     await state.update_data(rating=r)
     await state.set_state(ReviewFSM.text)
     await cb.message.edit_text(
         f"✍️ <b>Оставить отзыв</b>\n\nОценка: {stars(r)}\n\n"
         f"Шаг 2 из 2: Напишите ваш отзыв 👇\n<i>(минимум 10 символов)</i>",
-        reply_markup=InlineKeyboardBuilder().row(
-            InlineKeyboardButton(text="❌ Отмена", callback_data="reviews_menu")
-        ).as_markup()
+        reply_markup=kb_cancel_review()
     )
 
 @review_router.message(ReviewFSM.text)
@@ -919,8 +2320,8 @@ async def fsm_review_text(message: Message, state: FSMContext):
         reply_markup=kb_review_confirm()
     )
 
-@review_router.callback_query(F.data == "review_submit")
-async def cb_review_submit(cb: CallbackQuery, state: FSMContext, bot: Bot):
+@callback_router.callback_query("review_submit")
+async def cb_review_submit(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     data   = await state.get_data()
     rating = data.get("rating")
@@ -938,18 +2339,16 @@ async def cb_review_submit(cb: CallbackQuery, state: FSMContext, bot: Bot):
     )
     name  = u.first_name or "Аноним"
     uname = f" (@{u.username})" if u.username else ""
-    try:
-        await bot.send_message(ADMIN_ID,
-            f"🔔 <b>Новый отзыв!</b>\n\nОт: <b>{name}</b>{uname}\nОценка: {stars(rating)}\n\n{text}",
-            reply_markup=kb_moderate_review(rid))
-    except: pass
+    await OUTBOX.enqueue(ADMIN_ID,
+        f"🔔 <b>Новый отзыв!</b>\n\nОт: <b>{name}</b>{uname}\nОценка: {stars(rating)}\n\n{text}",
+        "admin_alert", reply_markup=kb_moderate_review(rid))
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 #  ADMIN — CALLBACK
 # ══════════════════════════════════════════════════════════════════════════════
 
-@admin_cb_router.callback_query(F.data == "admin_panel")
+@admin_callback("admin_panel")
 async def cb_admin_panel(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     await state.clear()
@@ -957,11 +2356,11 @@ async def cb_admin_panel(cb: CallbackQuery, state: FSMContext):
 
 # ── Пользователи ──────────────────────────────────────────────────────────────
 
-@admin_cb_router.callback_query(F.data == "adm_users")
+@admin_callback("adm_users")
 async def cb_adm_users(cb: CallbackQuery):
     await cb.answer()
-    users = await db_get_all_users()
-    total = len(users)
+    total = await db_count_users()
+    users = await db_get_latest_users(50)
     if not users:
         await cb.message.edit_text("👥 <b>Пользователей пока нет.</b>", reply_markup=kb_adm_back())
         return
@@ -974,97 +2373,102 @@ async def cb_adm_users(cb: CallbackQuery):
 
 # ── Записи клиентов ───────────────────────────────────────────────────────────
 
-@admin_cb_router.callback_query(F.data == "adm_bookings")
+@admin_callback("adm_bookings")
 async def cb_adm_bookings(cb: CallbackQuery):
     await cb.answer()
-    p = await db_get_pending_bookings()
-    c = await db_get_confirmed_bookings()
+    p = await db_count_pending_bookings()
+    c = await db_count_confirmed_bookings()
     await cb.message.edit_text(
         f"📋 <b>Записи клиентов</b>\n\n"
-        f"🕐 Ожидают подтверждения: <b>{len(p)}</b>\n"
-        f"✅ Подтверждённые: <b>{len(c)}</b>",
+        f"🕐 Ожидают подтверждения: <b>{p}</b>\n"
+        f"✅ Подтверждённые: <b>{c}</b>",
         reply_markup=kb_bookings_nav()
     )
 
-@admin_cb_router.callback_query(F.data == "adm_book_pending")
+@admin_callback("adm_book_pending")
 async def cb_adm_book_pending(cb: CallbackQuery):
     await cb.answer()
-    bookings = await db_get_pending_bookings()
+    bookings = await db_get_pending_bookings(limit=1)
     if not bookings:
         await cb.message.edit_text("🕐 <b>Заявок на подтверждение нет.</b>", reply_markup=kb_bookings_nav())
         return
+    total = await db_count_pending_bookings()
     b     = bookings[0]
     name  = b["first_name"] or "Аноним"
     uname = f" (@{b['username']})" if b["username"] else ""
 
-    # Автоопределение даты из текста клиента
-    dt_auto = parse_dt_from_text(b["datetime_txt"])
-    dt_line = f"\n🤖 Авто: <b>{fmt_dt(dt_auto.isoformat())}</b>" if dt_auto else \
-              "\n⚠️ Дату не удалось определить автоматически"
+    # Дата распознана один раз при создании заявки
+    exact = b["dt_confidence"] == DT_EXACT
+    if exact:
+        dt_line = f"\n🤖 Авто: <b>{fmt_ts(b['appt_ts'])}</b>"
+    elif b["dt_confidence"] == DT_DATE:
+        dt_line = f"\n🤖 Авто: <b>{fmt_ts(b['appt_ts'], False)}</b>, время не указано"
+    else:
+        dt_line = "\n⚠️ Дату не удалось определить автоматически"
 
     await cb.message.edit_text(
-        f"🕐 <b>Заявок: {len(bookings)} шт.</b>\n\n{'─'*26}\n"
+        f"🕐 <b>Заявок: {total} шт.</b>\n\n{'─'*26}\n"
         f"👤 <b>{name}</b>{uname}\n"
         f"💇‍♀️ <b>{b['service_name']}</b>\n"
         f"📅 Написал: <b>{b['datetime_txt']}</b>"
         f"{dt_line}\n"
         f"🕒 Заявка: {b['created_at'][:16].replace('T',' ')}",
-        reply_markup=kb_booking_moderate(b["id"], b["datetime_txt"])
+        reply_markup=kb_booking_moderate(b["id"], b["appt_ts"] if exact else None)
     )
 
-@admin_cb_router.callback_query(F.data.startswith("adm_book_confirmed:"))
-async def cb_adm_book_confirmed(cb: CallbackQuery):
+@admin_callback(ConfirmedPageCb)
+async def cb_adm_book_confirmed(cb: CallbackQuery, callback_data: ConfirmedPageCb):
     await cb.answer()
-    idx      = int(cb.data.split(":")[1])
-    bookings = await db_get_confirmed_bookings()
-    if not bookings:
+    idx    = callback_data.idx
+    anchor = callback_data.anchor
+    b      = await db_get_confirmed_booking_at(anchor, callback_data.direction) if anchor is not None else None
+    if b is None:
+        idx, b = 0, await db_get_confirmed_booking_at()
+    total = await db_count_confirmed_bookings()
+    if b is None or total == 0:
         await cb.message.edit_text("✅ <b>Подтверждённых записей нет.</b>", reply_markup=kb_bookings_nav())
         return
-    idx = max(0, min(idx, len(bookings)-1))
-    b     = bookings[idx]
+    idx   = max(0, min(idx, total-1))
     name  = b["first_name"] or "Аноним"
     uname = f" (@{b['username']})" if b["username"] else ""
-    dt    = fmt_dt(b["appt_dt"]) if b["appt_dt"] else b["datetime_txt"]
+    dt    = fmt_ts(b["appt_ts"]) if b["appt_ts"] else b["datetime_txt"]
     await cb.message.edit_text(
-        f"✅ <b>Подтверждённые записи: {len(bookings)} шт.</b>\n\n{'─'*26}\n"
+        f"✅ <b>Подтверждённые записи: {total} шт.</b>\n\n{'─'*26}\n"
         f"👤 <b>{name}</b>{uname}\n"
         f"💇‍♀️ <b>{b['service_name']}</b>\n"
         f"📅 <b>{dt}</b>",
-        reply_markup=kb_confirmed_nav(idx, len(bookings), b["id"])
+        reply_markup=kb_confirmed_nav(idx, total, b["id"])
     )
 
-@admin_cb_router.callback_query(F.data.startswith("adm_book_ok:"))
-async def cb_adm_book_ok(cb: CallbackQuery, bot: Bot):
+@admin_callback(BookOkCb)
+async def cb_adm_book_ok(cb: CallbackQuery, state: FSMContext, callback_data: BookOkCb):
     """
     Подтверждение записи одной кнопкой.
-    Дата берётся автоматически из текста клиента.
+    Дата берётся из распознанной при создании заявки (appt_ts).
     """
     await cb.answer()
-    bid     = int(cb.data.split(":")[1])
+    bid     = callback_data.bid
     booking = await db_get_booking(bid)
     if not booking:
         await cb.answer("Запись не найдена.", show_alert=True)
         return
 
-    dt = parse_dt_from_text(booking["datetime_txt"])
-
-    if dt:
-        # Дата распознана — подтверждаем сразу
-        await db_confirm_booking(bid, dt.isoformat())
-        dt_fmt = fmt_dt(dt.isoformat())
+    if booking["dt_confidence"] == DT_EXACT:
+        # Дата и время распознаны — подтверждаем сразу
+        await db_confirm_booking(bid, booking["appt_ts"])
+        dt_fmt = fmt_ts(booking["appt_ts"])
         active = reminder_label()
 
-        try:
-            await bot.send_message(
-                booking["user_id"],
-                f"🎉 <b>Ваша запись подтверждена!</b>\n\n"
-                f"💇‍♀️ Услуга: <b>{booking['service_name']}</b>\n"
-                f"📅 Дата и время: <b>{dt_fmt}</b>\n"
-                f"✂️ Мастер: <b>{MASTER_NAME_FULL}</b>\n\n"
-                f"Напоминания придут автоматически ({active}).\n"
-                f"<i>Если нужно перенести — напишите мастеру.</i>"
-            )
-        except: pass
+        await OUTBOX.enqueue(
+            booking["user_id"],
+            f"🎉 <b>Ваша запись подтверждена!</b>\n\n"
+            f"💇‍♀️ Услуга: <b>{booking['service_name']}</b>\n"
+            f"📅 Дата и время: <b>{dt_fmt}</b>\n"
+            f"✂️ Мастер: <b>{MASTER_NAME_FULL}</b>\n\n"
+            f"Напоминания придут автоматически ({active}).\n"
+            f"<i>Если нужно перенести — напишите мастеру.</i>",
+            "confirm"
+        )
 
         await cb.message.edit_text(
             f"✅ <b>Запись #{bid} подтверждена!</b>\n\n"
@@ -1082,55 +2486,52 @@ async def cb_adm_book_ok(cb: CallbackQuery, bot: Bot):
             f"<i>Формат: <code>ДД.ММ.ГГГГ ЧЧ:ММ</code>\nПример: <code>15.01.2025 14:00</code></i>",
             reply_markup=kb_cancel_adm()
         )
-        # Сохраняем в FSM для обработки ввода
-        # (используем временный state через message, но у нас callback — сохраняем в БД)
-        # Запишем booking_id в settings как временное значение
-        await db_save_setting("pending_confirm_bid", str(bid))
+        # Ждём дату от этого админа; у каждого админа — своё состояние
+        await state.set_state(AdminFSM.confirm_date)
+        await state.update_data(confirm_bid=bid)
 
-@admin_cb_router.callback_query(F.data.startswith("adm_book_del:"))
-async def cb_adm_book_del(cb: CallbackQuery, bot: Bot):
+@admin_callback(BookDelCb)
+async def cb_adm_book_del(cb: CallbackQuery, callback_data: BookDelCb):
     await cb.answer()
-    bid     = int(cb.data.split(":")[1])
+    bid     = callback_data.bid
     booking = await db_get_booking(bid)
     await db_cancel_booking(bid)
     if booking:
-        try:
-            await bot.send_message(
-                booking["user_id"],
-                f"😔 <b>Ваша запись отменена.</b>\n\n"
-                f"Услуга: <b>{booking['service_name']}</b>\n\n"
-                f"Если хотите перенести — напишите мастеру.",
-                reply_markup=kb_main(False)
-            )
-        except: pass
+        await OUTBOX.enqueue(
+            booking["user_id"],
+            f"😔 <b>Ваша запись отменена.</b>\n\n"
+            f"Услуга: <b>{booking['service_name']}</b>\n\n"
+            f"Если хотите перенести — напишите мастеру.",
+            "cancel",
+            reply_markup=kb_main(False)
+        )
     await cb.message.edit_text(
         f"❌ Запись #{bid} отменена, клиент уведомлён.",
         reply_markup=kb_bookings_nav()
     )
 
-@admin_cb_router.callback_query(F.data.startswith("adm_remind:"))
-async def cb_adm_remind(cb: CallbackQuery, bot: Bot):
+@admin_callback(RemindCb)
+async def cb_adm_remind(cb: CallbackQuery, callback_data: RemindCb):
     await cb.answer("🔔 Напоминание отправлено!")
-    bid     = int(cb.data.split(":")[1])
+    bid     = callback_data.bid
     booking = await db_get_booking(bid)
     if not booking:
         await cb.answer("Запись не найдена.", show_alert=True)
         return
-    dt = fmt_dt(booking["appt_dt"]) if booking["appt_dt"] else booking["datetime_txt"]
-    try:
-        await bot.send_message(
-            booking["user_id"],
-            f"🔔 <b>Напоминание о вашей записи!</b>\n\n"
-            f"💇‍♀️ Услуга: <b>{booking['service_name']}</b>\n"
-            f"📅 Дата и время: <b>{dt}</b>\n"
-            f"✂️ Мастер: <b>{MASTER_NAME_FULL}</b>\n\n"
-            f"<i>Ждём вас! 🌸</i>"
-        )
-    except: pass
+    dt = fmt_ts(booking["appt_ts"]) if booking["appt_ts"] else booking["datetime_txt"]
+    await OUTBOX.enqueue(
+        booking["user_id"],
+        f"🔔 <b>Напоминание о вашей записи!</b>\n\n"
+        f"💇‍♀️ Услуга: <b>{booking['service_name']}</b>\n"
+        f"📅 Дата и время: <b>{dt}</b>\n"
+        f"✂️ Мастер: <b>{MASTER_NAME_FULL}</b>\n\n"
+        f"<i>Ждём вас! 🌸</i>",
+        "reminder"
+    )
 
 # ── Настройка напоминаний ─────────────────────────────────────────────────────
 
-@admin_cb_router.callback_query(F.data == "adm_reminders")
+@admin_callback("adm_reminders")
 async def cb_adm_reminders(cb: CallbackQuery):
     await cb.answer()
     await cb.message.edit_text(
@@ -1141,10 +2542,10 @@ async def cb_adm_reminders(cb: CallbackQuery):
         reply_markup=kb_reminders()
     )
 
-@admin_cb_router.callback_query(F.data.startswith("adm_rem_toggle:"))
-async def cb_adm_rem_toggle(cb: CallbackQuery):
+@admin_callback(RemToggleCb)
+async def cb_adm_rem_toggle(cb: CallbackQuery, callback_data: RemToggleCb):
     await cb.answer()
-    key = cb.data.split(":")[1]  # r24 / r12 / r6 / r1
+    key = callback_data.kind
     if key not in REMINDER_SETTINGS:
         return
     # Переключаем
@@ -1152,12 +2553,45 @@ async def cb_adm_rem_toggle(cb: CallbackQuery):
     # Сохраняем в БД
     db_key = key.replace("r", "reminder_")
     await db_save_setting(db_key, "1" if REMINDER_SETTINGS[key] else "0")
+    invalidate_keyboards()
+    if LEADER.is_leader:
+        await REMINDERS.rebuild()
     # Обновляем клавиатуру
     await cb.message.edit_reply_markup(reply_markup=kb_reminders())
 
+# ── Профилирование ────────────────────────────────────────────────────────────
+
+@admin_callback("adm_profile")
+async def cb_adm_profile(cb: CallbackQuery):
+    await cb.answer()
+    await cb.message.edit_text(
+        f"🔬 <b>Профилирование</b>\n\n{PROFILER.status()}\n\n"
+        f"<i>Пока идёт замер, бот работает заметно медленнее. "
+        f"Отчёт и .prof-файл придут в этот чат.</i>",
+        reply_markup=kb_profile()
+    )
+
+@admin_callback(ProfileCb)
+async def cb_adm_prof(cb: CallbackQuery, bot: Bot, callback_data: ProfileCb):
+    mode, n = callback_data.mode, callback_data.n
+    if mode == "stop":
+        await cb.answer("Останавливаю…")
+        await PROFILER.stop()
+        return
+    if n is None:
+        await cb.answer()   # иначе у кнопки так и крутятся часики
+        return
+    if not PROFILER.start(bot, cb.message.chat.id,
+                          seconds=n if mode == "s" else None,
+                          updates=n if mode == "u" else None):
+        await cb.answer("Замер уже идёт.", show_alert=True)
+        return
+    await cb.answer("Профилирование включено")
+    await cb.message.edit_text(f"🔬 <b>Профилирование</b>\n\n{PROFILER.status()}", reply_markup=kb_profile())
+
 # ── Тексты услуг ──────────────────────────────────────────────────────────────
 
-@admin_cb_router.callback_query(F.data == "adm_svc_texts")
+@admin_callback("adm_svc_texts")
 async def cb_adm_svc_texts(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     await state.clear()
@@ -1166,10 +2600,10 @@ async def cb_adm_svc_texts(cb: CallbackQuery, state: FSMContext):
         reply_markup=kb_svc_list()
     )
 
-@admin_cb_router.callback_query(F.data.startswith("adm_edit_svc:"))
-async def cb_adm_edit_svc(cb: CallbackQuery, state: FSMContext):
+@admin_callback(EditSvcCb)
+async def cb_adm_edit_svc(cb: CallbackQuery, state: FSMContext, callback_data: EditSvcCb):
     await cb.answer()
-    idx     = int(cb.data.split(":")[1])
+    idx     = callback_data.idx
     current = await db_get_service_text(idx)
     custom  = current != DEFAULT_SERVICE_TEXTS[idx]
     await state.set_state(AdminFSM.edit_svc_text)
@@ -1181,10 +2615,10 @@ async def cb_adm_edit_svc(cb: CallbackQuery, state: FSMContext):
         reply_markup=kb_svc_edit(idx)
     )
 
-@admin_cb_router.callback_query(F.data.startswith("adm_reset_svc:"))
-async def cb_adm_reset_svc(cb: CallbackQuery, state: FSMContext):
+@admin_callback(ResetSvcCb)
+async def cb_adm_reset_svc(cb: CallbackQuery, state: FSMContext, callback_data: ResetSvcCb):
     await cb.answer()
-    idx = int(cb.data.split(":")[1])
+    idx = callback_data.idx
     await db_reset_service_text(idx)
     await state.clear()
     await cb.message.edit_text(
@@ -1194,7 +2628,7 @@ async def cb_adm_reset_svc(cb: CallbackQuery, state: FSMContext):
 
 # ── Рассылка ──────────────────────────────────────────────────────────────────
 
-@admin_cb_router.callback_query(F.data == "adm_broadcast")
+@admin_callback("adm_broadcast")
 async def cb_adm_broadcast(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     total = await db_count_users()
@@ -1204,73 +2638,65 @@ async def cb_adm_broadcast(cb: CallbackQuery, state: FSMContext):
         reply_markup=kb_adm_back()
     )
 
-@admin_cb_router.callback_query(F.data == "adm_do_broadcast")
+@admin_callback("adm_do_broadcast")
 async def cb_adm_do_broadcast(cb: CallbackQuery, state: FSMContext, bot: Bot):
     await cb.answer()
     if await state.get_state() != AdminFSM.broadcast_confirm:
         await cb.answer("Сначала введите текст.", show_alert=True)
         return
-    data     = await state.get_data()
-    text     = data.get("broadcast_text", "")
-    user_ids = await db_get_all_user_ids()
+    data = await state.get_data()
+    text = data.get("broadcast_text", "")
     await state.clear()
-    sent = failed = 0
-    await cb.message.edit_text(f"📣 Отправляю... ({len(user_ids)} получателей)")
-    for uid in user_ids:
-        try:
-            await bot.send_message(uid, text, parse_mode="HTML")
-            sent += 1
-            await asyncio.sleep(0.05)
-        except: failed += 1
-    await cb.message.answer(
-        f"✅ <b>Рассылка завершена!</b>\n\n✔ Отправлено: <b>{sent}</b>\n✖ Ошибок: <b>{failed}</b>",
-        reply_markup=kb_admin_main()
-    )
+    job_id, total = await db_create_broadcast(text, cb.message.chat.id, cb.message.message_id)
+    await cb.message.edit_text(f"📣 Отправляю... ({total} получателей)")
+    start_broadcast(bot, job_id)
 
 # ── Модерация отзывов ─────────────────────────────────────────────────────────
 
-@admin_cb_router.callback_query(F.data == "adm_reviews")
+@admin_callback("adm_reviews")
 async def cb_adm_reviews(cb: CallbackQuery):
     await cb.answer()
-    pending = await db_get_pending_reviews()
+    pending = await db_get_pending_reviews(limit=1)
     if not pending:
         await cb.message.edit_text("🛡 <b>Нет отзывов на проверке.</b>", reply_markup=kb_adm_back())
         return
+    total = await db_count_pending_reviews()
     r     = pending[0]
     name  = r["first_name"] or "Аноним"
     uname = f" (@{r['username']})" if r["username"] else ""
     await cb.message.edit_text(
-        f"🛡 <b>Модерация: {len(pending)} шт.</b>\n\n{'─'*26}\n"
+        f"🛡 <b>Модерация: {total} шт.</b>\n\n{'─'*26}\n"
         f"От: <b>{name}</b>{uname} | {r['created_at'][:10]}\n"
         f"Оценка: {stars(r['rating'])}\n\n{r['text']}",
         reply_markup=kb_moderate_review(r["id"])
     )
 
 async def _next_review(cb):
-    pending = await db_get_pending_reviews()
+    pending = await db_get_pending_reviews(limit=1)
     if not pending:
         await cb.message.edit_text("🛡 <b>Все отзывы проверены!</b>", reply_markup=kb_adm_back())
         return
+    total = await db_count_pending_reviews()
     r     = pending[0]
     name  = r["first_name"] or "Аноним"
     uname = f" (@{r['username']})" if r["username"] else ""
     await cb.message.edit_text(
-        f"🛡 <b>Модерация: {len(pending)} шт.</b>\n\n{'─'*26}\n"
+        f"🛡 <b>Модерация: {total} шт.</b>\n\n{'─'*26}\n"
         f"От: <b>{name}</b>{uname} | {r['created_at'][:10]}\n"
         f"Оценка: {stars(r['rating'])}\n\n{r['text']}",
         reply_markup=kb_moderate_review(r["id"])
     )
 
-@admin_cb_router.callback_query(F.data.startswith("adm_rev_ok:"))
-async def cb_adm_rev_ok(cb: CallbackQuery):
+@admin_callback(ReviewOkCb)
+async def cb_adm_rev_ok(cb: CallbackQuery, callback_data: ReviewOkCb):
     await cb.answer("✅ Одобрен!")
-    await db_set_review_status(int(cb.data.split(":")[1]), "approved")
+    await db_set_review_status(callback_data.rid, "approved")
     await _next_review(cb)
 
-@admin_cb_router.callback_query(F.data.startswith("adm_rev_del:"))
-async def cb_adm_rev_del(cb: CallbackQuery):
+@admin_callback(ReviewDelCb)
+async def cb_adm_rev_del(cb: CallbackQuery, callback_data: ReviewDelCb):
     await cb.answer("🗑 Удалён.")
-    await db_set_review_status(int(cb.data.split(":")[1]), "rejected")
+    await db_set_review_status(callback_data.rid, "rejected")
     await _next_review(cb)
 
 
@@ -1308,22 +2734,13 @@ async def fsm_svc_text(message: Message, state: FSMContext):
         reply_markup=kb_svc_list()
     )
 
-@admin_fsm_router.message(F.text)
-async def fsm_manual_date_input(message: Message, bot: Bot):
-    """
-    Ловим ввод даты вручную если автоопределение не сработало.
-    Используется только если в settings есть pending_confirm_bid.
-    """
-    if not is_admin(message.from_user.id):
-        return
-    # Проверяем есть ли ожидающее подтверждение
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT value FROM settings WHERE key='pending_confirm_bid'")
-        row = await cur.fetchone()
-    if not row:
+@admin_fsm_router.message(AdminFSM.confirm_date)
+async def fsm_manual_date_input(message: Message, state: FSMContext):
+    """Ввод даты вручную, если автоопределение не сработало."""
+    bid = (await state.get_data()).get("confirm_bid")
+    if bid is None:
+        await state.clear()
         return
-
-    bid  = int(row[0])
     text = (message.text or "").strip()
 
     # Пробуем распознать дату
@@ -1345,31 +2762,28 @@ async def fsm_manual_date_input(message: Message, bot: Bot):
         )
         return
 
+    await state.clear()
     booking = await db_get_booking(bid)
     if not booking:
         await message.answer("Запись не найдена.")
         return
 
-    await db_confirm_booking(bid, dt.isoformat())
-    # Очищаем временный флаг
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM settings WHERE key='pending_confirm_bid'")
-        await db.commit()
+    appt_ts = int(dt.timestamp())
+    await db_confirm_booking(bid, appt_ts)
 
-    dt_fmt = fmt_dt(dt.isoformat())
+    dt_fmt = fmt_ts(appt_ts)
     active = reminder_label()
 
-    try:
-        await bot.send_message(
-            booking["user_id"],
-            f"🎉 <b>Ваша запись подтверждена!</b>\n\n"
-            f"💇‍♀️ Услуга: <b>{booking['service_name']}</b>\n"
-            f"📅 Дата и время: <b>{dt_fmt}</b>\n"
-            f"✂️ Мастер: <b>{MASTER_NAME_FULL}</b>\n\n"
-            f"Напоминания придут автоматически ({active}).\n"
-            f"<i>Если нужно перенести — напишите мастеру.</i>"
-        )
-    except: pass
+    await OUTBOX.enqueue(
+        booking["user_id"],
+        f"🎉 <b>Ваша запись подтверждена!</b>\n\n"
+        f"💇‍♀️ Услуга: <b>{booking['service_name']}</b>\n"
+        f"📅 Дата и время: <b>{dt_fmt}</b>\n"
+        f"✂️ Мастер: <b>{MASTER_NAME_FULL}</b>\n\n"
+        f"Напоминания придут автоматически ({active}).\n"
+        f"<i>Если нужно перенести — напишите мастеру.</i>",
+        "confirm"
+    )
 
     await message.answer(
         f"✅ <b>Запись #{bid} подтверждена!</b>\n\n"
@@ -1380,65 +2794,745 @@ async def fsm_manual_date_input(message: Message, bot: Bot):
 
 
 # ══════════════════════════════════════════════════════════════════════════════
-#  НАПОМИНАНИЯ (фоновая задача)
+#  ИСХОДЯЩИЕ (фоновая задача)
 # ══════════════════════════════════════════════════════════════════════════════
 
-async def reminder_worker(bot: Bot):
-    while True:
+def lag_stats(lags) -> dict:
+    if not lags:
+        return {"count": 0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+    s = sorted(lags)
+    return {"count": len(s), "p50": s[len(s) // 2],
+            "p99": s[min(len(s) - 1, int(len(s) * 0.99))], "max": s[-1]}
+
+class Outbox:
+    """
+    Долговечная очередь уведомлений (подтверждения, отмены, напоминания,
+    оповещения админа). Хэндлер только пишет строку в outbox и отвечает
+    сразу; доставку ведут OUTBOX_WORKERS отправителей через общий лимитер.
+
+    Сетевые и серверные ошибки — повтор с экспоненциальной паузой до
+    OUTBOX_MAX_ATTEMPTS попыток; RetryAfter — пауза всего лимитера и повтор
+    без штрафа; заблокировавший бота чат запоминается в blocked_chats и
+    больше попыток не получает. Результаты сохраняются пачками раз в
+    SAVE_EVERY секунд. Доставка «хотя бы раз»: сообщение, ушедшее прямо
+    перед падением процесса, после рестарта может уйти повторно.
+    """
+    BATCH      = 200
+    SAVE_EVERY = 0.5
+    MAX_SLEEP  = 60.0
+
+    def __init__(self, workers: int = OUTBOX_WORKERS):
+        self._workers  = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._inflight: set[int] = set()          # id, взятые из БД и ещё не сохранённые
+        self._done: list[tuple] = []               # результаты для db_outbox_save
+        self._blocked: list[int] = []
+        self._wake     = asyncio.Event()
+        self.lags: deque[float] = deque(maxlen=1000)   # от постановки до доставки, сек
+        self.sent = self.failed = self.blocked = 0
+
+    def lag_stats(self) -> dict:
+        return lag_stats(self.lags)
+
+    def wake(self):
+        """Сообщения добавлены в outbox в обход enqueue (например, напоминания)."""
+        self._wake.set()
+
+    async def enqueue(self, chat_id: int, text: str, kind: str,
+                      reply_markup: InlineKeyboardMarkup | None = None) -> int | None:
+        if chat_id in BLOCKED_CHATS:
+            OUTBOX_MSGS.inc(kind=kind, result="blocked")
+            return None
+        oid = await db_outbox_add(chat_id, kind, text, reply_markup)
+        self._wake.set()
+        return oid
+
+    async def run(self, bot: Bot):
+        senders = [asyncio.create_task(self._sender(bot)) for _ in range(self._workers)]
+        purged  = 0.0
         try:
+            while True:
+                self._wake.clear()
+                try:
+                    await self._save()
+                    if time.monotonic() - purged > 3600:
+                        purged = time.monotonic()
+                        if n := await db_outbox_purge(OUTBOX_KEEP_DAYS):
+                            log.info(f"Outbox: удалено обработанных сообщений: {n}")
+                    if self._queue.qsize() < self.BATCH:
+                        for m in await db_outbox_due(self.BATCH + len(self._inflight)):
+                            if m["id"] not in self._inflight:
+                                self._inflight.add(m["id"])
+                                self._queue.put_nowait(m)
+                    if self._inflight:
+                        delay = self.SAVE_EVERY
+                    else:
+                        next_at = await db_outbox_next_at()
+                        delay   = self.MAX_SLEEP if next_at is None else next_at - time.time()
+                except Exception as e:
+                    log.error(f"outbox: {e}")
+                    delay = self.SAVE_EVERY
+                try:
+                    await asyncio.wait_for(self._wake.wait(), min(max(delay, 0.0), self.MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for t in senders:
+                t.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+            await self._save()
+            # Невзятое из очереди осталось в БД со status=0: после остановки его
+            # забирает следующий запуск (или другой лидер), а не эти отправители
+            self._queue = asyncio.Queue()
+            self._inflight.clear()
+
+    async def _save(self):
+        if not self._done and not self._blocked:
+            return
+        done, blocked, self._done, self._blocked = self._done, self._blocked, [], []
+        try:
+            await db_outbox_save(done, blocked)
+        except BaseException:
+            self._done, self._blocked = done + self._done, blocked + self._blocked
+            raise
+        self._inflight.difference_update(r[-1] for r in done)
+
+    async def _sender(self, bot: Bot):
+        while True:
+            m = await self._queue.get()
+            try:
+                status, attempts, next_at, error = await self._deliver(bot, m)
+            except Exception as e:
+                # Не ошибка Telegram (например, битая reply_markup в строке) — повтор
+                # не поможет, а упавший отправитель оставил бы id в _inflight навсегда
+                log.exception(f"Outbox #{m['id']}: непредвиденная ошибка")
+                status, attempts, next_at, error = OUT_FAILED, m["attempts"] + 1, 0.0, f"{type(e).__name__}: {e}"
             now = datetime.now()
-            for b in await db_get_bookings_for_reminders():
-                try: appt = datetime.fromisoformat(b["appt_dt"])
-                except: continue
-                diff = (appt - now).total_seconds() / 3600
-                uid  = b["user_id"]
-                svc  = b["service_name"]
-                bid  = b["id"]
-                dtf  = fmt_dt(b["appt_dt"])
-
-                # За 24 часа
-                if REMINDER_SETTINGS["r24"] and not b["reminded_24"] and 23.5 <= diff <= 24.5:
-                    try:
-                        await bot.send_message(uid,
-                            f"🔔 <b>Напоминание!</b>\n\nЗавтра у вас запись:\n"
-                            f"💇‍♀️ <b>{svc}</b>\n📅 <b>{dtf}</b>\n\n"
-                            f"<i>Ждём вас! 🌸</i>")
-                        await db_mark_reminded(bid, "reminded_24")
-                    except: pass
-
-                # За 12 часов
-                elif REMINDER_SETTINGS["r12"] and not b["reminded_12"] and 11.5 <= diff <= 12.5:
-                    try:
-                        await bot.send_message(uid,
-                            f"⏰ <b>Напоминание!</b>\n\nЧерез 12 часов:\n"
-                            f"💇‍♀️ <b>{svc}</b>\n📅 <b>{dtf}</b>\n\n"
-                            f"<i>Не забудьте! 💫</i>")
-                        await db_mark_reminded(bid, "reminded_12")
-                    except: pass
-
-                # За 6 часов
-                elif REMINDER_SETTINGS["r6"] and not b["reminded_6"] and 5.5 <= diff <= 6.5:
-                    try:
-                        await bot.send_message(uid,
-                            f"⏰ <b>Напоминание!</b>\n\nЧерез 6 часов:\n"
-                            f"💇‍♀️ <b>{svc}</b>\n📅 <b>{dtf}</b>\n\n"
-                            f"<i>Скоро увидимся! ✨</i>")
-                        await db_mark_reminded(bid, "reminded_6")
-                    except: pass
-
-                # За 1 час
-                elif REMINDER_SETTINGS["r1"] and not b["reminded_1"] and 0.75 <= diff <= 1.25:
-                    try:
-                        await bot.send_message(uid,
-                            f"⚡ <b>Напоминание!</b>\n\nЧерез 1 час:\n"
-                            f"💇‍♀️ <b>{svc}</b>\n📅 <b>{dtf}</b>\n\n"
-                            f"<i>Выезжайте! 🚀</i>")
-                        await db_mark_reminded(bid, "reminded_1")
-                    except: pass
+            if status == OUT_SENT:
+                self.sent += 1
+                lag = now.timestamp() - datetime.fromisoformat(m["created_at"]).timestamp()
+                self.lags.append(lag)
+                OUTBOX_DELAY.observe(lag, kind=m["kind"])
+            elif status == OUT_FAILED:
+                self.failed += 1
+                log.warning(f"Outbox #{m['id']} → {m['chat_id']} не доставлено: {error}")
+            elif status == OUT_BLOCKED:
+                self.blocked += 1
+            OUTBOX_MSGS.inc(kind=m["kind"], result=("retry", "sent", "failed", "blocked")[status])
+            self._done.append((status, attempts, next_at, error,
+                               now.isoformat() if status == OUT_SENT else None, m["id"]))
+            if self._queue.empty():
+                self._wake.set()   # пачка разобрана — сохранить результаты и взять следующую
+
+    async def _deliver(self, bot: Bot, m: dict) -> tuple[int, int, float, str | None]:
+        """Одна попытка. Возвращает (status, attempts, next_at, last_error)."""
+        chat_id, attempts = m["chat_id"], m["attempts"] + 1
+        if chat_id in BLOCKED_CHATS:
+            return OUT_BLOCKED, m["attempts"], 0.0, "blocked"
+        await TG_LIMITER.acquire(chat_id)
+        try:
+            markup = InlineKeyboardMarkup.model_validate_json(m["reply_markup"]) if m["reply_markup"] else None
+            await bot.send_message(chat_id, m["text"], reply_markup=markup)
+            return OUT_SENT, attempts, 0.0, None
+        except TelegramRetryAfter as e:
+            log.warning(f"Flood control: пауза {e.retry_after} с")
+            TG_LIMITER.pause(e.retry_after)
+            return OUT_QUEUED, m["attempts"], time.time() + e.retry_after, e.message
+        except TelegramForbiddenError as e:
+            log.info(f"Чат {chat_id} заблокировал бота: {e.message}")
+            BLOCKED_CHATS.add(chat_id)
+            self._blocked.append(chat_id)
+            return OUT_BLOCKED, attempts, 0.0, e.message
+        except TelegramBadRequest as e:
+            # Чат не найден, битая разметка — повтор не поможет
+            return OUT_FAILED, attempts, 0.0, e.message
+        except TelegramAPIError as e:
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                return OUT_FAILED, attempts, 0.0, e.message
+            backoff = min(OUTBOX_BACKOFF * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+            return OUT_QUEUED, attempts, time.time() + backoff, e.message
+
+OUTBOX = Outbox()
 
-        except Exception as e:
-            log.error(f"reminder_worker: {e}")
-        await asyncio.sleep(60)
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  РАССЫЛКА (фоновая задача)
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Запущенные рассылки: id задания -> задача
+BROADCAST_TASKS: dict[int, asyncio.Task] = {}
+
+def start_broadcast(bot: Bot, job_id: int):
+    # Рассылки ведёт лидер; задание, созданное в другом процессе, он
+    # подхватит по версии «broadcasts» (см. CacheSync)
+    if job_id in BROADCAST_TASKS or not LEADER.is_leader:
+        return
+    task = asyncio.create_task(run_broadcast(bot, job_id))
+    BROADCAST_TASKS[job_id] = task
+    task.add_done_callback(lambda _: BROADCAST_TASKS.pop(job_id, None))
+
+async def resume_broadcasts(bot: Bot):
+    """Продолжает рассылки, прерванные перезапуском, с первого неотправленного получателя."""
+    for job_id in await db_get_running_broadcasts():
+        log.info(f"Продолжаю рассылку #{job_id}")
+        start_broadcast(bot, job_id)
+
+async def stop_broadcasts():
+    """При остановке бота: прерываем рассылки, успев сохранить прогресс."""
+    tasks = list(BROADCAST_TASKS.values())
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def run_broadcast(bot: Bot, job_id: int):
+    job = await db_get_broadcast(job_id)
+    if not job or job["status"] != "running":
+        return
+    queue: asyncio.Queue = asyncio.Queue()
+    for uid in await db_get_broadcast_queue(job_id):
+        queue.put_nowait(uid)
+
+    done: list[tuple[int, int, int]] = []     # ещё не сохранённые результаты
+    sent, failed = job["sent"], job["failed"]
+    started = time.monotonic()
+    started_done = sent + failed
+
+    async def save():
+        nonlocal done
+        if done:
+            rows, done = done, []
+            try:
+                await db_mark_broadcast_recipients(rows)
+            except BaseException:
+                done = rows + done
+                raise
+
+    async def sender():
+        nonlocal sent, failed
+        while True:
+            try:
+                uid = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                ok = await tg_send(bot, uid, job["text"], parse_mode="HTML")
+            except TelegramAPIError as e:
+                log.warning(f"Рассылка #{job_id} → {uid}: {e.message}")
+                ok = False
+            if ok: sent += 1
+            else:  failed += 1
+            BROADCAST_MSGS.inc(result="sent" if ok else "failed")
+            done.append((1 if ok else 2, job_id, uid))
+
+    async def progress():
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS)
+            await save()
+            rate = (sent + failed - started_done) / max(time.monotonic() - started, 1e-6)
+            try:
+                await bot.edit_message_text(
+                    f"📣 <b>Рассылка #{job_id}</b>\n\n"
+                    f"✔ Отправлено: <b>{sent}</b> из {job['total']}\n"
+                    f"✖ Ошибок: <b>{failed}</b>\n"
+                    f"⚡ Скорость: <b>{rate:.1f}</b> сообщ./с",
+                    chat_id=job["admin_chat_id"], message_id=job["progress_msg_id"]
+                )
+            except TelegramAPIError:
+                pass  # сообщение не изменилось / удалено — прогресс всё равно в БД
+
+    workers  = [asyncio.create_task(sender()) for _ in range(BROADCAST_WORKERS)]
+    reporter = asyncio.create_task(progress())
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        reporter.cancel()
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(reporter, *workers, return_exceptions=True)
+        await save()
+
+    await db_finish_broadcast(job_id)
+    elapsed = time.monotonic() - started
+    log.info(f"Рассылка #{job_id} завершена: {sent} ок, {failed} ошибок за {elapsed:.0f} с")
+    await OUTBOX.enqueue(
+        job["admin_chat_id"],
+        f"✅ <b>Рассылка завершена!</b>\n\n✔ Отправлено: <b>{sent}</b>\n✖ Ошибок: <b>{failed}</b>\n"
+        f"⏱ За {elapsed:.0f} с",
+        "admin_alert",
+        reply_markup=kb_admin_main()
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  НАПОМИНАНИЯ (фоновая задача)
+# ══════════════════════════════════════════════════════════════════════════════
+
+# Ключ настройки -> (за сколько часов, колонка-флаг, допуск опоздания в часах, текст)
+REMINDER_KINDS = {
+    "r24": (24, "reminded_24", 0.5,
+            "🔔 <b>Напоминание!</b>\n\nЗавтра у вас запись:\n"
+            "💇‍♀️ <b>{svc}</b>\n📅 <b>{dtf}</b>\n\n<i>Ждём вас! 🌸</i>"),
+    "r12": (12, "reminded_12", 0.5,
+            "⏰ <b>Напоминание!</b>\n\nЧерез 12 часов:\n"
+            "💇‍♀️ <b>{svc}</b>\n📅 <b>{dtf}</b>\n\n<i>Не забудьте! 💫</i>"),
+    "r6":  (6,  "reminded_6",  0.5,
+            "⏰ <b>Напоминание!</b>\n\nЧерез 6 часов:\n"
+            "💇‍♀️ <b>{svc}</b>\n📅 <b>{dtf}</b>\n\n<i>Скоро увидимся! ✨</i>"),
+    "r1":  (1,  "reminded_1",  0.25,
+            "⚡ <b>Напоминание!</b>\n\nЧерез 1 час:\n"
+            "💇‍♀️ <b>{svc}</b>\n📅 <b>{dtf}</b>\n\n<i>Выезжайте! 🚀</i>"),
+}
+
+class ReminderScheduler:
+    """
+    Планировщик напоминаний на min-heap: точное время срабатывания
+    считается один раз при подтверждении записи, между напоминаниями
+    задача спит. Куча строится из БД при старте и при переключении
+    интервалов в админке; отмена записи убирает её напоминания сразу.
+    """
+    MAX_SLEEP = 3600.0   # просыпаемся хотя бы раз в час — на случай перевода часов
+    RETRY     = 5.0      # пауза после неудачной постановки в outbox
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, str, int]] = []   # (когда, id записи, ключ, appt_ts)
+        self._active: Dict[int, dict] = {}                      # id записи -> данные для текста
+        self._wake = asyncio.Event()
+        self.lags: deque[float] = deque(maxlen=1000)            # опоздание отправки, сек
+        self.sent = self.failed = 0
+
+    def lag_stats(self) -> dict:
+        """Опоздание постановки в outbox относительно расписания по последним напоминаниям."""
+        return lag_stats(self.lags)
+
+    @staticmethod
+    def _add(heap: list, active: dict, bid: int, user_id: int, service_name: str,
+             appt_ts: int, sent: set[str]):
+        active[bid] = {"user_id": user_id, "service_name": service_name,
+                       "appt_ts": appt_ts, "sent": sent}
+        for kind, (hours, _, _, _) in REMINDER_KINDS.items():
+            if REMINDER_SETTINGS[kind] and kind not in sent:
+                heapq.heappush(heap, (appt_ts - hours * 3600, bid, kind, appt_ts))
+
+    def schedule(self, bid: int, user_id: int, service_name: str, appt_ts: int):
+        self._add(self._heap, self._active, bid, user_id, service_name, appt_ts, set())
+        self._wake.set()
+
+    def discard(self, bid: int):
+        # Записи в куче остаются, но без _active при срабатывании пропускаются
+        self._active.pop(bid, None)
+
+    def clear(self):
+        """Процесс перестал быть лидером: следующий run() всё равно перестроит кучу из БД."""
+        self._heap, self._active = [], {}
+
+    async def rebuild(self):
+        heap, active = [], {}
+        for b in await db_get_bookings_for_reminders():
+            sent = {k for k, (_, field, _, _) in REMINDER_KINDS.items() if b[field]}
+            # Отправленные, но ещё не отмеченные в БД, тоже не повторяем
+            old = self._active.get(b["id"])
+            if old and old["appt_ts"] == b["appt_ts"]:
+                sent |= old["sent"]
+            self._add(heap, active, b["id"], b["user_id"], b["service_name"], b["appt_ts"], sent)
+        # Заведомо пропущенные окна выкидываем сразу
+        now  = time.time()
+        heap = [e for e in heap if e[0] + REMINDER_KINDS[e[2]][2] * 3600 >= now]
+        heapq.heapify(heap)
+        self._heap, self._active = heap, active
+        self._wake.set()
+        log.info(f"Напоминаний в очереди: {len(heap)}")
+
+    async def run(self, bot: Bot):
+        await self.rebuild()
+        while True:
+            self._wake.clear()
+            delay = self.MAX_SLEEP
+            if self._heap:
+                delay = min(delay, max(0.0, self._heap[0][0] - time.time()))
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._fire_due(bot)
+            except Exception as e:
+                log.error(f"reminders: {e}")
+                await asyncio.sleep(self.RETRY)   # не крутиться, пока БД занята
+
+    async def _fire_due(self, bot: Bot):
+        """Все наступившие напоминания одной транзакцией отмечаются в reminded_*
+        и ставятся в outbox."""
+        now = time.time()
+        batch, due, taken = [], [], set()
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            fire_ts, bid, kind, appt_ts = entry
+            b = self._active.get(bid)
+            if (b is None or b["appt_ts"] != appt_ts or kind in b["sent"]
+                    or (bid, kind) in taken or not REMINDER_SETTINGS[kind]):
+                continue   # запись отменена/перенесена, уже отправлено или интервал выключен
+            _, field, grace, text = REMINDER_KINDS[kind]
+            if now - fire_ts > grace * 3600:
+                log.info(f"Напоминание {kind} для #{bid} пропущено: окно закрылось")
+                continue
+            taken.add((bid, kind))
+            due.append(entry)
+            batch.append((fire_ts, bid, field, b["user_id"],
+                          text.format(svc=b["service_name"], dtf=fmt_ts(b["appt_ts"]))))
+        if not batch:
+            return
+
+        # Доставка, повторы и заблокировавшие бота — забота Outbox
+        try:
+            queued = await db_enqueue_reminders([item[1:] for item in batch])
+        except Exception:
+            # Ничего не записано: возвращаем в кучу, следующий круг попробует снова
+            for entry in due:
+                heapq.heappush(self._heap, entry)
+            raise
+        # Отправленными считаем только после коммита; _active мог смениться за время записи
+        for _, bid, kind, appt_ts in due:
+            if (b := self._active.get(bid)) is not None and b["appt_ts"] == appt_ts:
+                b["sent"].add(kind)
+        OUTBOX.wake()
+        now = time.time()
+        for fire_ts, *_ in batch:
+            self.lags.append(now - fire_ts)
+            REMINDER_LAG.observe(now - fire_ts)
+        REMINDERS_SENT.inc(queued)
+        self.sent += queued
+        st = self.lag_stats()
+        if queued < len(batch):
+            log.warning(f"Напоминания: {len(batch) - queued} уже поставлены в очередь другим процессом")
+        log.info(f"Напоминания: {queued} в очереди на отправку, "
+                 f"опоздание p50={st['p50']:.1f}с max={st['max']:.1f}с")
+
+REMINDERS = ReminderScheduler()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  НЕСКОЛЬКО ПРОЦЕССОВ (лидер и кэши)
+# ══════════════════════════════════════════════════════════════════════════════
+
+class LeaderLease:
+    """
+    Выбор лидера среди процессов на одной БД — аренда в таблице leases.
+    Фоновые задачи (планировщик напоминаний, Outbox, рассылки) работают
+    только у лидера, остальные процессы лишь обрабатывают апдейты.
+    Лидер продлевает аренду каждые LEASE_RENEW секунд; упал — через
+    LEASE_TTL её берёт другой процесс, остановлен штатно — отдаёт сразу.
+    Не сумевший продлить аренду до её истечения (завис, БД недоступна)
+    останавливает задачи сам, не дожидаясь, пока их перехватят.
+    """
+    NAME = "workers"
+
+    def __init__(self, holder: str = INSTANCE_ID, ttl: float = LEASE_TTL, renew: float = LEASE_RENEW):
+        self.holder, self.ttl, self.renew = holder, ttl, renew
+        self.is_leader = False
+        self.bot: Bot | None = None
+        self._expires = 0.0
+        self._tasks: list[asyncio.Task] = []
+
+    async def run(self, bot: Bot):
+        self.bot = bot
+        try:
+            while True:
+                started = time.time()
+                try:
+                    acquired = await db_lease_acquire(self.NAME, self.holder, self.ttl)
+                except Exception as e:
+                    log.error(f"lease: {e}")
+                    acquired = None   # неизвестно: остаёмся, кем были, пока аренда не истекла
+                try:
+                    if acquired:
+                        self._expires = started + self.ttl
+                        if not self.is_leader:
+                            await self._start(bot)
+                    elif self.is_leader and (acquired is False or time.time() >= self._expires):
+                        log.warning(f"{self.holder}: аренда лидера потеряна")
+                        await self._stop()
+                except Exception as e:
+                    # Например, resume_broadcasts не достучался до БД: откатываем
+                    # наполовину запущенное и пробуем заново на следующем круге
+                    log.error(f"lease: не удалось сменить роль: {e}")
+                    if self.is_leader:
+                        await self._stop()
+                await asyncio.sleep(self.renew)
+        finally:
+            if self.is_leader:
+                await self._stop()
+                await db_lease_release(self.NAME, self.holder)
+
+    async def _start(self, bot: Bot):
+        log.info(f"Лидер: {self.holder}, запускаю напоминания, outbox и рассылки")
+        self.is_leader = True
+        self._tasks = [asyncio.create_task(REMINDERS.run(bot)), asyncio.create_task(OUTBOX.run(bot))]
+        await resume_broadcasts(bot)
+
+    async def _stop(self):
+        log.info(f"{self.holder}: останавливаю фоновые задачи лидера")
+        self.is_leader = False
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        REMINDERS.clear()
+        await stop_broadcasts()
+
+LEADER = LeaderLease()
+
+class CacheSync:
+    """
+    Согласованность кэшей в памяти между процессами. Хэлпер, меняющий
+    закэшированные данные, в той же транзакции увеличивает версию в
+    cache_versions (_bump); каждый процесс раз в CACHE_POLL секунд читает
+    эту таблицу из нескольких строк и для изменившихся версий вызывает
+    перезагрузку, зарегистрированную через on(). Версии, записанные этим
+    процессом, пропускаются: свой кэш хэлпер уже обновил, а перезагрузка
+    бывает дорогой (перестройка кучи напоминаний). Если между сверками
+    версию увеличивал и кто-то другой — перезагрузка всё равно будет.
+    """
+    def __init__(self):
+        self.versions: dict[str, int] = {}   # заполняется в init_db до загрузки кэшей
+        self._own: dict[str, set[int]] = {}  # версии, записанные этим процессом
+        self._reloaders: dict[str, Any] = {}
+        self.reloads = 0
+
+    def mine(self, versions):
+        """Вызывается после коммита _bump: [(имя, версия), ...]."""
+        for name, version in versions:
+            self._own.setdefault(name, set()).add(version)
+
+    def on(self, name: str):
+        def register(fn):
+            self._reloaders[name] = fn
+            return fn
+        return register
+
+    async def check(self):
+        for name, version in (await db_cache_versions()).items():
+            seen = self.versions.get(name, 0)
+            if seen == version:
+                continue
+            self.versions[name] = version
+            own = self._own.pop(name, set())
+            if v := {x for x in own if x > version}:
+                self._own[name] = v      # свой коммит новее прочитанной версии
+            if seen < version and all(x in own for x in range(seen + 1, version + 1)):
+                continue
+            if reload := self._reloaders.get(name):
+                try:
+                    await reload()
+                    self.reloads += 1
+                except Exception as e:
+                    log.error(f"cache sync {name}: {e}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(CACHE_POLL)
+            try:
+                await self.check()
+            except Exception as e:
+                log.error(f"cache sync: {e}")
+
+CACHE_SYNC = CacheSync()
+
+@CACHE_SYNC.on("admins")
+async def _reload_admins():
+    async with POOL.read() as db:
+        await db_load_admins(db)
+
+@CACHE_SYNC.on("settings")
+async def _reload_settings():
+    async with POOL.read() as db:
+        await db_load_reminder_settings(db)
+    invalidate_keyboards()
+    if LEADER.is_leader:
+        await REMINDERS.rebuild()
+
+@CACHE_SYNC.on("service_texts")
+async def _reload_service_texts():
+    async with POOL.read() as db:
+        await db_load_service_texts(db)
+
+@CACHE_SYNC.on("blocked")
+async def _reload_blocked():
+    async with POOL.read() as db:
+        await db_load_blocked(db)
+
+@CACHE_SYNC.on("reviews")
+async def _reload_reviews():
+    async with POOL.read() as db:
+        await db_load_review_stats(db)
+
+@CACHE_SYNC.on("bookings")
+async def _reload_bookings():
+    COUNT_CACHE.pop("confirmed_bookings", None)
+    if LEADER.is_leader:
+        await REMINDERS.rebuild()
+
+@CACHE_SYNC.on("outbox")
+async def _reload_outbox():
+    if LEADER.is_leader:
+        OUTBOX.wake()
+
+@CACHE_SYNC.on("broadcasts")
+async def _reload_broadcasts():
+    if LEADER.is_leader:
+        await resume_broadcasts(LEADER.bot)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  ПРОФИЛИРОВАНИЕ
+# ══════════════════════════════════════════════════════════════════════════════
+
+class UpdateProfiler(BaseMiddleware):
+    """
+    cProfile по кнопке из админки — на N секунд или на N апдейтов
+    (во втором случае тоже не дольше PROFILE_MAX_SECONDS).
+    Пока замер не идёт, от middleware остаётся одна проверка на апдейт.
+    Результат: .prof-файл в PROFILE_DIR (pstats, snakeviz) и топ функций админу.
+    """
+    def __init__(self):
+        self._prof: Optional[cProfile.Profile] = None
+        self._timer: Optional[asyncio.Task] = None
+        self._bot: Optional[Bot] = None
+        self._chat_id = 0
+        self._limit   = 0      # сколько апдейтов профилировать (0 — по времени)
+        self._seconds = 0
+        self._updates = 0
+        self._started = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._prof is not None
+
+    async def __call__(self, handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if self._prof is None:
+            return await handler(event, data)
+        try:
+            return await handler(event, data)
+        finally:
+            self._updates += 1
+            if self._limit and self._updates == self._limit:
+                asyncio.create_task(self.stop())
+
+    def status(self) -> str:
+        if self._prof is None:
+            return "Сейчас выключено."
+        left = (f"апдейтов {self._updates} из {self._limit}" if self._limit
+                else f"осталось {max(0, self._seconds - (time.monotonic() - self._started)):.0f} с")
+        return f"⏺ Идёт замер: {time.monotonic() - self._started:.0f} с, {left}."
+
+    def start(self, bot: Bot, chat_id: int, seconds: int | None = None, updates: int | None = None) -> bool:
+        if self._prof is not None:
+            return False
+        self._bot, self._chat_id = bot, chat_id
+        self._limit   = updates or 0
+        self._seconds = min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+        self._updates = 0
+        self._started = time.monotonic()
+        self._timer   = asyncio.create_task(self._stop_after(self._seconds))
+        self._prof    = cProfile.Profile()
+        self._prof.enable()
+        invalidate_keyboards()
+        log.info(f"Профилирование включено: {updates or 0} апдейтов / {self._seconds} с")
+        return True
+
+    async def _stop_after(self, seconds: float):
+        await asyncio.sleep(seconds)
+        await self.stop()
+
+    async def stop(self):
+        prof, self._prof = self._prof, None
+        if prof is None:
+            return
+        prof.disable()
+        if self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        invalidate_keyboards()
+        elapsed = time.monotonic() - self._started
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"profile-{datetime.now():%Y%m%d-%H%M%S-%f}.prof")
+        await asyncio.to_thread(prof.dump_stats, path)
+        log.info(f"Профиль сохранён: {path}")
+        try:
+            await self._bot.send_message(self._chat_id, self.summary(prof, elapsed, path),
+                                         reply_markup=kb_admin_main())
+            await self._bot.send_document(self._chat_id, FSInputFile(path))
+        except TelegramAPIError as e:
+            log.warning(f"Профиль не отправлен: {e.message}")
+
+    def summary(self, prof: cProfile.Profile, elapsed: float, path: str, top: int = PROFILE_TOP) -> str:
+        stats = pstats.Stats(prof).stats   # (файл, строка, функция) -> (cc, вызовы, своё, полное, ...)
+        here  = os.path.abspath(__file__)
+
+        def table(rows, col):
+            lines = []
+            for (file, line, func), v in rows:
+                name = f"{os.path.basename(file)}:{line} {func}" if line else func
+                lines.append(f"{v[col] * 1000:8.1f} {v[1]:7d}  {name[:50]}")
+            return html.escape("\n".join(lines) or "—")
+
+        own  = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)[:top]
+        ours = sorted(((k, v) for k, v in stats.items() if os.path.abspath(k[0]) == here),
+                      key=lambda kv: kv[1][3], reverse=True)[:top]
+        return (f"🔬 <b>Профиль: {elapsed:.0f} с, {self._updates} апдейтов</b>\n\n"
+                f"<b>Собственное время</b> (мс, вызовы, функция):\n<pre>{table(own, 2)}</pre>\n"
+                f"<b>{os.path.basename(here)} с вложенными вызовами</b>:\n<pre>{table(ours, 3)}</pre>\n"
+                f"Файл: <code>{html.escape(path)}</code>")
+
+PROFILER = UpdateProfiler()
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+#  ВЕБХУК
+# ══════════════════════════════════════════════════════════════════════════════
+
+async def health(request: web.Request) -> web.Response:
+    """Проверка живости для балансировщика/оркестратора: БД отвечает — 200."""
+    try:
+        async with POOL.read() as db:
+            await (await db.execute("SELECT 1")).fetchone()
+    except Exception as e:
+        return web.json_response({"status": "error", "error": str(e)}, status=503)
+    return web.json_response({"status": "ok", "leader": LEADER.is_leader, "broadcasts": len(BROADCAST_TASKS),
+                              "updates": UPDATE_GATE.stats()})
+
+def build_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """
+    aiohttp-приложение: POST WEBHOOK_PATH — апдейты (с проверкой секрета),
+    GET /healthz — проверка живости.
+    Апдейт обрабатывается до ответа Telegram: если процесс остановят
+    посреди обработки, Telegram пришлёт его повторно.
+    """
+    app = web.Application()
+    handler = SimpleRequestHandler(dp, bot, handle_in_background=False, secret_token=WEBHOOK_SECRET)
+    app.router.add_post(WEBHOOK_PATH, handler.handle)
+    app.router.add_get("/healthz", health)
+    return app
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    runner = web.AppRunner(build_webhook_app(dp, bot))
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=False
+    )
+    log.info(f"Бот запущен (вебхук {WEBHOOK_URL}{WEBHOOK_PATH}, порт {WEBAPP_PORT})!")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        # Вебхук не удаляем: пока бота нет, апдейты ждут в очереди Telegram.
+        # cleanup() дожидается апдейтов, которые уже обрабатываются
+        await runner.cleanup()
 
 
 # ══════════════════════════════════════════════════════════════════════════════
@@ -1447,29 +3541,52 @@ async def reminder_worker(bot: Bot):
 
 async def main():
     log.info("Запуск бота...")
+    await POOL.open()
     await init_db()
+    warm_keyboards()
 
-    fsm_storage = SQLiteFSMStorage(DB_PATH)
+    fsm_storage = SQLiteFSMStorage(POOL)
     await fsm_storage.init()
 
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp  = Dispatcher(storage=fsm_storage)
 
+    dp.include_router(callback_router)
     dp.include_router(auth_router)
     dp.include_router(common_router)
-    dp.include_router(user_router)
     dp.include_router(review_router)
     dp.include_router(booking_router)
-    dp.include_router(admin_cb_router)
     dp.include_router(admin_fsm_router)
+    install_update_gate(dp)
+    install_metrics(dp, bot)
+    dp.update.outer_middleware(PROFILER)
+    metrics_runner = await start_metrics_server()
 
-    asyncio.create_task(reminder_worker(bot))
+    # Напоминания, outbox и рассылки запускает лидер (LeaderLease), кэши сверяет CacheSync
+    leader_task = asyncio.create_task(LEADER.run(bot))
+    sync_task   = asyncio.create_task(CACHE_SYNC.run())
 
     try:
-        log.info("Бот запущен!")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=True)
+        if WEBHOOK_URL:
+            await run_webhook(dp, bot)
+        else:
+            log.info("Бот запущен!")
+            # Очередь апдейтов не сбрасываем — накопленное за рестарт обработается
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        # Лидер останавливает рассылки и Outbox (тот дописывает результаты
+        # отправленного) и отдаёт аренду — другой процесс подхватит сразу
+        sync_task.cancel()
+        leader_task.cancel()
+        await asyncio.gather(sync_task, leader_task, return_exceptions=True)
+        await PROFILER.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
+        await fsm_storage.close()
+        await USER_BUFFER.close()
+        await POOL.close()
         log.info("Бот остановлен.")
 
 if __name__ == "__main__":
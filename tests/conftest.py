@@ -0,0 +1,29 @@
+import asyncio, os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+@pytest.fixture
+def run_db(tmp_path):
+    """
+    run_db(fn) — выполняет корутину-функцию fn() на свежей временной БД:
+    пул открыт, миграции init_db применены; после — пул закрыт.
+    """
+    def run(fn):
+        async def body():
+            main.DB_PATH     = str(tmp_path / "test.db")
+            main.POOL        = main.SQLitePool(main.DB_PATH)
+            main.USER_BUFFER = main.UserUpsertBuffer(main.POOL)
+            await main.POOL.open()
+            try:
+                await main.init_db()
+                return await fn()
+            finally:
+                await main.USER_BUFFER.close()
+                await main.POOL.close()
+        return asyncio.run(body())
+    return run
@@ -0,0 +1,51 @@
+import main
+
+
+async def _foreign_bump(name):
+    # Как _bump в другом процессе: версия растёт, но своей не записывается
+    async with main.POOL.write() as db:
+        cur = await db.execute(main._BUMP, (name,))
+        await cur.fetchall()
+
+
+def test_reloads_only_foreign_changes(run_db, monkeypatch):
+    sync = main.CacheSync()
+    monkeypatch.setattr(main, "CACHE_SYNC", sync)
+
+    async def body():
+        reloads = []
+        async def reload():
+            reloads.append("test")
+        sync.on("test")(reload)
+        await sync.check()
+
+        async with main.POOL.write() as db:
+            await main._bump(db, "test")
+        await sync.check()
+        own = list(reloads)
+
+        await _foreign_bump("test")
+        await sync.check()
+        foreign = list(reloads)
+
+        async with main.POOL.write() as db:
+            await main._bump(db, "test")
+        await _foreign_bump("test")
+        await sync.check()
+        mixed = list(reloads)
+
+        try:
+            async with main.POOL.write() as db:
+                await main._bump(db, "test")
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        await _foreign_bump("test")   # та же версия, что у откаченного _bump
+        await sync.check()
+        return own, foreign, mixed, list(reloads)
+
+    own, foreign, mixed, rolled_back = run_db(body)
+    assert own == []
+    assert foreign == ["test"]
+    assert mixed == ["test", "test"]
+    assert rolled_back == ["test", "test", "test"]
@@ -0,0 +1,112 @@
+import asyncio, time
+from contextlib import asynccontextmanager
+
+from aiogram.fsm.storage.base import StorageKey
+
+import main
+
+READ_DELAY = 0.01   # медленный диск: каждый промах кэша ждёт
+
+
+def slow_reads(pool: main.SQLitePool):
+    # Задержка до взятия соединения: упираемся в замки хранилища, а не в число читателей пула
+    read = pool.read
+
+    @asynccontextmanager
+    async def slow():
+        await asyncio.sleep(READ_DELAY)
+        async with read() as db:
+            yield db
+    pool.read = slow
+
+
+async def drive(storage: main.SQLiteFSMStorage, users: int, steps: int = 5) -> float:
+    async def user(uid: int):
+        key = StorageKey(bot_id=1, chat_id=uid, user_id=uid)
+        for i in range(steps):
+            await storage.update_data(key, {"step": i})
+            await storage.set_state(key, f"S:{i}")
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(uid) for uid in range(users)))
+    return time.perf_counter() - t0
+
+
+def test_throughput_scales_with_users(run_db):
+    """
+    Разные чаты не ждут друг друга: при ttl=0 каждая операция читает БД,
+    и с одним общим замком время росло бы линейно с числом пользователей.
+    """
+    async def body():
+        slow_reads(main.POOL)
+        timings = {}
+        for users in (1, 10, 100):
+            storage = main.SQLiteFSMStorage(main.POOL, ttl=0.0)
+            await storage.init()
+            timings[users] = await drive(storage, users)
+            await storage.close()
+            assert storage._locks == {}
+        return timings
+
+    timings = run_db(body)
+    ops = {users: users * 10 / elapsed for users, elapsed in timings.items()}
+    assert ops[10]  > ops[1] * 5
+    assert ops[100] > ops[1] * 20
+
+
+def test_one_key_stays_consistent(run_db):
+    """Параллельные записи одного ключа не теряются; замки после работы убраны."""
+    async def body():
+        storage = main.SQLiteFSMStorage(main.POOL, ttl=0.0)
+        await storage.init()
+        key = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+        async def add(i: int):
+            await storage.update_data(key, {f"k{i}": i})
+        await asyncio.gather(*(add(i) for i in range(200)))
+        await storage.close()
+        assert storage._locks == {}
+
+        fresh = main.SQLiteFSMStorage(main.POOL)
+        return await fresh.get_data(key)
+
+    data = run_db(body)
+    assert data == {f"k{i}": i for i in range(200)}
+
+
+def test_key_being_flushed_is_not_evicted(run_db):
+    """
+    Пока flush() не закоммитил запись, ключ уже не в _dirty; вытесни его
+    промах по другому ключу — get_state перечитал бы из БД старое состояние,
+    а следующий set_data записал бы его поверх нового.
+    """
+    async def body():
+        pool  = main.POOL
+        write = pool.write
+
+        @asynccontextmanager
+        async def slow_commit():
+            async with write() as db:
+                yield db
+                await asyncio.sleep(0.05)
+        pool.write = slow_commit
+
+        storage = main.SQLiteFSMStorage(pool, max_size=2, flush_delay=0.2)
+        await storage.init()
+        k1, k2, k3 = (StorageKey(bot_id=1, chat_id=i, user_id=i) for i in (1, 2, 3))
+
+        await storage.set_state(k1, "A:one")
+        flushing = asyncio.create_task(storage.flush())
+        await asyncio.sleep(0.01)
+        await storage.get_state(k2)
+        await storage.get_state(k3)
+        during = await storage.get_state(k1)
+        await flushing
+
+        await storage.set_data(k1, {"x": 1})
+        await storage.close()
+        async with pool.read() as db:
+            cur = await db.execute("SELECT state FROM fsm_data WHERE key=?", (storage._key(k1),))
+            stored = (await cur.fetchone())[0]
+        return during, stored, storage._flushing
+
+    assert run_db(body) == ("A:one", "A:one", set())
@@ -0,0 +1,54 @@
+import asyncio
+
+import main
+
+
+def test_failed_start_is_retried(run_db, monkeypatch):
+    """Ошибка при запуске задач лидера не должна завершать LeaderLease.run навсегда."""
+    monkeypatch.setattr(main, "REMINDERS", main.ReminderScheduler())
+    monkeypatch.setattr(main, "OUTBOX", main.Outbox())
+    resume, calls = main.resume_broadcasts, []
+
+    async def flaky_resume(bot):
+        calls.append(bot)
+        if len(calls) == 1:
+            raise main.aiosqlite.OperationalError("database is locked")
+        await resume(bot)
+    monkeypatch.setattr(main, "resume_broadcasts", flaky_resume)
+
+    async def body():
+        leader = main.LeaderLease(holder="test", ttl=1.0, renew=0.02)
+        task   = asyncio.create_task(leader.run(None))
+        for _ in range(100):
+            if len(calls) >= 2 and leader.is_leader:
+                break
+            await asyncio.sleep(0.01)
+        alive = not task.done() and leader.is_leader and len(leader._tasks) == 2
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        async with main.POOL.read() as db:
+            cur = await db.execute("SELECT COUNT(*) FROM leases")
+            held = (await cur.fetchone())[0]
+        return alive, len(calls), held
+
+    assert run_db(body) == (True, 2, 0)
+
+
+def test_only_leader_keeps_reminder_heap(run_db, monkeypatch):
+    monkeypatch.setattr(main, "REMINDERS", main.ReminderScheduler())
+    monkeypatch.setattr(main, "LEADER", main.LeaderLease(holder="test"))
+
+    async def body():
+        async with main.POOL.write() as db:
+            await db.executemany(
+                "INSERT INTO bookings (user_id,service_name,datetime_txt,status,created_at) "
+                "VALUES(?,'s','t','pending','2025-01-01')", [(1,), (2,)])
+        appt_ts = int(main.time.time()) + 2 * 86400
+        await main.db_confirm_booking(1, appt_ts)
+        follower = (len(main.REMINDERS._heap), len(main.REMINDERS._active))
+        main.LEADER.is_leader = True
+        await main.db_confirm_booking(2, appt_ts)
+        await main.db_cancel_booking(2)
+        return follower, list(main.REMINDERS._active), len(main.REMINDERS._heap) > 0
+
+    assert run_db(body) == ((0, 0), [], True)
@@ -0,0 +1,35 @@
+import asyncio
+
+import main
+
+
+def test_unexpected_error_fails_row_and_keeps_sender(run_db):
+    async def body():
+        ok  = await main.db_outbox_add(1, "admin_alert", "ok")
+        bad = await main.db_outbox_add(2, "admin_alert", "bad")
+        async with main.POOL.write() as db:
+            await db.execute("UPDATE outbox SET reply_markup='{broken' WHERE id=?", (bad,))
+
+        class Bot:
+            sent = []
+            async def send_message(self, chat_id, text, reply_markup=None):
+                self.sent.append(chat_id)
+
+        outbox, bot = main.Outbox(workers=1), Bot()
+        task = asyncio.create_task(outbox.run(bot))
+        for _ in range(200):
+            if outbox.sent + outbox.failed == 2 and not outbox._inflight:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        async with main.POOL.read() as db:
+            cur  = await db.execute("SELECT id, status, last_error FROM outbox ORDER BY id")
+            rows = await cur.fetchall()
+        return outbox, bot, ok, bad, rows
+
+    outbox, bot, ok, bad, rows = run_db(body)
+    assert (outbox.sent, outbox.failed, bot.sent, outbox._inflight) == (1, 1, [1], set())
+    assert rows[0][:2] == (ok, main.OUT_SENT)
+    assert rows[1][:2] == (bad, main.OUT_FAILED) and rows[1][2].startswith("ValidationError")
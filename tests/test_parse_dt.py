@@ -0,0 +1,75 @@
+"""Корпус фраз клиентов для parse_dt с фиксированной «сегодняшней» датой."""
+from datetime import date, datetime
+
+import pytest
+
+import main
+
+
+TODAY = date(2025, 12, 20)   # суббота
+NOW   = datetime(2025, 12, 20, 12, 0)
+
+CORPUS = [
+    ("15.01 14:00",                              datetime(2026, 1, 15, 14, 0)),
+    ("15.01.2025 14:00",                         datetime(2025, 1, 15, 14, 0)),
+    ("25.12 10:30",                              datetime(2025, 12, 25, 10, 30)),
+    ("15 января в 14:00",                        datetime(2026, 1, 15, 14, 0)),
+    ("15 января 2027 в 9:05",                    datetime(2027, 1, 15, 9, 5)),
+    ("3 марта в 12",                             datetime(2026, 3, 3, 12, 0)),
+    ("3 мая, 18:00",                             datetime(2026, 5, 3, 18, 0)),
+    ("завтра в 10",                              datetime(2025, 12, 21, 10, 0)),
+    ("Завтра в 10:30",                           datetime(2025, 12, 21, 10, 30)),
+    ("сегодня в 18:00",                          datetime(2025, 12, 20, 18, 0)),
+    ("послезавтра к 11",                         datetime(2025, 12, 22, 11, 0)),
+    ("в пятницу в 15:00",                        datetime(2025, 12, 26, 15, 0)),
+    ("в пятницу в 7 вечера",                     datetime(2025, 12, 26, 19, 0)),
+    ("пн 9 утра",                                datetime(2025, 12, 22, 9, 0)),
+    ("в субботу в 16",                           datetime(2025, 12, 20, 16, 0)),
+    ("договорились на 28.12 в 13:00, спасибо!",  datetime(2025, 12, 28, 13, 0)),
+    ("28/12 13:00",                              datetime(2025, 12, 28, 13, 0)),
+    ("14:00 15.01",                              datetime(2026, 1, 15, 14, 0)),
+    ("в 14:00 завтра",                           datetime(2025, 12, 21, 14, 0)),
+    ("5 февраля 15ч",                            datetime(2026, 2, 5, 15, 0)),
+    ("в пятницу",                                None),
+    ("когда-нибудь",                             None),
+    ("31.02 10:00",                              None),
+    ("15.01",                                    None),
+    ("в 14:00",                                  None),
+]
+
+
+@pytest.mark.parametrize("text, expected", CORPUS)
+def test_corpus(text, expected):
+    assert main.parse_dt_from_text(text, NOW) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Количество, а не час: дата есть, времени нет
+    ("на 2 человека завтра",    (datetime(2025, 12, 21), False)),
+    ("на 10 человек завтра",    (datetime(2025, 12, 21), False)),
+    ("завтра на 3",             (datetime(2025, 12, 21), False)),
+    # С «ч» или периодом ранний час — всё-таки время
+    ("завтра в 2 часа",         (datetime(2025, 12, 21, 2, 0), True)),
+    ("завтра в 2 дня",          (datetime(2025, 12, 21, 14, 0), True)),
+    # Полночь «12 ночи» — в конце названного дня
+    ("сегодня в 12 ночи",       (datetime(2025, 12, 21, 0, 0), True)),
+    ("15 января в 12:00 ночи",  (datetime(2026, 1, 16, 0, 0), True)),
+])
+def test_not_an_hour_and_midnight(text, expected):
+    assert main.parse_dt(text, TODAY) == expected
+
+
+def test_backfill_parses_relative_to_created_at(run_db):
+    async def body():
+        async with main.POOL.write() as db:
+            await db.execute(
+                "INSERT INTO bookings (user_id,service_name,datetime_txt,status,created_at) "
+                "VALUES(1,'s','завтра в 10','pending','2025-03-04T09:00:00')")
+            await db.execute("UPDATE bookings SET dt_confidence=NULL, appt_ts=NULL")
+        await main.init_db()
+        async with main.POOL.read() as db:
+            cur = await db.execute("SELECT appt_ts, dt_confidence FROM bookings")
+            return await cur.fetchone()
+
+    appt_ts, conf = run_db(body)
+    assert (datetime.fromtimestamp(appt_ts), conf) == (datetime(2025, 3, 5, 10, 0), main.DT_EXACT)
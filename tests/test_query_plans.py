@@ -0,0 +1,71 @@
+"""
+Планы горячих запросов: ни один не должен читать таблицу целиком (SCAN)
+или сортировать во временном B-дереве (USE TEMP B-TREE).
+
+Запросы не переписываются в тесте, а перехватываются у самих db_*-функций
+через trace-callback соединений пула — тест ломается, если запрос в main.py
+поменяли так, что он перестал попадать в индекс.
+"""
+import main
+
+
+async def _captured(calls) -> list[str]:
+    sql: list[str] = []
+    for conn in main.POOL._conns:
+        await conn.set_trace_callback(sql.append)
+    for call in calls:
+        await call()
+    for conn in main.POOL._conns:
+        await conn.set_trace_callback(None)
+    return [s for s in sql if s.lstrip().upper().startswith("SELECT")]
+
+
+async def _plans(statements) -> dict[str, list[str]]:
+    out = {}
+    async with main.POOL.read() as db:
+        for s in statements:
+            cur = await db.execute("EXPLAIN QUERY PLAN " + s)
+            out[s] = [r[3] for r in await cur.fetchall()]
+    return out
+
+
+def _bad(sql: str, detail: str) -> bool:
+    if "USE TEMP B-TREE" in detail:
+        return True
+    if not detail.startswith("SCAN"):
+        return False
+    # Обход индекса по порядку с LIMIT («последние 50») останавливается
+    # на LIMIT строк — это не чтение таблицы целиком
+    return not (" USING " in detail and "INDEX" in detail and " LIMIT " in sql.upper())
+
+
+HOT = [
+    lambda: main.db_get_pending_bookings(limit=1),
+    main.db_count_pending_bookings,
+    main.db_get_confirmed_booking_at,
+    lambda: main.db_get_confirmed_booking_at(1, "next"),
+    lambda: main.db_get_confirmed_booking_at(1, "prev"),
+    main.db_count_confirmed_bookings,
+    main.db_get_bookings_for_reminders,
+    lambda: main.db_get_pending_reviews(1),
+    main.db_count_pending_reviews,
+    main.db_get_approved_review_at,
+    lambda: main.db_get_approved_review_at(1, "next"),
+    lambda: main.db_get_approved_review_at(1, "prev"),
+    lambda: main.db_outbox_due(50),
+    main.db_outbox_next_at,
+    main.db_get_running_broadcasts,
+    lambda: main.db_get_broadcast_queue(1),
+    main.db_get_latest_users,
+]
+
+
+def test_hot_queries_use_indexes(run_db):
+    async def body():
+        statements = await _captured(HOT)
+        assert len(statements) >= len(HOT)
+        return await _plans(statements)
+
+    plans = run_db(body)
+    bad = {s.strip(): p for s, p in plans.items() if any(_bad(s, d) for d in p)}
+    assert not bad, "\n\n".join(f"{s}\n  -> {p}" for s, p in bad.items())
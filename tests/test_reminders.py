@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+import main
+
+
+def test_failed_enqueue_keeps_reminder(run_db, monkeypatch):
+    """Неудачная запись в outbox не должна съедать напоминание: ни в куче, ни через rebuild."""
+    monkeypatch.setattr(main, "REMINDERS", main.ReminderScheduler())
+    monkeypatch.setitem(main.REMINDER_SETTINGS, "r1", True)
+    enqueue = main.db_enqueue_reminders
+
+    async def body():
+        appt_ts = int(time.time()) + 3600 - 60          # «за 1 час» наступило минуту назад
+        async with main.POOL.write() as db:
+            await db.execute(
+                "INSERT INTO bookings (user_id,service_name,datetime_txt,appt_ts,dt_confidence,status,created_at) "
+                "VALUES(7,'s','t',?,2,'confirmed','2025-01-01')", (appt_ts,))
+        await main.REMINDERS.rebuild()
+
+        async def locked(items):
+            raise main.aiosqlite.OperationalError("database is locked")
+        monkeypatch.setattr(main, "db_enqueue_reminders", locked)
+        with pytest.raises(main.aiosqlite.OperationalError):
+            await main.REMINDERS._fire_due(None)
+        monkeypatch.setattr(main, "db_enqueue_reminders", enqueue)
+
+        await main.REMINDERS.rebuild()
+        await main.REMINDERS._fire_due(None)
+        async with main.POOL.read() as db:
+            cur = await db.execute("SELECT COUNT(*) FROM outbox WHERE kind='reminder'")
+            queued = (await cur.fetchone())[0]
+            cur = await db.execute("SELECT reminded_1 FROM bookings")
+            flag = (await cur.fetchone())[0]
+        return queued, flag
+
+    assert run_db(body) == (1, 1)
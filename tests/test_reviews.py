@@ -0,0 +1,20 @@
+import main
+
+
+def test_status_transitions_keep_stats_consistent(run_db):
+    async def body():
+        a = await main.db_add_review(1, "a", "A", 5, "text")
+        b = await main.db_add_review(2, "b", "B", 3, "text")
+        steps = [(a, "approved"), (a, "approved"), (b, "rejected"), (b, "approved"), (a, "rejected")]
+        for review_id, status in steps:
+            await main.db_set_review_status(review_id, status)
+        async with main.POOL.read() as db:
+            cur = await db.execute("SELECT id, status FROM reviews ORDER BY id")
+            statuses = await cur.fetchall()
+        stats = dict(main.REVIEW_STATS)
+        return statuses, stats, await main.db_rebuild_review_stats()
+
+    statuses, stats, drift = run_db(body)
+    assert [s for _, s in statuses] == ["rejected", "approved"]
+    assert {r: n for r, n in stats.items() if n} == {3: 1}
+    assert drift == {}
@@ -0,0 +1,34 @@
+"""Вебхук локально: aiohttp TestClient вместо Telegram, FakeSession вместо Bot API."""
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import bench
+import main
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def test_webhook(tmp_path):
+    async def body():
+        bot, dp, session = await bench.make_env(db_path=str(tmp_path / "webhook.db"))
+        client = TestClient(TestServer(main.build_webhook_app(dp, bot)))
+        await client.start_server()
+        try:
+            update = bench.msg_update(4242, "/start").model_dump(mode="json", exclude_none=True)
+            wrong  = await client.post(main.WEBHOOK_PATH, json=update, headers={SECRET_HEADER: "wrong"})
+            before = session.count("SendMessage")
+            ok     = await client.post(main.WEBHOOK_PATH, json=update,
+                                       headers={SECRET_HEADER: main.WEBHOOK_SECRET})
+            sent   = session.count("SendMessage") - before
+            health = await client.get("/healthz")
+            return wrong.status, ok.status, sent, health.status, await health.json()
+        finally:
+            await client.close()
+            await bench.close_env(dp)
+
+    wrong, ok, sent, health, payload = asyncio.run(body())
+    assert wrong == 401
+    assert ok == 200 and sent == 1      # /start обработан до ответа Telegram
+    assert health == 200 and payload["status"] == "ok"